@@ -1,9 +1,12 @@
 from django.contrib import admin
-from .models import ChatMessage, ChatSession, ReportCard, User, ChatBot
+from .models import ChatMessage, ChatSession, ReportCard, ReportJob, TurnScore, OpeningMessage, User, ChatBot
 
 admin.site.register(ChatMessage)
 admin.site.register(ChatSession)
 admin.site.register(ReportCard)
 admin.site.register(ChatBot)
+admin.site.register(ReportJob)
+admin.site.register(TurnScore)
+admin.site.register(OpeningMessage)
 
 admin.site.register(User)
@@ -0,0 +1,272 @@
+"""
+Async versions of the views that wait on the AI provider.
+
+Under ASGI these handlers await AsyncOpenAI and the async ORM instead of
+blocking a worker thread, so one process can hold many concurrent LLM calls.
+They are routed in place of the sync views when ASYNC_VIEWS is enabled (see
+api/urls.py); request/response shapes are identical.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.utils.html import escape
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import metrics
+from .chat_service import (
+    CHAT_ENDED_MESSAGE, MAX_USER_MESSAGES, build_context, canned_opener, format_bot_prompt,
+    pick_scenario, wants_to_end,
+)
+from .chat_views import (
+    ChatMessageView, ChatSessionView, ReportGenerationView, User, discard, event_stream_response, reply_data,
+)
+from .models import ChatBot, ChatMessage, ChatSession
+from .openers import pop_opener
+from .renderers import EventStreamRenderer, format_event
+from .report_jobs import await_report, on_chat_ended
+from .context_summary import schedule_summary
+from .conversation_cache import conversation_cache
+from .turn_scoring import schedule_turn_scoring
+from .resilience import BulkheadFull
+from .utils import LLMOverloaded, aget_ai_response, astream_ai_response
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines.
+
+    Authentication, permission and throttle checks (``initial``) may call
+    Supabase or the cache synchronously, so they run in a worker thread; the
+    handler itself runs on the event loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def same_schema_as(sync_handler):
+    """
+    Reuses the swagger_auto_schema of the sync handler an async one replaces.
+    """
+    def decorator(handler):
+        handler._swagger_auto_schema = getattr(sync_handler, "_swagger_auto_schema", None)
+        return handler
+    return decorator
+
+
+class AsyncChatSessionView(AsyncAPIView, ChatSessionView):
+
+    @same_schema_as(ChatSessionView.post)
+    async def post(self, request):
+        chat_session = None
+        try:
+            # Ensure the user is properly authenticated
+            if not isinstance(request.user, User):
+                return Response({"error": "User is not authenticated correctly"}, status=400)
+
+            # 1. Retrieve bot_id from the request data or query parameters
+            bot_id = request.data.get("bot_id") or request.query_params.get("bot_id")
+            if bot_id:
+                try:
+                    bot = await ChatBot.objects.aget(pk=bot_id)
+                except ChatBot.DoesNotExist:
+                    logger.error("Invalid bot_id provided, defaulting to first available ChatBot.")
+                    bot = await ChatBot.objects.afirst()
+            else:
+                bot = await ChatBot.objects.afirst()
+
+            if not bot:
+                logger.error("No ChatBot available in the system.")
+                return Response({"error": "No ChatBot available."}, status=500)
+
+            # 2. Create a new ChatSession and attach the selected ChatBot
+            chat_session = await ChatSession.objects.acreate(user=request.user, bot=bot)
+
+            # 3. Select a random scenario
+            selected_scenario = pick_scenario()
+            if not selected_scenario:
+                logger.error("No scenarios available to select.")
+                return Response({"error": "No scenarios available. Please contact support."}, status=500)
+
+            # 4. Format the prompt and save it as the system message
+            formatted_initial_prompt = format_bot_prompt(bot, selected_scenario)
+            await ChatMessage.objects.acreate(
+                session=chat_session,
+                sender="system",
+                content=formatted_initial_prompt
+            )
+
+            # 5. Get and save a pooled opener, or the AI response to the initial prompt
+            ai_response = await sync_to_async(pop_opener)(bot, formatted_initial_prompt)
+            if ai_response is None:
+                try:
+                    ai_response = await aget_ai_response([{"role": "system", "content": formatted_initial_prompt}])
+                except BulkheadFull:
+                    metrics.incr("chat.canned_openers")
+                    ai_response = canned_opener(selected_scenario)
+            ai_msg = await ChatMessage.objects.acreate(
+                session=chat_session,
+                sender="assistant",
+                content=ai_response
+            )
+
+            return Response({
+                "message": "Chat session created successfully",
+                "session_id": chat_session.id,
+                "ai_response": ai_msg.content,
+                "custom_scenario": selected_scenario
+            }, status=201)
+
+        except Exception as e:
+            logger.exception(f"Error creating chat session: {e}")
+            if chat_session is not None:
+                await sync_to_async(discard)(chat_session)
+            return Response({
+                "message": f"Chat session not created due to error | {e}",
+                "session_id": None,
+                "ai_response": None
+            }, status=500)
+
+
+class AsyncChatMessageView(AsyncAPIView, ChatMessageView):
+
+    @same_schema_as(ChatMessageView.post)
+    async def post(self, request, session_id):
+        user_msg = ai_msg = None
+        try:
+            user_message = request.data.get("message")
+            if not user_message:
+                return Response(
+                    {"error": "Missing 'message' in request"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # Sanitize the user message
+            user_message = escape(user_message)
+
+            session = await ChatSession.objects.filter(id=session_id).afirst()
+            if not session:
+                return Response(
+                    {"error": "Chat session not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            user_msg = await ChatMessage.objects.acreate(
+                session=session, sender="user", content=user_message
+            )
+            conversation = await sync_to_async(conversation_cache.append)(session, user_msg)
+
+            chat_ended = wants_to_end(user_message)
+            user_message_count = conversation.user_count
+            if user_message_count >= MAX_USER_MESSAGES:
+                chat_ended = True
+
+            if not chat_ended:
+                messages = build_context(conversation.system_contents, conversation.history, conversation.summary)
+                schedule_summary(session, conversation.history)
+
+                if request.accepted_renderer.format == EventStreamRenderer.format:
+                    return event_stream_response(
+                        self.astream_reply(session, user_msg, messages, user_message_count)
+                    )
+
+                ai_response = await aget_ai_response(messages)
+            else:
+                ai_response = CHAT_ENDED_MESSAGE
+
+            ai_msg = await ChatMessage.objects.acreate(
+                session=session, sender="assistant", content=ai_response
+            )
+            if not chat_ended:
+                schedule_turn_scoring(user_msg)
+            await sync_to_async(conversation_cache.append)(session, ai_msg)
+            if chat_ended:
+                await sync_to_async(on_chat_ended)(session, request.user)
+
+            return Response(
+                reply_data(user_msg, ai_msg, chat_ended, user_message_count), status=status.HTTP_200_OK
+            )
+
+        except BulkheadFull:
+            await sync_to_async(discard)(user_msg)
+            raise LLMOverloaded()
+        except Exception as e:
+            logger.exception(f"Error handling chat message: {e}")
+            if user_msg is not None and ai_msg is None:
+                await sync_to_async(discard)(user_msg)
+            return Response(
+                {"error": "Internal server error"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    async def astream_reply(self, session, user_msg, messages, user_message_count):
+        """
+        Async variant of ChatMessageView.stream_reply.
+        """
+        chunks = []
+        shed = False
+        try:
+            async for chunk in astream_ai_response(messages):
+                chunks.append(chunk)
+                yield format_event("token", {"content": chunk})
+        except BulkheadFull:
+            shed = True
+        finally:
+            if not shed:
+                ai_msg = await ChatMessage.objects.acreate(
+                    session=session, sender="assistant", content="".join(chunks)
+                )
+                schedule_turn_scoring(user_msg)
+                await sync_to_async(conversation_cache.append)(session, ai_msg)
+        if shed:
+            await sync_to_async(discard)(user_msg)
+            yield format_event("error", {"error": LLMOverloaded.default_detail})
+            return
+        yield format_event("done", reply_data(user_msg, ai_msg, False, user_message_count))
+
+
+class AsyncReportGenerationView(AsyncAPIView, ReportGenerationView):
+
+    @same_schema_as(ReportGenerationView.get)
+    async def get(self, request, session_id):
+        try:
+            wait = self.get_wait(request)
+        except ValueError:
+            return Response(
+                {"error": "'wait' must be a number of seconds"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Only a few queries and an enqueue; the evaluation runs in the report
+        # worker. Waiting for it happens on the event loop, not in a thread.
+        response = await sync_to_async(self.report_or_enqueue)(request, session_id)
+        if response.status_code == status.HTTP_202_ACCEPTED and wait:
+            if await await_report(session_id, wait):
+                response = await sync_to_async(self.report_or_enqueue)(request, session_id)
+        return response
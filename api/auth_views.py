@@ -8,20 +8,24 @@ from django.conf import settings
 from drf_yasg.utils import swagger_auto_schema
 import json
 from drf_yasg import openapi
-from dotenv import load_dotenv
 import logging
-from supabase import create_client, Client
 from django.conf import settings
+from gotrue.errors import AuthRetryableError
+from .resilience import ResilienceError
+from .supabase_auth import LazyAuthenticationMixin, call_supabase_auth
+from .clients import get_supabase_client
+from .throttling import TokenBucketThrottle
 
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
 
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+SUPABASE_UNAVAILABLE_RESPONSE = {"error": "Authentication service temporarily unavailable. Please try again shortly."}
 
-class SupabaseGuestLoginView(APIView):
+class SupabaseGuestLoginView(LazyAuthenticationMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = "auth_guest"
 
     @swagger_auto_schema(
         operation_summary="Anonymous Login via Supabase",
@@ -32,17 +36,22 @@ class SupabaseGuestLoginView(APIView):
     )
     def post(self, request):
         try:
-            data = supabase.auth.sign_in_anonymously()
+            data = call_supabase_auth(get_supabase_client().auth.sign_in_anonymously)
             data=json.loads(data.model_dump_json())
             # The response structure may vary; adjust as needed.
             return Response(data, status=status.HTTP_200_OK)
+        except (ResilienceError, AuthRetryableError) as e:
+            logger.error(f"Anonymous login failed, Supabase unavailable: {e}")
+            return Response(SUPABASE_UNAVAILABLE_RESPONSE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.error(f"Anonymous login failed: {e}")
             return Response({"error": "Anonymous login failed"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class SupabaseLoginView(APIView):
+class SupabaseLoginView(LazyAuthenticationMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = "auth_login"
 
     @swagger_auto_schema(
         operation_summary="Login via Supabase",
@@ -69,11 +78,14 @@ class SupabaseLoginView(APIView):
 
             try:
                 # Use the Supabase SDK to sign in with email and password.
-                data = supabase.auth.sign_in_with_password({
+                data = call_supabase_auth(get_supabase_client().auth.sign_in_with_password, {
                     "email": email,
                     "password": password,
                 })
                 data=json.loads(data.model_dump_json())
+            except (ResilienceError, AuthRetryableError) as e:
+                logger.error(f"Login failed, Supabase unavailable: {e}")
+                return Response(SUPABASE_UNAVAILABLE_RESPONSE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             except Exception as e:
                 logger.error(f"Error during login: {e}")
                 return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
@@ -88,8 +100,10 @@ class SupabaseLoginView(APIView):
             return Response({"message": "Error while login", "data": None}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class SupabaseRegisterView(APIView):
+class SupabaseRegisterView(LazyAuthenticationMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = "auth_register"
 
     @swagger_auto_schema(
         operation_summary="Register a new user via Supabase",
@@ -117,7 +131,7 @@ class SupabaseRegisterView(APIView):
 
 
             # Use the Supabase SDK to sign up the user.
-            data = supabase.auth.sign_up({
+            data = call_supabase_auth(get_supabase_client().auth.sign_up, {
                 "email": email,
                 "password": password
             })
@@ -130,6 +144,9 @@ class SupabaseRegisterView(APIView):
                 return Response({"error": error_message}, status=status.HTTP_409_CONFLICT)
 
             return Response({"message": "User registered successfully", "data": data}, status=status.HTTP_201_CREATED)
+        except (ResilienceError, AuthRetryableError) as e:
+            logger.error(f"Signup failed, Supabase unavailable: {e}")
+            return Response(SUPABASE_UNAVAILABLE_RESPONSE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.exception("Failed to signup")
             if "User already registered" in str(e):
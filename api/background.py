@@ -0,0 +1,55 @@
+"""
+In-process thread pool for fire-and-forget work that must not delay a response,
+such as scoring a chat turn.
+
+Tasks are best effort: anything still queued when the process exits is lost, so
+callers must be able to redo the work later (see turn_scoring.evaluate_incrementally).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix="background"
+                )
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs ``fn(*args, **kwargs)`` in the background pool. Exceptions are logged
+    and counted, never raised to the caller.
+    """
+    metrics.incr("background.submitted")
+    return get_executor().submit(_run, fn, args, kwargs)
+
+
+def _run(fn, args, kwargs):
+    name = getattr(fn, "__name__", repr(fn))
+    started = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Background task {name} failed")
+        metrics.incr("background.failed")
+    finally:
+        metrics.observe(f"background.{name}.seconds", time.perf_counter() - started)
+        # Pool threads are not requests, so nothing else closes their connection.
+        connection.close()
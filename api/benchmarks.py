@@ -0,0 +1,341 @@
+"""
+Benchmark suite run by ``manage.py run_benchmarks``.
+
+Each benchmark is a function registered with ``@benchmark(name)`` that returns
+a flat dict of results; values that are durations are reported in seconds.
+Benchmarks registered with ``uses_test_db=True`` create and drop a test database
+on the configured server and only run with ``--use-test-db``.
+"""
+import asyncio
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.urls import reverse
+
+BENCHMARKS = {}
+
+# What a worker does before it can serve its first request.
+COLD_START_SNIPPET = (
+    "import time; started = time.perf_counter(); "
+    "import django; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def benchmark(name, uses_test_db=False):
+    def register(fn):
+        fn.uses_test_db = uses_test_db
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples),
+    }
+
+
+@benchmark("cold_start")
+def cold_start(repeat=5):
+    """
+    Time from interpreter start to a loaded URLconf, measured in fresh processes.
+    """
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", COLD_START_SNIPPET],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return summarize(samples)
+
+
+@benchmark("rate_limiter")
+def rate_limiter(repeat=5, calls=2000):
+    """
+    Per-request cost of TokenBucketThrottle.allow_request against the configured cache.
+    """
+    from django.test import RequestFactory, override_settings
+
+    from .throttling import TokenBucketThrottle
+
+    class View:
+        throttle_scope = "benchmark"
+        headers = {}
+
+    request = RequestFactory().get("/", REMOTE_ADDR="203.0.113.7")
+    samples = []
+    with override_settings(RATE_LIMITS={"benchmark": f"{calls * repeat * 10}/s"}):
+        for _ in range(repeat):
+            throttle = TokenBucketThrottle()
+            started = time.perf_counter()
+            for _ in range(calls):
+                throttle.allow_request(request, View)
+            samples.append((time.perf_counter() - started) / calls)
+    return summarize(samples)
+
+
+class StubCompletions:
+    """
+    Stands in for ``client.chat.completions`` with a fixed provider latency and
+    records how many calls were waiting at once.
+    """
+
+    def __init__(self, latency, is_async, reply="stub reply"):
+        self.latency = latency
+        self.is_async = is_async
+        self.reply = reply
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _response(self):
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def create(self, **kwargs):
+        if self.is_async:
+            return self._acreate()
+        self._enter()
+        try:
+            time.sleep(self.latency)
+        finally:
+            self._exit()
+        return self._response()
+
+    async def _acreate(self):
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self._exit()
+        return self._response()
+
+
+def stub_llm_client(completions):
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+@benchmark("llm_concurrency")
+def llm_concurrency(repeat=5, sessions=100, latency=0.2, wsgi_threads=8):
+    """
+    Concurrent chat sessions waiting on the AI provider, served by a WSGI
+    worker (a fixed pool of ``wsgi_threads`` threads calling get_ai_response)
+    versus one ASGI event loop (aget_ai_response). The provider is stubbed with
+    ``latency`` seconds per call, so only the serving model is measured.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from . import clients
+    from .utils import aget_ai_response, get_ai_response, llm_bulkhead
+
+    # Distinct per session, so the calls are not coalesced (see utils.llm_calls).
+    messages = [[{"role": "user", "content": f"hi from session {number}"}] for number in range(sessions)]
+    results = {"sessions": sessions, "provider_latency": float(latency), "wsgi_threads": wsgi_threads}
+    saved = dict(clients._instances)
+    saved_limit = llm_bulkhead.max_concurrent
+    # Measure the serving model, not the bulkhead.
+    llm_bulkhead.max_concurrent = sessions
+    # get_ai_response logs every call at error level.
+    logging.disable(logging.ERROR)
+    try:
+        for model in ("wsgi", "asgi"):
+            completions = StubCompletions(latency, is_async=model == "asgi")
+            clients._instances["llm"] = clients._instances["async_llm"] = stub_llm_client(completions)
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if model == "wsgi":
+                    with ThreadPoolExecutor(max_workers=wsgi_threads) as pool:
+                        list(pool.map(get_ai_response, messages))
+                else:
+                    async def serve():
+                        await asyncio.gather(*(aget_ai_response(session) for session in messages))
+                    asyncio.run(serve())
+                samples.append(time.perf_counter() - started)
+            elapsed = statistics.median(samples)
+            results[f"{model}_seconds"] = elapsed
+            results[f"{model}_sessions_per_second"] = sessions / elapsed
+            results[f"{model}_peak_in_flight"] = completions.peak_in_flight
+    finally:
+        logging.disable(logging.NOTSET)
+        llm_bulkhead.max_concurrent = saved_limit
+        clients._instances.clear()
+        clients._instances.update(saved)
+    return results
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Runs the block against a freshly created test database, dropped afterwards,
+    for benchmarks that go through real views and tables. This clobbers
+    ``test_<NAME>`` on the configured database server; see ``uses_test_db``.
+    """
+    from django.db import connection
+
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@benchmark("time_to_report", uses_test_db=True)
+def time_to_report(repeat=5, provider_latency=1.0, think_time=0.5, poll_interval=0.25):
+    """
+    Time from the chat-ending message to the report being visible, for a client
+    that asks for it ``think_time`` seconds later and then polls the report card.
+    Compares generation queued on the first generate-report call (on_demand)
+    with generation queued at chat end (speculative, SPECULATIVE_REPORTS).
+    A report worker runs in a background thread; the provider is stubbed with
+    ``provider_latency`` seconds per call.
+    """
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    from . import clients
+    from .models import ChatMessage, ChatSession, User
+    from .report_jobs import ReportWorker
+
+    evaluation = json.dumps({"engagement_score": 6, "humor_score": 4, "empathy_score": 8, "feedback": "Nice"})
+    results = {"provider_latency": float(provider_latency), "think_time": float(think_time)}
+    saved = dict(clients._instances)
+    clients._instances["llm"] = stub_llm_client(StubCompletions(provider_latency, is_async=False, reply=evaluation))
+    logging.disable(logging.ERROR)
+    try:
+        with throwaway_database(), override_settings(ALLOWED_HOSTS=["testserver"], RATE_LIMITS={}):
+            user = User.objects.create(email="benchmark@example.com")
+            client = APIClient()
+            client.force_authenticate(user)
+            worker = ReportWorker(concurrency=2, poll_interval=0.1)
+            thread = threading.Thread(target=worker.run, daemon=True)
+            thread.start()
+            try:
+                for mode, speculative in (("on_demand", False), ("speculative", True)):
+                    samples = []
+                    with override_settings(SPECULATIVE_REPORTS=speculative):
+                        for _ in range(repeat):
+                            session = ChatSession.objects.create(user=user)
+                            ChatMessage.objects.create(session=session, sender="system", content="You are Sam.")
+                            started = time.perf_counter()
+                            client.post(
+                                reverse("chat_messages", args=[session.id]), {"message": "end chat"}, format="json"
+                            )
+                            time.sleep(think_time)
+                            response = client.get(reverse("generate_report", args=[session.id]))
+                            while response.status_code == 202:
+                                time.sleep(poll_interval)
+                                response = client.get(reverse("reportcard-detail", args=[session.id]))
+                            samples.append(time.perf_counter() - started)
+                    results[f"{mode}_seconds"] = statistics.median(samples)
+            finally:
+                worker.stop()
+                thread.join()
+    finally:
+        logging.disable(logging.NOTSET)
+        clients._instances.clear()
+        clients._instances.update(saved)
+    return results
+
+
+@benchmark("prescoring")
+def prescoring(repeat=5):
+    """
+    Lesson answers failed by course_content.prescoring instead of the AI
+    evaluator, over the labelled answers in prescoring_samples.json.
+    ``outcome_changes`` counts answers it failed that the evaluator passed and
+    should stay 0; ``seconds_per_answer`` is the cost of running the rules.
+    """
+    from pathlib import Path
+
+    from course_content.evaluation import is_empty_response
+    from course_content.models import Lesson
+    from course_content.prescoring import prescore
+
+    samples_path = Path(settings.BASE_DIR) / "course_content" / "prescoring_samples.json"
+    samples = json.loads(samples_path.read_text())
+    lessons = {name: Lesson(**fields) for name, fields in samples["lessons"].items()}
+    answers = [
+        (lessons[answer["lesson"]], answer["response"], answer["time_taken"], answer["passed"])
+        for answer in samples["answers"]
+        if not is_empty_response(answer["response"])
+    ]
+
+    failed = [(passed, prescore(lesson, response, time_taken)) for lesson, response, time_taken, passed in answers]
+    prescored = sum(1 for _, feedback in failed if feedback)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for lesson, response, time_taken, _ in answers:
+            prescore(lesson, response, time_taken)
+        timings.append((time.perf_counter() - started) / len(answers))
+    return {
+        "answers": len(samples["answers"]),
+        "past_empty_check": len(answers),
+        "llm_calls_avoided": prescored,
+        "avoided_ratio": prescored / len(answers),
+        "outcome_changes": sum(1 for passed, feedback in failed if passed and feedback),
+        "seconds_per_answer": statistics.median(timings),
+    }
+
+
+@benchmark("structured_output")
+def structured_output(repeat=5, parses=2000):
+    """
+    Per-reply cost of parsing the report evaluation (utils.REPORT_OUTPUT) for
+    the reply shapes seen from the provider: plain JSON, JSON in a code fence
+    with prose around it, and the older markdown format.
+    """
+    from .utils import REPORT_OUTPUT
+
+    replies = {
+        "json": '{"engagement_score": 72, "humor_score": 55, "empathy_score": 80, "feedback": "Warm and curious."}',
+        "fenced": (
+            'Here is the evaluation:\n```json\n{"engagement_score": 72, "humor_score": 55, '
+            '"empathy_score": 80, "feedback": "Warm and curious."}\n```'
+        ),
+        "markdown": (
+            "### **Engagement Score: 72/100**\n**Explanation:** Asked good questions.\n---\n"
+            "### **Humor Score: 55/100**\n**Explanation:** A few light jokes.\n---\n"
+            "### **Empathy Score: 80/100**\n**Explanation:** Listened well.\n---\n"
+            "**Feedback:** Warm and curious."
+        ),
+    }
+    results = {}
+    for shape, reply in replies.items():
+        REPORT_OUTPUT.parse(reply)
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(parses):
+                REPORT_OUTPUT.parse(reply)
+            samples.append((time.perf_counter() - started) / parses)
+        results[f"{shape}_seconds"] = statistics.median(samples)
+    return results
@@ -0,0 +1,188 @@
+"""
+Chat steps shared by the sync views in chat_views and the async ones in async_views.
+Nothing here touches the database or the AI provider.
+"""
+import json
+import logging
+import os
+import random
+from functools import lru_cache
+
+from django.conf import settings
+
+from . import metrics
+
+try:
+    import tiktoken
+except ImportError:  # In requirements.txt; token counts are estimated without it.
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Load scenarios from a JSON file or a predefined list
+try:
+    with open(settings.SCENARIOS_FILE_PATH, 'r') as file:
+        SCENARIOS = json.load(file)
+        logger.info(f"Loaded {len(SCENARIOS)} scenarios from scenarios.json.")
+except FileNotFoundError:
+    logger.error(f"scenarios.json file not found at {settings.SCENARIOS_FILE_PATH}.")
+    SCENARIOS = []
+except json.JSONDecodeError as e:
+    logger.error(f"Error decoding JSON from scenarios.json: {e}")
+    SCENARIOS = []
+
+CLIENT_URL = os.getenv("CLIENT_URL", "https://socialflow.skdev.one")
+MAX_USER_MESSAGES = 10
+CHAT_ENDED_MESSAGE = "Chat has ended. You can now view your report."
+
+
+def pick_scenario():
+    """
+    Returns a random scenario, or None if none are loaded.
+    """
+    if not SCENARIOS:
+        return None
+    return random.choice(SCENARIOS)
+
+
+def format_bot_prompt(bot, scenario):
+    return bot.prompt.format(
+        name=scenario["ai_name"],
+        custom_role=scenario["ai_role"]
+    )
+
+
+def canned_opener(scenario):
+    """
+    Opening line used when the AI provider is too busy to write one.
+    """
+    return f"Hi, I'm {scenario['ai_name']}! How's your day going?"
+
+
+def wants_to_end(user_message):
+    lower_message = user_message.lower()
+    return "end chat" in lower_message or "end this chat" in lower_message
+
+
+# Tokens the chat format adds to every message on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    The tokenizer for AI_MODEL. Loaded once from ApiConfig.ready, so the
+    encoding files are read (or downloaded) at startup rather than during the
+    first request.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(os.getenv("AI_MODEL", ""))
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # The encoding files are downloaded when missing from the local cache.
+        logger.warning(f"tiktoken unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of ``text`` with tiktoken. Without it the count is
+    estimated at three UTF-8 bytes per token, which overcounts English (about
+    four characters per token) so the context stays under budget, and still
+    holds for scripts that take one token per character.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def message_tokens(message):
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def history_tokens(history):
+    return sum(count_tokens(content) + MESSAGE_OVERHEAD_TOKENS for _, content in history)
+
+
+def build_context(system_contents, history, summary=""):
+    """
+    Builds the AI context from the session's system messages, the rolling
+    summary of the turns already compacted (see api.context_summary) and the
+    (sender, content) history since then, ordered by time.
+
+    The system prompt and the summary are always kept; the newest messages are
+    added until CHAT_CONTEXT_TOKENS is reached, and the latest one always is.
+    """
+    prefix = []
+    system_msg = " ".join(system_contents)
+    if system_msg:
+        prefix.append({"role": "system", "content": system_msg})
+    if summary:
+        prefix.append({"role": "system", "content": f"Summary of the conversation so far: {summary}"})
+
+    budget = settings.CHAT_CONTEXT_TOKENS - sum(message_tokens(message) for message in prefix)
+    recent = []
+    for sender, content in reversed(history):
+        message = {"role": sender, "content": content}
+        budget -= message_tokens(message)
+        if budget < 0 and recent:
+            break
+        recent.append(message)
+    recent.reverse()
+    messages = prefix + recent
+    metrics.observe("chat.context_tokens", sum(message_tokens(message) for message in messages))
+    return messages
+
+
+def needs_summary(history):
+    """
+    Whether the history since the last summary has grown past
+    CHAT_SUMMARY_TRIGGER_TOKENS and older turns should be compacted.
+    """
+    return history_tokens(history) > settings.CHAT_SUMMARY_TRIGGER_TOKENS
+
+
+def split_for_summary(history):
+    """
+    Splits (id, sender, content) history into the older messages to compact and
+    the newest ones to keep verbatim, which fit in half of
+    CHAT_SUMMARY_TRIGGER_TOKENS.
+
+    Returns:
+        tuple: (older, recent)
+    """
+    keep = settings.CHAT_SUMMARY_TRIGGER_TOKENS // 2
+    split = len(history)
+    while split > 0:
+        keep -= count_tokens(history[split - 1][2]) + MESSAGE_OVERHEAD_TOKENS
+        if keep < 0:
+            break
+        split -= 1
+    return history[:split], history[split:]
+
+
+def report_response_data(report_card, feedback, unlocked_cat, unlocked_sub, unlocked_lesson, session_id):
+    return {
+        "engagement_score": report_card.engagement_score,
+        "humor_score": report_card.humor_score,
+        "empathy_score": report_card.empathy_score,
+        "total_score": report_card.total_score,
+        "feedback_summary": feedback,
+        "feedback": feedback,
+        "unlocked_content": True if unlocked_cat or unlocked_sub or unlocked_lesson else False,
+        "report_link": f"{CLIENT_URL}/report-cards/{session_id}"
+    }
+
+
+def report_job_data(job, report_card_url, session_id):
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "report_card_url": report_card_url,
+        "report_link": f"{CLIENT_URL}/report-cards/{session_id}"
+    }
@@ -1,50 +1,85 @@
-from .utils import get_ai_response, process_evaluation
-from .models import User, ChatSession, ChatMessage, ReportCard, ChatBot
+from . import metrics
+from .utils import LLMOverloaded, get_ai_response, stream_ai_response
+from .resilience import BulkheadFull
+from .report_jobs import enqueue_report, on_chat_ended, wait_for_report
+from .turn_scoring import schedule_turn_scoring
+from .context_summary import schedule_summary
+from .conversation_cache import conversation_cache
+from .openers import pop_opener
+from .supabase_auth import LazyAuthenticationMixin
+from .throttling import TokenBucketThrottle
+from .renderers import EventStreamRenderer, format_event
+from .chat_service import (
+    CHAT_ENDED_MESSAGE, MAX_USER_MESSAGES, build_context, canned_opener, format_bot_prompt,
+    pick_scenario, report_job_data, report_response_data, wants_to_end,
+)
+from .models import User, ChatSession, ChatMessage, ReportCard, ReportJob, ChatBot
 from .serializers import UserSerializer, ChatSessionSerializer, ChatMessageSerializer, ReportCardSerializer, ChatBotListSerializer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from django.http import StreamingHttpResponse
+from django.urls import reverse
 from django.contrib.auth import get_user_model
 from drf_yasg.utils import swagger_auto_schema
-import random
 from drf_yasg import openapi
 from django.conf import settings
-import json
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 import os
-from dotenv import load_dotenv
 from django.utils.html import escape
 from django.db import transaction
 from rest_framework import status
 
 
 
-load_dotenv()
 import logging
 
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
-# Load scenarios from a JSON file or a predefined list
-try:
-    with open(settings.SCENARIOS_FILE_PATH, 'r') as file:
-        SCENARIOS = json.load(file)
-        logger.info(f"Loaded {len(SCENARIOS)} scenarios from scenarios.json.")
-except FileNotFoundError:
-    logger.error(f"scenarios.json file not found at {settings.SCENARIOS_FILE_PATH}.")
-    SCENARIOS = []
-except json.JSONDecodeError as e:
-    logger.error(f"Error decoding JSON from scenarios.json: {e}")
-    SCENARIOS = []
-
 INITIAL_PROMPT = os.getenv('INITIAL_PROMPT_V2', "Welcome! Let's start chatting.")
 EVALUATION_PROMPT = os.getenv('EVALUATION_PROMPT', "Welcome! Let's start chatting.")
-CLIENT_URL = os.getenv("CLIENT_URL", "https://socialflow.skdev.one")
-MAX_MESSAGES = 20
 
 
 
-class ChatBotListView(APIView):
+def discard(instance):
+    """
+    Compensating delete for a row committed by a chat step that then failed,
+    e.g. the user message of a turn the AI never answered, so the transcript
+    stays consistent and a retry does not store it twice.
+    """
+    try:
+        instance.delete()
+        if isinstance(instance, ChatMessage):
+            conversation_cache.invalidate(instance.session_id)
+    except Exception as e:
+        logger.error(f"Could not discard {instance._meta.model_name} {instance.pk}: {e}")
+
+
+def reply_data(user_msg, ai_msg, chat_ended, message_count):
+    """
+    Body of a chat message reply, also sent as the ``done`` event of a stream.
+    """
+    return {
+        "user_message": user_msg.content,
+        "ai_response": ai_msg.content,
+        "chat_ended": chat_ended,
+        "message_count": message_count
+    }
+
+
+def event_stream_response(events):
+    """
+    Streams the SSE ``events`` unbuffered, past any proxy.
+    """
+    response = StreamingHttpResponse(events, content_type=EventStreamRenderer.media_type)
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class ChatBotListView(LazyAuthenticationMixin, APIView):
     # Adjust permission_classes as needed (e.g., IsAuthenticated)
     permission_classes = []
 
@@ -57,7 +92,7 @@ class ChatBotListView(APIView):
         bots = ChatBot.objects.all()
         serializer = ChatBotListSerializer(bots, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
-class ChatSessionView(APIView):
+class ChatSessionView(LazyAuthenticationMixin, APIView):
     """
     API to create a new chat session.
     """
@@ -99,6 +134,7 @@ class ChatSessionView(APIView):
         }
     )
     def post(self, request):
+        chat_session = None
         try:
             # Ensure the user is properly authenticated
             if not isinstance(request.user, User):
@@ -123,17 +159,13 @@ class ChatSessionView(APIView):
             chat_session = ChatSession.objects.create(user=request.user, bot=bot)
 
             # 3. Select a random scenario
-            if not SCENARIOS:
+            selected_scenario = pick_scenario()
+            if not selected_scenario:
                 logger.error("No scenarios available to select.")
                 return Response({"error": "No scenarios available. Please contact support."}, status=500)
 
-            selected_scenario = random.choice(SCENARIOS)
-
             # 4. Format the prompt using the selected bot's prompt instead of INITIAL_PROMPT
-            formatted_initial_prompt = bot.prompt.format(
-                name=selected_scenario["ai_name"],
-                custom_role=selected_scenario["ai_role"]
-            )
+            formatted_initial_prompt = format_bot_prompt(bot, selected_scenario)
 
             # 5. Save the formatted system message with the custom scenario
             system_message = ChatMessage.objects.create(
@@ -145,8 +177,16 @@ class ChatSessionView(APIView):
             # 6. Prepare messages for the AI (including the formatted system message)
             messages = [{"role": "system", "content": formatted_initial_prompt}]
 
-            # 7. Get AI response to the initial prompt
-            ai_response = get_ai_response(messages)
+            # 7. Take a pre-generated opener for this prompt (see openers). Only
+            # if the pool is empty, get the AI response to the initial prompt,
+            # or a canned opener when the AI provider is saturated
+            ai_response = pop_opener(bot, formatted_initial_prompt)
+            if ai_response is None:
+                try:
+                    ai_response = get_ai_response(messages)
+                except BulkheadFull:
+                    metrics.incr("chat.canned_openers")
+                    ai_response = canned_opener(selected_scenario)
 
             # 8. Save the AI response
             ai_msg = ChatMessage.objects.create(
@@ -164,6 +204,8 @@ class ChatSessionView(APIView):
 
         except Exception as e:
             logger.exception(f"Error creating chat session: {e}")
+            if chat_session is not None:
+                discard(chat_session)
             return Response({
                 "message": f"Chat session not created due to error | {e}",
                 "session_id": None,
@@ -171,12 +213,24 @@ class ChatSessionView(APIView):
             }, status=500)
 
 
-class ChatMessageView(APIView):
+class ChatMessageView(LazyAuthenticationMixin, APIView):
+    """
+    Sends a user message and returns the AI reply. Clients sending
+    ``Accept: text/event-stream`` get the reply streamed as ``token`` events,
+    followed by a ``done`` event carrying the regular JSON body.
+    """
     permission_classes = [IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = "chat_message"
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer]
 
     @swagger_auto_schema(
         operation_summary="Send a message in a chat session",
-        operation_description="Sends a user message to the chat session and gets an AI response.",
+        operation_description=(
+            "Sends a user message to the chat session and gets an AI response. "
+            "With 'Accept: text/event-stream' the response is streamed as Server-Sent Events: "
+            "'token' events with {content}, then a 'done' event with the JSON body below."
+        ),
         manual_parameters=[
             openapi.Parameter(
                 name="session_id",
@@ -234,8 +288,8 @@ class ChatMessageView(APIView):
         },
         security=[{"Bearer": []}]
     )
-    @transaction.atomic
     def post(self, request, session_id):
+        user_msg = ai_msg = None
         try:
             data = request.data
             user_message = data.get("message")
@@ -248,87 +302,123 @@ class ChatMessageView(APIView):
             # Sanitize the user message
             user_message = escape(user_message)
 
-            # Retrieve the chat session for the current user
-            session = ChatSession.objects.filter(id=session_id).first()
-            if not session:
-                return Response(
-                    {"error": "Chat session not found"},
-                    status=status.HTTP_404_NOT_FOUND
+            # Short write transaction: store the user message and read the
+            # context. It is committed before the AI provider is called, so no
+            # transaction (or row lock) is held for the length of the LLM call.
+            with transaction.atomic():
+                session = ChatSession.objects.filter(id=session_id).first()
+                if not session:
+                    return Response(
+                        {"error": "Chat session not found"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+
+                user_msg = ChatMessage.objects.create(
+                    session=session, sender="user", content=user_message
                 )
+                # Cached context of the session, including the new message
+                conversation = conversation_cache.append(session, user_msg)
+
+                # Check if the chat should end
+                chat_ended = wants_to_end(user_message)
+
+                # Get the current message count
+                user_message_count = conversation.user_count
+
+                # Check if we've reached the maximum number of messages
+                if user_message_count >= MAX_USER_MESSAGES:
+                    chat_ended = True
+
+                if chat_ended:
+                    # If chat has ended, create a simple closing message and
+                    # start the evaluation (see report_jobs.on_chat_ended)
+                    ai_msg = ChatMessage.objects.create(
+                        session=session, sender="assistant", content=CHAT_ENDED_MESSAGE
+                    )
+                    conversation_cache.append(session, ai_msg)
+                    on_chat_ended(session, request.user)
+                else:
+                    # Gather context for AI response: system messages, the rolling
+                    # summary and the turns since (see context_summary)
+                    messages = build_context(conversation.system_contents, conversation.history, conversation.summary)
 
-            # Save the user message
-            user_msg = ChatMessage.objects.create(
-                session=session, sender="user", content=user_message
-            )
-
-            # Check if the chat should end
-            lower_message = user_message.lower()
-            chat_ended = "end chat" in lower_message or "end this chat" in lower_message
-
-            # Get the current message count
-            user_message_count = session.messages.filter(sender="user").count()
-            
-            # Check if we've reached the maximum number of messages
-            if user_message_count >= 10:
-                chat_ended = True
-
-            # Only generate AI response if the chat hasn't ended
-            ai_response = ""
             if not chat_ended:
-                # Gather context for AI response
-                system_qs = session.messages.filter(sender="system")
-                system_msg = (
-                    " ".join(system_qs.values_list("content", flat=True))
-                    if system_qs.exists() else ""
-                )
+                # The message is committed, so the background task can read it
+                schedule_summary(session, conversation.history)
 
-                # Retrieve messages (user and assistant) ordered by creation time
-                ai_msgs_qs = session.messages.filter(sender__in=["user", "assistant"]).order_by("timestamp")
-                messages = [
-                    {"role": msg.sender, "content": msg.content}
-                    for msg in ai_msgs_qs
-                ]
-                # Prepend system message if it exists
-                if system_msg:
-                    messages.insert(0, {"role": "system", "content": system_msg})
-                # Limit context to the last MAX_MESSAGES if needed
-                if len(messages) > MAX_MESSAGES:
-                    messages = messages[-MAX_MESSAGES:]
+                if request.accepted_renderer.format == EventStreamRenderer.format:
+                    return event_stream_response(
+                        self.stream_reply(session, user_msg, messages, user_message_count)
+                    )
 
                 # Get AI response based on the conversation context
                 ai_response = get_ai_response(messages)
                 ai_msg = ChatMessage.objects.create(
                     session=session, sender="assistant", content=ai_response
                 )
-            else:
-                # If chat has ended, create a simple closing message
-                ai_response = "Chat has ended. You can now view your report."
-                ai_msg = ChatMessage.objects.create(
-                    session=session, sender="assistant", content=ai_response
-                )
+                # Only answered turns are scored: a discarded one would stay in
+                # the session totals.
+                schedule_turn_scoring(user_msg)
+                conversation_cache.append(session, ai_msg)
 
             # Return the response with chat_ended flag
-            return Response({
-                "user_message": user_msg.content,
-                "ai_response": ai_msg.content,
-                "chat_ended": chat_ended,
-                "message_count": user_message_count
-            }, status=status.HTTP_200_OK)
+            return Response(
+                reply_data(user_msg, ai_msg, chat_ended, user_message_count), status=status.HTTP_200_OK
+            )
 
+        except BulkheadFull:
+            discard(user_msg)
+            raise LLMOverloaded()
         except Exception as e:
             logger.exception(f"Error handling chat message: {e}")
-            transaction.set_rollback(True)
+            if user_msg is not None and ai_msg is None:
+                discard(user_msg)
             return Response(
                 {"error": "Internal server error"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class ReportGenerationView(APIView):
+    def stream_reply(self, session, user_msg, messages, user_message_count):
+        """
+        Yields the AI reply as SSE ``token`` events and persists the assembled
+        message once the provider stream ends (also when the client disconnects
+        early, so the conversation history stays consistent). If the call is
+        shed by the LLM bulkhead, a single ``error`` event is sent instead.
+        """
+        chunks = []
+        shed = False
+        try:
+            for chunk in stream_ai_response(messages):
+                chunks.append(chunk)
+                yield format_event("token", {"content": chunk})
+        except BulkheadFull:
+            shed = True
+        finally:
+            if not shed:
+                ai_msg = ChatMessage.objects.create(
+                    session=session, sender="assistant", content="".join(chunks)
+                )
+                schedule_turn_scoring(user_msg)
+                conversation_cache.append(session, ai_msg)
+        if shed:
+            # The provider is saturated; the headers are already sent, so report
+            # it as an event. The turn is dropped and can be sent again.
+            discard(user_msg)
+            yield format_event("error", {"error": LLMOverloaded.default_detail})
+            return
+        yield format_event("done", reply_data(user_msg, ai_msg, False, user_message_count))
+
+class ReportGenerationView(LazyAuthenticationMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
         operation_summary="Generate a report for a chat session",
-        operation_description="Generates a report based on the messages in a chat session.",
+        operation_description=(
+            "Queues report generation for the chat session and returns 202 with the job. "
+            "Poll the report-card endpoint until it returns the report. If the report already "
+            "exists it is returned directly with 200. Generation usually starts as soon as the "
+            "chat ends; pass 'wait' to wait for it to finish instead of getting a 202."
+        ),
         manual_parameters=[
             openapi.Parameter(
                 name="session_id",
@@ -344,6 +434,13 @@ class ReportGenerationView(APIView):
                 description="Bearer JWT token",
                 type=openapi.TYPE_STRING,
                 required=True,
+            ),
+            openapi.Parameter(
+                name="wait",
+                in_=openapi.IN_QUERY,
+                description="Seconds to wait for a queued or running report before answering 202 (capped by the server)",
+                type=openapi.TYPE_NUMBER,
+                required=False,
             )
         ],
         responses={
@@ -363,13 +460,42 @@ class ReportGenerationView(APIView):
                     }
                 )
             ),
+            202: openapi.Response(
+                "Report generation queued",
+                openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "job_id": openapi.Schema(type=openapi.TYPE_STRING, format="uuid", description="Report job ID"),
+                        "status": openapi.Schema(type=openapi.TYPE_STRING, description="pending, running, done or failed"),
+                        "report_card_url": openapi.Schema(type=openapi.TYPE_STRING, description="Report card endpoint to poll"),
+                        "report_link": openapi.Schema(type=openapi.TYPE_STRING, description="Link to the report")
+                    }
+                )
+            ),
             404: "Chat session not found",
             401: "Unauthorized - Bearer token required",
         },
         security=[{"Bearer": []}]
     )
-    @transaction.atomic
     def get(self, request, session_id):
+        try:
+            wait = self.get_wait(request)
+        except ValueError:
+            return Response(
+                {"error": "'wait' must be a number of seconds"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return self.report_or_enqueue(request, session_id, wait)
+
+    def get_wait(self, request):
+        wait = float(request.query_params.get("wait", 0))
+        return max(0.0, min(wait, settings.REPORT_MAX_WAIT_SECONDS))
+
+    def report_or_enqueue(self, request, session_id, wait=0):
+        """
+        Returns the session's report (200) or queues its generation (202),
+        waiting up to ``wait`` seconds for a queued or running job first.
+        """
         try:
             # Retrieve the chat session for the current user
             session = ChatSession.objects.filter(id=session_id).first()
@@ -379,36 +505,32 @@ class ReportGenerationView(APIView):
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Extract user and AI messages from the session
-            user_messages = list(
-                session.messages.filter(sender="user").values_list("content", flat=True)
-            )
-            ai_messages = list(
-                session.messages.filter(sender="assistant").values_list("content", flat=True)
-            )
-
-            # Generate the report
-            report_card, feedback, unlocked_cat, unlocked_sub, unlocked_lesson = process_evaluation(
-                session, user_messages, ai_messages, session_id, request.user
+            report_card = ReportCard.objects.filter(session=session).first()
+            if not report_card:
+                # Usually already queued when the chat ended; the evaluation runs
+                # in `manage.py run_report_worker`.
+                job, created = enqueue_report(session, request.user)
+                if wait:
+                    report_card = wait_for_report(session.id, wait)
+                if not report_card:
+                    report_card_url = request.build_absolute_uri(reverse("reportcard-detail", args=[session_id]))
+                    response = Response(
+                        report_job_data(job, report_card_url, session_id),
+                        status=status.HTTP_202_ACCEPTED
+                    )
+                    response["Location"] = report_card_url
+                    return response
+
+            job = ReportJob.objects.filter(session=session).first()
+            return Response(
+                report_response_data(
+                    report_card, report_card.feedback, job and job.unlocked_content, None, None, session_id
+                ),
+                status=status.HTTP_200_OK
             )
 
-            # Prepare the response
-            response_data = {
-                "engagement_score": report_card.engagement_score,
-                "humor_score": report_card.humor_score,
-                "empathy_score": report_card.empathy_score,
-                "total_score": report_card.total_score,
-                "feedback_summary": feedback,
-                "feedback": feedback,
-                "unlocked_content": True if unlocked_cat or unlocked_sub or unlocked_lesson else False,
-                "report_link": f"{CLIENT_URL}/report-cards/{session_id}"
-            }
-
-            return Response(response_data, status=status.HTTP_200_OK)
-
         except Exception as e:
             logger.exception(f"Error generating report: {e}")
-            transaction.set_rollback(True)
             return Response(
                 {"error": "Internal server error"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
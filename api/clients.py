@@ -0,0 +1,139 @@
+"""
+Registry of network clients shared across modules.
+
+Clients are built on first use rather than at import time, so worker boot and
+management commands such as ``migrate`` do not pay for importing and
+configuring the Supabase and OpenAI SDKs.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_factories = {}
+_instances = {}
+_lock = threading.Lock()
+
+
+def register(name, factory):
+    _factories[name] = factory
+
+
+def get(name):
+    client = _instances.get(name)
+    if client is None:
+        with _lock:
+            client = _instances.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = _instances[name] = _factories[name]()
+                metrics.observe(f"clients.{name}.build_seconds", time.perf_counter() - started)
+    return client
+
+
+def reset(name=None):
+    """
+    Drops built clients so the next ``get`` rebuilds them (tests, settings changes).
+    """
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+def _build_supabase():
+    from .supabase_client import create_supabase_client
+
+    return create_supabase_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+
+
+def _primary_provider():
+    return "openai" if "gpt" in os.getenv("AI_MODEL") else "deepseek"
+
+
+def _fallback_provider():
+    return "deepseek" if _primary_provider() == "openai" else "openai"
+
+
+def _provider_options(provider):
+    if provider == "deepseek":
+        return {"api_key": os.getenv("DEEPSEEK_API_KEY"), "base_url": os.getenv("AI_BASE_URL")}
+    return {"api_key": os.getenv("OPENAI_API_KEY")}
+
+
+def _build_llm():
+    from openai import OpenAI
+
+    logger.info(f"Using {_primary_provider()}")
+    return OpenAI(**_provider_options(_primary_provider()))
+
+
+def _build_async_llm():
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(**_provider_options(_primary_provider()))
+
+
+def _build_llm_fallback():
+    from openai import OpenAI
+
+    return OpenAI(**_provider_options(_fallback_provider()))
+
+
+def _build_async_llm_fallback():
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(**_provider_options(_fallback_provider()))
+
+
+def _build_llm_router():
+    from .llm_router import LLMRouter, Provider
+
+    providers = [
+        Provider(_primary_provider(), os.getenv("AI_MODEL"), get_llm_client, get_async_llm_client,
+                 alpha=settings.LLM_EWMA_ALPHA),
+    ]
+    if settings.LLM_FALLBACK_MODEL and _provider_options(_fallback_provider())["api_key"]:
+        providers.append(
+            Provider(_fallback_provider(), settings.LLM_FALLBACK_MODEL,
+                     lambda: get("llm_fallback"), lambda: get("async_llm_fallback"),
+                     alpha=settings.LLM_EWMA_ALPHA)
+        )
+    return LLMRouter(
+        providers,
+        hedge=settings.LLM_HEDGING,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY,
+        error_penalty=settings.LLM_ERROR_PENALTY,
+        hedge_threads=settings.LLM_HEDGE_THREADS,
+    )
+
+
+register("supabase", _build_supabase)
+register("llm", _build_llm)
+register("async_llm", _build_async_llm)
+register("llm_fallback", _build_llm_fallback)
+register("async_llm_fallback", _build_async_llm_fallback)
+register("llm_router", _build_llm_router)
+
+
+def get_supabase_client():
+    return get("supabase")
+
+
+def get_llm_client():
+    return get("llm")
+
+
+def get_async_llm_client():
+    return get("async_llm")
+
+
+def get_llm_router():
+    return get("llm_router")
@@ -0,0 +1,82 @@
+"""
+Rolling summary of long chats.
+
+Once the turns since the last summary outgrow CHAT_SUMMARY_TRIGGER_TOKENS, the
+older ones are compacted, together with the previous summary, into a new summary
+stored on the ChatSession. The message views then only use the turns after
+ChatSession.summarized_through (see api.conversation_cache), so the prompt stays
+about the same size however long the chat gets.
+"""
+import logging
+
+from . import background, metrics
+from .chat_service import needs_summary, split_for_summary
+from .conversation_cache import conversation_cache
+from .models import ChatSession
+from .resilience import BulkheadFull
+from .utils import AI_FALLBACK_MESSAGE, get_ai_response
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "You keep the running summary of a role-play conversation between a user and an AI character. "
+    "Update the summary with the new messages. Keep names, facts, plans and the mood of the "
+    "conversation; leave out small talk. Answer with the summary only, in at most 150 words."
+)
+
+
+def build_summary_messages(summary, messages):
+    transcript = "\n".join(f"{sender}: {content}" for _, sender, content in messages)
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Summary so far: {summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
+
+
+def schedule_summary(session, history):
+    """
+    Compacts the session's older turns in the background when ``history``, its
+    (sender, content) turns since the last summary, has grown too long.
+    """
+    if needs_summary(history):
+        background.submit(summarise_session, session.pk)
+
+
+def summarise_session(session_id):
+    """
+    Folds the older turns since the last summary into it, keeping the newest
+    ones verbatim.
+
+    Returns:
+        bool: Whether the summary was updated.
+    """
+    session = ChatSession.objects.get(pk=session_id)
+    history = list(
+        session.messages.filter(sender__in=["user", "assistant"], pk__gt=session.summarized_through)
+        .order_by("pk")
+        .values_list("pk", "sender", "content")
+    )
+    older, _ = split_for_summary(history)
+    if not older:
+        return False
+
+    try:
+        summary = get_ai_response(
+            build_summary_messages(session.context_summary, older), temperature=0.3, background=True
+        )
+    except BulkheadFull:
+        # Live calls come first; the next message schedules it again.
+        summary = AI_FALLBACK_MESSAGE
+    if summary == AI_FALLBACK_MESSAGE:
+        metrics.incr("chat.summary_failed")
+        return False
+
+    # Only applies if no concurrent run has moved the summary on meanwhile.
+    updated = ChatSession.objects.filter(pk=session_id, summarized_through=session.summarized_through).update(
+        context_summary=summary, summarized_through=older[-1][0]
+    )
+    if updated:
+        conversation_cache.invalidate(session_id)
+        metrics.incr("chat.summarised")
+        metrics.observe("chat.summarised_messages", len(older))
+    return bool(updated)
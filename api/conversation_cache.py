@@ -0,0 +1,120 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import metrics
+from .caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class Conversation:
+    """
+    What the message views need to build the next prompt of a chat session:
+    its system messages, rolling summary, the (sender, content) turns since
+    that summary and the number of user messages so far.
+
+    ``version`` is the id of the newest message included. Instances are never
+    mutated, so they can be shared between threads.
+    """
+
+    def __init__(self, version, system_contents, summary, history, user_count):
+        self.version = version
+        self.system_contents = system_contents
+        self.summary = summary
+        self.history = history
+        self.user_count = user_count
+
+    def appended(self, message):
+        system_contents, history = self.system_contents, self.history
+        if message.sender == "system":
+            system_contents = system_contents + [message.content]
+        else:
+            history = history + [(message.sender, message.content)]
+        return Conversation(
+            version=message.pk,
+            system_contents=system_contents,
+            summary=self.summary,
+            history=history,
+            user_count=self.user_count + (message.sender == "user"),
+        )
+
+
+class ConversationCache:
+    """
+    Write-through cache of the Conversation of each active chat session, so a
+    steady-state chat turn writes its messages without re-reading the history.
+
+    Conversations live in an in-process LRU. The id of the newest message of
+    each session is kept in the shared Django cache as a version stamp: a local
+    entry is only used while its version matches, so a turn handled by another
+    worker process (or an invalidation) makes the next read reload from the
+    database.
+    """
+
+    def __init__(self, local_size=1024, ttl=1800, prefix="chat:conversation"):
+        self.local = TTLCache(maxsize=local_size, ttl=ttl)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _version_key(self, session_id):
+        return f"{self.prefix}:{session_id}"
+
+    def get(self, session):
+        conversation = self.local.get(session.pk)
+        if conversation is not None and cache.get(self._version_key(session.pk)) == conversation.version:
+            metrics.incr("conversation_cache.hit")
+            return conversation
+        metrics.incr("conversation_cache.miss")
+        return self._load(session)
+
+    def append(self, session, message):
+        """
+        Adds a message just saved for ``session`` and returns the updated
+        Conversation. Falls back to a reload if the cached one is out of date.
+        """
+        key = self._version_key(session.pk)
+        conversation = self.local.get(session.pk)
+        if conversation is None or cache.get(key) != conversation.version or message.pk <= conversation.version:
+            metrics.incr("conversation_cache.miss")
+            return self._load(session)
+        conversation = conversation.appended(message)
+        self.local.set(session.pk, conversation)
+        cache.set(key, conversation.version, timeout=self.ttl)
+        metrics.incr("conversation_cache.append")
+        return conversation
+
+    def invalidate(self, session_id):
+        self.local.delete(session_id)
+        cache.delete(self._version_key(session_id))
+        metrics.incr("conversation_cache.invalidated")
+
+    def _load(self, session):
+        rows = list(
+            session.messages.filter(Q(sender="system") | Q(pk__gt=session.summarized_through))
+            .order_by("timestamp", "pk")
+            .values_list("pk", "sender", "content")
+        )
+        conversation = Conversation(
+            version=max((pk for pk, _, _ in rows), default=0),
+            system_contents=[content for _, sender, content in rows if sender == "system"],
+            summary=session.context_summary,
+            history=[(sender, content) for _, sender, content in rows if sender in ("user", "assistant")],
+            user_count=session.messages.filter(sender="user").count(),
+        )
+        key = self._version_key(session.pk)
+        shared_version = cache.get(key)
+        if shared_version is None or shared_version <= conversation.version:
+            self.local.set(session.pk, conversation)
+            cache.set(key, conversation.version, timeout=self.ttl)
+        # Otherwise a newer message was written elsewhere meanwhile: serve this
+        # read, but leave caching to the next one.
+        return conversation
+
+
+conversation_cache = ConversationCache(
+    local_size=settings.CONVERSATION_CACHE_SIZE,
+    ttl=settings.CONVERSATION_CACHE_TTL,
+)
@@ -0,0 +1,102 @@
+"""
+Readiness checks for the load balancer.
+
+The dependency checks (Postgres, LLM provider, Supabase) are run by a single
+background thread per process every READINESS_CACHE_SECONDS; probe requests only
+read the last result, so probe traffic never turns into dependency traffic.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+from .clients import get_llm_client
+from .http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+
+def check_database():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def check_llm_provider():
+    get_llm_client().with_options(timeout=settings.READINESS_CHECK_TIMEOUT, max_retries=0).models.list()
+
+
+def check_supabase():
+    response = get_http_client().get(
+        f"{settings.SUPABASE_URL}/auth/v1/health",
+        headers={"apikey": settings.SUPABASE_ANON_KEY},
+        timeout=settings.READINESS_CHECK_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+class ReadinessProber:
+    """
+    Runs ``checks`` in one daemon thread and caches the combined result.
+    """
+
+    def __init__(self, checks, interval):
+        self.checks = checks
+        self.interval = interval
+        self._result = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def status(self):
+        if self._result is None:
+            with self._lock:
+                if self._result is None:
+                    # First probe in this process: answer from a real check and
+                    # start refreshing in the background.
+                    self._result = self.run_checks()
+                    self._start()
+        return self._result
+
+    def run_checks(self):
+        results = {}
+        for name, check in self.checks.items():
+            started = time.perf_counter()
+            try:
+                check()
+                results[name] = {"ok": True}
+            except Exception:
+                # Probes are unauthenticated: the reason only goes to the log.
+                logger.exception(f"Readiness check '{name}' failed")
+                results[name] = {"ok": False}
+            elapsed = time.perf_counter() - started
+            results[name]["latency_ms"] = round(elapsed * 1000, 1)
+            metrics.set_gauge(f"readiness.{name}.ok", int(results[name]["ok"]))
+        ready = all(result["ok"] for result in results.values())
+        metrics.set_gauge("readiness.ready", int(ready))
+        return {"ready": ready, "checks": results, "checked_at": time.time()}
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._loop, name="readiness-prober", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._result = self.run_checks()
+            finally:
+                # The prober thread is not a request, so nothing else closes its
+                # database connection. The first, synchronous run uses the request's.
+                connection.close()
+
+
+readiness_prober = ReadinessProber(
+    checks={
+        "database": check_database,
+        "llm": check_llm_provider,
+        "supabase": check_supabase,
+    },
+    interval=settings.READINESS_CACHE_SECONDS,
+)
@@ -0,0 +1,84 @@
+"""
+Shared, per-process pooled HTTP client for calls to Supabase.
+
+Every Supabase auth call (the SDK clients and SupabaseAuthBackend) goes through
+one keep-alive connection pool with explicit connect/read timeouts, instead of
+a new TCP+TLS handshake per request. Pool utilisation and handshake counts are
+published to ``api.metrics`` under ``http.supabase.*``.
+"""
+import threading
+
+import httpx
+from django.conf import settings
+from gotrue.http_clients import SyncClient
+
+from . import metrics
+
+_client = None
+_client_lock = threading.Lock()
+
+# httpcore trace events that correspond to a new connection being set up.
+HANDSHAKE_EVENTS = {
+    "connection.connect_tcp.complete": "http.supabase.tcp_handshakes",
+    "connection.start_tls.complete": "http.supabase.tls_handshakes",
+}
+
+
+def _trace(event_name, info):
+    counter = HANDSHAKE_EVENTS.get(event_name)
+    if counter:
+        metrics.incr(counter)
+
+
+def _on_request(request):
+    request.extensions["trace"] = _trace
+    metrics.incr("http.supabase.requests")
+    # Snapshot taken before this request claims a connection, i.e. what the
+    # other in-flight requests are holding.
+    publish_pool_stats()
+
+
+def pool_stats():
+    """
+    Returns the number of open, idle and busy connections in the shared pool.
+
+    These are read from httpx/httpcore internals; if a version without them is
+    installed, nothing is returned rather than failing the request.
+    """
+    if _client is None:
+        return {"connections": 0, "idle": 0, "busy": 0}
+    try:
+        connections = list(_client._transport._pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+    except AttributeError:
+        return {}
+    return {"connections": len(connections), "idle": idle, "busy": len(connections) - idle}
+
+
+def publish_pool_stats():
+    for name, value in pool_stats().items():
+        metrics.set_gauge(f"http.supabase.pool.{name}", value)
+
+
+def get_http_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SyncClient(
+                    http2=settings.SUPABASE_HTTP2,
+                    follow_redirects=True,
+                    limits=httpx.Limits(
+                        max_connections=settings.SUPABASE_HTTP_POOL_SIZE,
+                        max_keepalive_connections=settings.SUPABASE_HTTP_POOL_SIZE,
+                        keepalive_expiry=settings.SUPABASE_HTTP_KEEPALIVE_SECONDS,
+                    ),
+                    timeout=httpx.Timeout(
+                        settings.SUPABASE_HTTP_READ_TIMEOUT,
+                        connect=settings.SUPABASE_HTTP_CONNECT_TIMEOUT,
+                        pool=settings.SUPABASE_HTTP_CONNECT_TIMEOUT,
+                    ),
+                    event_hooks={"request": [_on_request]},
+                )
+                metrics.set_gauge("http.supabase.pool.max_connections", settings.SUPABASE_HTTP_POOL_SIZE)
+    return _client
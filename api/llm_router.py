@@ -0,0 +1,314 @@
+"""
+Routes chat completion calls across the configured LLM providers.
+
+Each provider keeps an exponentially weighted moving average (EWMA) of its
+latency and error rate; every call goes to the provider with the best score and
+fails over to the next one on error. With hedging on, a second request is sent
+to the runner-up once the first has taken longer than its recent p95 latency,
+and whichever answers first wins. Routing decisions are published as
+``llm.*`` metrics.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _options(response_format):
+    # Only sent when asked for, as not every compatible endpoint supports it.
+    return {"response_format": response_format} if response_format else {}
+
+
+class Provider:
+    """
+    One OpenAI-compatible endpoint. ``client`` and ``async_client`` are
+    callables returning the (sync / async) SDK client, so they are only built
+    when first used.
+    """
+
+    def __init__(self, name, model, client, async_client=None, alpha=0.2, window=200):
+        self.name = name
+        self.model = model
+        self._client = client
+        self._async_client = async_client
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client()
+
+    @property
+    def async_client(self):
+        return self._async_client()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self._latencies.append(seconds)
+                self.latency = seconds if self.latency is None else self.latency + self.alpha * (seconds - self.latency)
+        metrics.observe(f"llm.{self.name}.seconds", seconds)
+        metrics.incr(f"llm.{self.name}.{'ok' if ok else 'errors'}")
+        if self.latency is not None:
+            metrics.set_gauge(f"llm.{self.name}.ewma_ms", round(self.latency * 1000))
+        metrics.set_gauge(f"llm.{self.name}.error_rate", round(self.error_rate, 3))
+
+    def p95(self):
+        """
+        95th percentile of the recent successful latencies, or None while there
+        are too few samples to tell.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < LLMRouter.MIN_HEDGE_SAMPLES:
+            return None
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def score(self, error_penalty, prior):
+        """
+        Expected latency, inflated by the error rate. A provider without a
+        successful call yet is assumed to be as slow as ``prior``.
+        """
+        latency = self.latency if self.latency is not None else prior
+        return latency * (1 + error_penalty * self.error_rate)
+
+
+class LLMRouter:
+
+    MIN_HEDGE_SAMPLES = 20
+    # Latency assumed for every provider until one has answered.
+    DEFAULT_LATENCY = 1.0
+
+    def __init__(self, providers, hedge=False, hedge_min_delay=0.5, error_penalty=10.0, hedge_threads=32):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = providers
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.error_penalty = error_penalty
+        self.hedge_threads = hedge_threads
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def ranked(self):
+        """
+        Providers by score, best first; ties keep the configured order.
+
+        Unsampled providers are scored as the slowest sampled one, so they
+        never outrank a provider that has answered until they answer too, and
+        one that only fails drops behind after its first error.
+        """
+        known = [provider.latency for provider in self.providers if provider.latency is not None]
+        prior = max(known) if known else self.DEFAULT_LATENCY
+        return sorted(self.providers, key=lambda provider: provider.score(self.error_penalty, prior))
+
+    def hedge_delay(self, provider):
+        if not self.hedge or len(self.providers) < 2:
+            return None
+        p95 = provider.p95()
+        if p95 is None:
+            return None
+        return max(self.hedge_min_delay, p95)
+
+    def complete(self, messages, temperature, response_format=None):
+        """
+        Returns the reply text of the first provider to answer.
+        ``response_format`` is passed to the provider, e.g. JSON mode.
+
+        Raises:
+            The last provider error if every provider failed.
+        """
+        ranked = self.ranked()
+        metrics.incr(f"llm.route.{ranked[0].name}")
+        delay = self.hedge_delay(ranked[0])
+        if delay is None:
+            return self._complete_in_order(ranked, messages, temperature, response_format)
+
+        pool = self._get_pool()
+        first = pool.submit(self._call, ranked[0], messages, temperature, response_format)
+        done, _ = wait([first], timeout=delay)
+        if done and first.exception() is None:
+            return first.result()
+        if done:
+            # Failed before the hedge was due: plain failover.
+            return self._complete_in_order(ranked[1:], messages, temperature, response_format, error=first.exception())
+
+        metrics.incr("llm.hedge.sent")
+        hedge = pool.submit(self._call, ranked[1], messages, temperature, response_format)
+        pending = {first, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser keeps running in the pool; its latency is still recorded.
+                    if future is hedge:
+                        metrics.incr("llm.hedge.won")
+                    return future.result()
+                error = future.exception()
+        return self._complete_in_order(ranked[2:], messages, temperature, response_format, error=error)
+
+    async def acomplete(self, messages, temperature, response_format=None):
+        """
+        Async variant of complete; the losing request of a hedge is cancelled.
+        """
+        ranked = self.ranked()
+        metrics.incr(f"llm.route.{ranked[0].name}")
+        delay = self.hedge_delay(ranked[0])
+        if delay is None:
+            return await self._acomplete_in_order(ranked, messages, temperature, response_format)
+
+        first = asyncio.ensure_future(self._acall(ranked[0], messages, temperature, response_format))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done and first.exception() is None:
+            return first.result()
+        if done:
+            return await self._acomplete_in_order(ranked[1:], messages, temperature, response_format, error=first.exception())
+
+        metrics.incr("llm.hedge.sent")
+        hedge = asyncio.ensure_future(self._acall(ranked[1], messages, temperature, response_format))
+        pending = {first, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            metrics.incr("llm.hedge.won")
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        return await self._acomplete_in_order(ranked[2:], messages, temperature, response_format, error=error)
+
+    def stream(self, messages, temperature):
+        """
+        Yields the reply in chunks from the best provider. Fails over to the
+        next one only if nothing has been yielded yet; streams are not hedged.
+        """
+        error = None
+        ranked = self.ranked()
+        metrics.incr(f"llm.route.{ranked[0].name}")
+        for index, provider in enumerate(ranked):
+            if index:
+                metrics.incr("llm.failover")
+            started = time.perf_counter()
+            yielded = False
+            try:
+                stream = provider.client.chat.completions.create(
+                    model=provider.model, messages=messages, temperature=temperature, stream=True
+                )
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yielded = True
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                provider.record(time.perf_counter() - started, ok=False)
+                if yielded:
+                    raise
+                logger.warning(f"LLM provider {provider.name} failed: {e}")
+                error = e
+                continue
+            provider.record(time.perf_counter() - started, ok=True)
+            return
+        raise error
+
+    async def astream(self, messages, temperature):
+        """
+        Async variant of stream.
+        """
+        error = None
+        ranked = self.ranked()
+        metrics.incr(f"llm.route.{ranked[0].name}")
+        for index, provider in enumerate(ranked):
+            if index:
+                metrics.incr("llm.failover")
+            started = time.perf_counter()
+            yielded = False
+            try:
+                stream = await provider.async_client.chat.completions.create(
+                    model=provider.model, messages=messages, temperature=temperature, stream=True
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yielded = True
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                provider.record(time.perf_counter() - started, ok=False)
+                if yielded:
+                    raise
+                logger.warning(f"LLM provider {provider.name} failed: {e}")
+                error = e
+                continue
+            provider.record(time.perf_counter() - started, ok=True)
+            return
+        raise error
+
+    def _complete_in_order(self, providers, messages, temperature, response_format=None, error=None):
+        for provider in providers:
+            if error is not None:
+                metrics.incr("llm.failover")
+            try:
+                return self._call(provider, messages, temperature, response_format)
+            except Exception as e:
+                logger.warning(f"LLM provider {provider.name} failed: {e}")
+                error = e
+        raise error
+
+    async def _acomplete_in_order(self, providers, messages, temperature, response_format=None, error=None):
+        for provider in providers:
+            if error is not None:
+                metrics.incr("llm.failover")
+            try:
+                return await self._acall(provider, messages, temperature, response_format)
+            except Exception as e:
+                logger.warning(f"LLM provider {provider.name} failed: {e}")
+                error = e
+        raise error
+
+    def _call(self, provider, messages, temperature, response_format=None):
+        started = time.perf_counter()
+        try:
+            response = provider.client.chat.completions.create(
+                model=provider.model, messages=messages, temperature=temperature,
+                **_options(response_format)
+            )
+        except Exception:
+            provider.record(time.perf_counter() - started, ok=False)
+            raise
+        provider.record(time.perf_counter() - started, ok=True)
+        return response.choices[0].message.content
+
+    async def _acall(self, provider, messages, temperature, response_format=None):
+        started = time.perf_counter()
+        try:
+            response = await provider.async_client.chat.completions.create(
+                model=provider.model, messages=messages, temperature=temperature,
+                **_options(response_format)
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            provider.record(time.perf_counter() - started, ok=False)
+            raise
+        provider.record(time.perf_counter() - started, ok=True)
+        return response.choices[0].message.content
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.hedge_threads, thread_name_prefix="llm-hedge")
+        return self._pool
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.benchmarks import COLD_START_SNIPPET
+
+
+class Command(BaseCommand):
+    help = "Reports import time per module for a cold worker start (python -X importtime)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=25, help="Number of modules to show")
+        parser.add_argument("--prefix", default="", help="Only show modules starting with this prefix, e.g. 'api'")
+        parser.add_argument("--sort", choices=["cumulative", "self"], default="cumulative")
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", COLD_START_SNIPPET],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        total = float(result.stdout.strip().splitlines()[-1])
+
+        rows = []
+        for line in result.stderr.splitlines():
+            # "import time:  self [us] | cumulative | imported package"
+            if not line.startswith("import time:") or "imported package" in line:
+                continue
+            self_us, cumulative_us, module = line[len("import time:"):].split("|")
+            module = module.strip()
+            if module.startswith(options["prefix"]):
+                rows.append((module, int(self_us) / 1000, int(cumulative_us) / 1000))
+
+        key = 2 if options["sort"] == "cumulative" else 1
+        rows.sort(key=lambda row: row[key], reverse=True)
+
+        self.stdout.write(f"{'module':<60} {'self ms':>10} {'cumul. ms':>10}")
+        for module, self_ms, cumulative_ms in rows[:options["limit"]]:
+            self.stdout.write(f"{module:<60} {self_ms:>10.1f} {cumulative_ms:>10.1f}")
+        self.stdout.write(self.style.SUCCESS(f"Total startup: {total * 1000:.1f} ms"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.openers import refill_all
+
+
+class Command(BaseCommand):
+    help = "Fills the pools of pre-generated chat openers for every bot and scenario (see api.openers)."
+
+    def handle(self, *args, **options):
+        added, pruned = refill_all()
+        self.stdout.write(f"Added {added} openers, removed {pruned} unused ones")
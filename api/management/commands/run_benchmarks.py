@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Runs the benchmark suite (all benchmarks, or the ones named)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help=f"Benchmarks to run: {', '.join(sorted(BENCHMARKS))}")
+        parser.add_argument("--repeat", type=int, default=5, help="Repetitions per benchmark")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON")
+        parser.add_argument(
+            "--use-test-db", action="store_true",
+            help="Allow benchmarks that create and drop a test_<NAME> database on the configured database server",
+        )
+
+    def handle(self, *args, **options):
+        names = options["names"] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+        needs_test_db = [name for name in names if BENCHMARKS[name].uses_test_db]
+        if needs_test_db and not options["use_test_db"]:
+            if options["names"]:
+                raise CommandError(
+                    f"{', '.join(needs_test_db)} create and drop a test database on the configured "
+                    "database server; pass --use-test-db to run them"
+                )
+            self.stderr.write(f"Skipping {', '.join(needs_test_db)} (needs --use-test-db)")
+            names = [name for name in names if name not in needs_test_db]
+
+        results = {}
+        for name in names:
+            results[name] = BENCHMARKS[name](repeat=options["repeat"])
+            if not options["json"]:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for key, value in results[name].items():
+                    value = f"{value:.6f}" if isinstance(value, float) else value
+                    self.stdout.write(f"  {key:<28} {value}")
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,32 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.report_jobs import ReportWorker
+
+
+class Command(BaseCommand):
+    help = "Runs queued report generation jobs (see api.report_jobs)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.REPORT_WORKER_CONCURRENCY,
+            help="Jobs run at the same time"
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=settings.REPORT_WORKER_POLL_SECONDS,
+            help="Seconds between queue polls when idle"
+        )
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        worker = ReportWorker(options["concurrency"], options["poll_interval"])
+        # Finish in-flight jobs on shutdown; unclaimed ones stay queued.
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        self.stdout.write(f"Report worker started with concurrency {options['concurrency']}")
+        try:
+            worker.run(once=options["once"])
+        except KeyboardInterrupt:
+            worker.stop()
+        self.stdout.write("Report worker stopped")
@@ -0,0 +1,58 @@
+"""
+Process-local metrics registry.
+
+Counters, gauges and simple timing summaries are kept in memory for the current
+worker process. They are exposed as JSON through ``socialflow_django.views.MetricsView``
+so they can be scraped and graphed per worker.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """
+    Records one observation (e.g. a duration in seconds) for ``name``.
+    """
+    with _lock:
+        summary = _timings.get(name)
+        if summary is None:
+            summary = _timings[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["max"] = max(summary["max"], value)
+
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {name: dict(summary) for name, summary in _timings.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
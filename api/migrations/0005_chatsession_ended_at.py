@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-17 00:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='ended_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
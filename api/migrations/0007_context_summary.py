@@ -0,0 +1,23 @@
+# Generated by Django 4.2.19 on 2026-10-17 00:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_turnscore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summarized_through',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.19 on 2026-10-17 01:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_context_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prompt_hash', models.CharField(max_length=64)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opening_messages', to='api.chatbot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['prompt_hash', 'created_at'], name='api_opening_prompt__35d122_idx')],
+            },
+        ),
+    ]
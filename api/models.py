@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser, BaseUserManager, PermissionsMixin
 )
@@ -60,11 +61,39 @@ class ChatBot(models.Model):
 
     def __str__(self):
         return self.name
+
+class OpeningMessage(models.Model):
+    """
+    Pre-generated first assistant line for a bot prompt formatted with one
+    scenario (see api.openers). Used once, then deleted.
+    """
+    bot = models.ForeignKey(ChatBot, related_name="opening_messages", on_delete=models.CASCADE)
+    # sha256 of the formatted prompt, so a changed bot prompt gets fresh openers
+    prompt_hash = models.CharField(max_length=64)
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["prompt_hash", "created_at"])]
+
+    def __str__(self):
+        return str(self.content)
+
 class ChatSession(models.Model):
     id = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     bot = models.ForeignKey(ChatBot, on_delete=models.CASCADE, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    # Running totals of the per-turn scores (see api.turn_scoring).
+    scored_turns = models.PositiveIntegerField(default=0)
+    engagement_total = models.PositiveIntegerField(default=0)
+    humor_total = models.PositiveIntegerField(default=0)
+    empathy_total = models.PositiveIntegerField(default=0)
+    # Rolling summary of the turns up to and including message summarized_through
+    # (see api.context_summary).
+    context_summary = models.TextField(blank=True, default="")
+    summarized_through = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return str(self.id)
@@ -79,6 +108,21 @@ class ChatMessage(models.Model):
     def __str__(self):
         return str(self.content)
 
+class TurnScore(models.Model):
+    """
+    Scores (0-100) for a single user message, with a short note for the final summary.
+    """
+    message = models.OneToOneField(ChatMessage, related_name="turn_score", on_delete=models.CASCADE)
+    session = models.ForeignKey(ChatSession, related_name="turn_scores", on_delete=models.CASCADE)
+    engagement_score = models.IntegerField()
+    humor_score = models.IntegerField()
+    empathy_score = models.IntegerField()
+    note = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.message_id}: {self.engagement_score}/{self.humor_score}/{self.empathy_score}"
+
 class ReportCard(models.Model):
     session = models.OneToOneField(ChatSession, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -91,3 +135,38 @@ class ReportCard(models.Model):
 
     def __str__(self):
         return str(self.total_score)
+
+
+class ReportJob(models.Model):
+    """
+    Queued report generation for a chat session, run by ``manage.py run_report_worker``.
+    There is at most one job per session, so enqueueing is idempotent.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
+    session = models.OneToOneField(ChatSession, related_name="report_job", on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    unlocked_content = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "available_at"])]
+
+    def __str__(self):
+        return f"{self.session_id} ({self.status})"
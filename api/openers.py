@@ -0,0 +1,118 @@
+"""
+Pool of pre-generated chat opening lines.
+
+The first assistant message of a session only depends on the bot's prompt
+formatted with the chosen scenario, so a few are generated ahead of time for
+each (bot, scenario) pair. Session creation takes the oldest one, which keeps
+the pool rotating, and the pool is topped back up to OPENER_POOL_DEPTH in the
+background. Only an empty pool makes session creation wait on the AI provider.
+``manage.py refill_openers`` fills every pool, e.g. after a deploy.
+"""
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from . import background, metrics
+from .chat_service import SCENARIOS, format_bot_prompt
+from .models import ChatBot, OpeningMessage
+from .resilience import BulkheadFull
+from .utils import AI_FALLBACK_MESSAGE, get_ai_response
+
+logger = logging.getLogger(__name__)
+
+_refilling = set()
+_refilling_lock = threading.Lock()
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def pop_opener(bot, prompt):
+    """
+    Takes the oldest pooled opener for the formatted ``prompt`` and schedules a
+    refill of its pool.
+
+    Returns:
+        str: The opener, or None if the pool is empty or disabled.
+    """
+    if not settings.OPENER_POOL_DEPTH:
+        return None
+    with transaction.atomic():
+        opener = (
+            OpeningMessage.objects.select_for_update(skip_locked=True)
+            .filter(prompt_hash=prompt_hash(prompt))
+            .order_by("created_at")
+            .first()
+        )
+        if opener is not None:
+            opener.delete()
+    metrics.incr("openers.hit" if opener is not None else "openers.miss")
+    background.submit(refill_pool, bot.pk, prompt)
+    return opener.content if opener is not None else None
+
+
+def refill_pool(bot_id, prompt):
+    """
+    Generates openers for ``prompt`` until its pool holds OPENER_POOL_DEPTH
+    different ones. A pool already being refilled by this process is left alone.
+
+    Returns:
+        int: Number of openers added.
+    """
+    key = prompt_hash(prompt)
+    with _refilling_lock:
+        if key in _refilling:
+            return 0
+        _refilling.add(key)
+    added = 0
+    try:
+        pooled = set(OpeningMessage.objects.filter(prompt_hash=key).values_list("content", flat=True))
+        missing = settings.OPENER_POOL_DEPTH - len(pooled)
+        # Every call sends the same messages, so they must not be coalesced,
+        # and a repeated opener is dropped; a few extra calls make up for those.
+        for _ in range(2 * missing):
+            if added == missing:
+                break
+            try:
+                content = get_ai_response(
+                    [{"role": "system", "content": prompt}], coalesce=False, background=True
+                )
+            except BulkheadFull:
+                # Live calls come first; the next pop retries.
+                break
+            if content == AI_FALLBACK_MESSAGE:
+                break
+            if content in pooled:
+                metrics.incr("openers.duplicate")
+                continue
+            pooled.add(content)
+            OpeningMessage.objects.create(bot_id=bot_id, prompt_hash=key, content=content)
+            added += 1
+    finally:
+        with _refilling_lock:
+            _refilling.discard(key)
+    metrics.incr("openers.generated", added)
+    return added
+
+
+def refill_all():
+    """
+    Fills the pool of every bot and scenario, and drops openers of prompts that
+    are no longer in use (edited bots or scenarios).
+
+    Returns:
+        tuple: (added, pruned)
+    """
+    added = 0
+    current = set()
+    for bot in ChatBot.objects.all():
+        for scenario in SCENARIOS:
+            prompt = format_bot_prompt(bot, scenario)
+            current.add(prompt_hash(prompt))
+            added += refill_pool(bot.pk, prompt)
+    pruned, _ = OpeningMessage.objects.exclude(prompt_hash__in=current).delete()
+    return added, pruned
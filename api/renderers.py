@@ -0,0 +1,28 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+def format_event(event, data):
+    """
+    Formats one Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets views accept ``Accept: text/event-stream``. Streaming views return a
+    StreamingHttpResponse themselves; this renderer only handles the regular
+    Response objects sent to such clients (errors, or replies that did not need
+    streaming), as a single ``error`` or final ``done`` event.
+    """
+
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get("response")
+        event = "error" if response is not None and response.status_code >= 400 else "done"
+        return format_event(event, data).encode(self.charset)
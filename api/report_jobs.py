@@ -0,0 +1,239 @@
+"""
+DB-backed queue for report generation.
+
+ReportGenerationView enqueues one ReportJob per chat session and answers 202;
+``manage.py run_report_worker`` claims pending jobs, runs the evaluation outside
+the request cycle and stores the ReportCard, which ReportCardDetailView serves
+once it exists. Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of workers can share the table.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import ChatSession, ReportCard, ReportJob
+from .resilience import backoff_delay
+from .turn_scoring import evaluate_incrementally
+from .utils import process_evaluation, save_evaluation
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_report(session, user):
+    """
+    Queues report generation for ``session``.
+
+    A session has at most one job: an existing pending, running or finished job
+    is returned unchanged, a failed one is queued again.
+
+    Returns:
+        tuple: (job, created)
+    """
+    job, created = ReportJob.objects.get_or_create(session=session, defaults={"user": user})
+    if created:
+        metrics.incr("report_jobs.enqueued")
+    elif job.status == ReportJob.FAILED:
+        ReportJob.objects.filter(pk=job.pk, status=ReportJob.FAILED).update(
+            status=ReportJob.PENDING, attempts=0, error="", available_at=timezone.now()
+        )
+        job.refresh_from_db()
+        metrics.incr("report_jobs.requeued")
+    return job, created
+
+
+def on_chat_ended(session, user):
+    """
+    Records when the chat ended and, with SPECULATIVE_REPORTS, queues its report
+    right away, so it is usually ready by the time the client asks for it.
+    """
+    ChatSession.objects.filter(pk=session.pk, ended_at__isnull=True).update(ended_at=timezone.now())
+    if settings.SPECULATIVE_REPORTS:
+        job, created = enqueue_report(session, user)
+        if created:
+            metrics.incr("report_jobs.speculative")
+
+
+REPORT_POLL_INTERVAL = 0.25
+
+
+def wait_for_report(session_id, timeout):
+    """
+    Waits up to ``timeout`` seconds for the in-flight job of the session to
+    store its ReportCard. Returns the ReportCard, or None.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        report_card = ReportCard.objects.filter(session_id=session_id).first()
+        if report_card:
+            return report_card
+        if ReportJob.objects.filter(session_id=session_id, status=ReportJob.FAILED).exists():
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(REPORT_POLL_INTERVAL, remaining))
+
+
+async def await_report(session_id, timeout):
+    """
+    Async variant of wait_for_report that does not hold a thread while waiting.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        report_card = await ReportCard.objects.filter(session_id=session_id).afirst()
+        if report_card:
+            return report_card
+        if await ReportJob.objects.filter(session_id=session_id, status=ReportJob.FAILED).aexists():
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        await asyncio.sleep(min(REPORT_POLL_INTERVAL, remaining))
+
+
+def claim_jobs(limit):
+    """
+    Marks up to ``limit`` runnable jobs as running and returns them. Running
+    jobs whose lease has expired (their worker died) are runnable again.
+    """
+    now = timezone.now()
+    lease_expired = now - timedelta(seconds=settings.REPORT_JOB_LEASE_SECONDS)
+    with transaction.atomic():
+        jobs = list(
+            ReportJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=ReportJob.PENDING, available_at__lte=now)
+                | Q(status=ReportJob.RUNNING, started_at__lt=lease_expired)
+            )
+            .order_by("available_at")[:limit]
+        )
+        if jobs:
+            ReportJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=ReportJob.RUNNING, started_at=now, attempts=F("attempts") + 1
+            )
+    for job in jobs:
+        job.status = ReportJob.RUNNING
+        job.started_at = now
+        job.attempts += 1
+    return jobs
+
+
+def run_job(job):
+    """
+    Generates the report for a claimed job, from the turn scores when
+    INCREMENTAL_SCORING is on and they are available, else from the full
+    transcript. A session that already has a ReportCard is not evaluated again. Failures are retried with backoff until
+    REPORT_JOB_MAX_ATTEMPTS is reached.
+    """
+    started = time.perf_counter()
+    try:
+        unlocked_content = job.unlocked_content
+        if not ReportCard.objects.filter(session_id=job.session_id).exists():
+            session = job.session
+            evaluation_data = evaluate_incrementally(session) if settings.INCREMENTAL_SCORING else None
+            if evaluation_data:
+                with transaction.atomic():
+                    _, _, unlocked_cat, unlocked_sub, unlocked_lesson = save_evaluation(
+                        session, job.user, evaluation_data
+                    )
+            else:
+                user_messages = list(
+                    session.messages.filter(sender="user").values_list("content", flat=True)
+                )
+                ai_messages = list(
+                    session.messages.filter(sender="assistant").values_list("content", flat=True)
+                )
+                _, _, unlocked_cat, unlocked_sub, unlocked_lesson = process_evaluation(
+                    session, user_messages, ai_messages, session.id, job.user
+                )
+            unlocked_content = bool(unlocked_cat or unlocked_sub or unlocked_lesson)
+    except Exception as e:
+        logger.exception(f"Report job {job.pk} for session {job.session_id} failed: {e}")
+        _fail(job, e)
+        return
+    finally:
+        metrics.observe("report_jobs.run_seconds", time.perf_counter() - started)
+
+    finished_at = timezone.now()
+    ReportJob.objects.filter(pk=job.pk).update(
+        status=ReportJob.DONE, unlocked_content=unlocked_content, error="", finished_at=finished_at
+    )
+    job.status = ReportJob.DONE
+    job.unlocked_content = unlocked_content
+    metrics.incr("report_jobs.done")
+    ended_at = job.session.ended_at
+    if ended_at:
+        metrics.observe("report_jobs.chat_end_to_report_seconds", (finished_at - ended_at).total_seconds())
+
+
+def _fail(job, error):
+    if job.attempts >= settings.REPORT_JOB_MAX_ATTEMPTS:
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=ReportJob.FAILED, error=str(error), finished_at=timezone.now()
+        )
+        job.status = ReportJob.FAILED
+        metrics.incr("report_jobs.failed")
+        return
+    delay = backoff_delay(job.attempts, settings.REPORT_JOB_RETRY_BASE_DELAY, settings.REPORT_JOB_RETRY_MAX_DELAY)
+    ReportJob.objects.filter(pk=job.pk).update(
+        status=ReportJob.PENDING, error=str(error), available_at=timezone.now() + timedelta(seconds=delay)
+    )
+    job.status = ReportJob.PENDING
+    metrics.incr("report_jobs.retried")
+
+
+class ReportWorker:
+    """
+    Polls the queue and runs up to ``concurrency`` jobs at a time in a thread pool.
+    """
+
+    def __init__(self, concurrency, poll_interval):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self, once=False):
+        """
+        Works the queue until ``stop()`` is called, or until it is empty when
+        ``once`` is set. In-flight jobs are always finished before returning.
+        """
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="report-worker") as pool:
+            while not self._stopping.is_set():
+                close_old_connections()
+                in_flight = {future for future in in_flight if not future.done()}
+                free = self.concurrency - len(in_flight)
+                jobs = claim_jobs(free) if free > 0 else []
+                in_flight.update(pool.submit(self._run, job) for job in jobs)
+                metrics.set_gauge("report_jobs.in_flight", len(in_flight))
+
+                if not jobs and not in_flight:
+                    if once:
+                        break
+                    self._stopping.wait(self.poll_interval)
+                elif not jobs or len(in_flight) >= self.concurrency:
+                    # Nothing new to claim, or no free slot: wait for a job to finish.
+                    _, in_flight = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            wait(in_flight)
+        metrics.set_gauge("report_jobs.in_flight", 0)
+
+    def _run(self, job):
+        try:
+            run_job(job)
+        except Exception:
+            logger.exception(f"Report worker could not record the outcome of job {job.pk}")
+        finally:
+            # Worker threads are not requests, so nothing else closes their connection.
+            connection.close()
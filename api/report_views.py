@@ -6,11 +6,12 @@ from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
-from .models import ChatSession, ReportCard
+from .models import ChatSession, ReportCard, ReportJob
+from .supabase_auth import LazyAuthenticationMixin
 
 logger = logging.getLogger(__name__)
 
-class ReportCardDetailView(APIView):
+class ReportCardDetailView(LazyAuthenticationMixin, APIView):
     """
     GET /api/chat/sessions/<session_id>/report-card/
     Returns the report card for a specific chat session.
@@ -49,6 +50,7 @@ class ReportCardDetailView(APIView):
                     }
                 )
             ),
+            202: "Report generation is queued or running",
             404: "Not Found"
         }
         ,
@@ -66,6 +68,10 @@ class ReportCardDetailView(APIView):
             rc = ReportCard.objects.get(session=session)
             first_report = ReportCard.objects.filter(user=user).count() == 1
         except ReportCard.DoesNotExist:
+            job = ReportJob.objects.filter(session=session).first()
+            if job and job.status in (ReportJob.PENDING, ReportJob.RUNNING):
+                # Generation is queued or running (see ReportGenerationView); poll again.
+                return Response({"job_id": str(job.id), "status": job.status}, status=status.HTTP_202_ACCEPTED)
             return Response({"error": "Report card not found for this session."}, status=status.HTTP_404_NOT_FOUND)
 
         data = {
@@ -85,7 +91,7 @@ class ReportCardDetailView(APIView):
 
 
 
-class ReportCardListView(APIView):
+class ReportCardListView(LazyAuthenticationMixin, APIView):
     """
     GET /api/report-cards/
     Returns all report cards for the current user.
@@ -0,0 +1,273 @@
+"""
+Resilience helpers for calls to external services: bounded retries with capped
+exponential backoff and jitter, per-call deadlines, a circuit breaker and a
+concurrency bulkhead.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ResilienceError(Exception):
+    """Base class for failures raised by this module instead of calling the service."""
+
+
+class CircuitOpenError(ResilienceError):
+    pass
+
+
+class DeadlineExceeded(ResilienceError):
+    pass
+
+
+class BulkheadFull(ResilienceError):
+    """The call was shed: no free slot and the queue is full or the wait timed out."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast once ``failure_threshold`` consecutive failures have been seen.
+
+    After ``reset_timeout`` seconds in the open state a single trial call is let
+    through (half-open); its outcome closes or re-opens the circuit. The state is
+    published as the ``circuit.<name>.state`` gauge (0 closed, 1 half-open, 2 open).
+    Only exceptions listed in ``failure_exceptions`` count as failures, so e.g. an
+    invalid-credentials error from the service does not trip the breaker.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, failure_exceptions=(Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_exceptions = failure_exceptions
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._state = self.CLOSED
+        self._publish()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def call(self, fn, *args, **kwargs):
+        self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except self.failure_exceptions:
+            self._on_failure()
+            raise
+        except BaseException:
+            # Not a service failure, but a half-open trial has still finished.
+            self._release_trial()
+            raise
+        self._on_success()
+        return result
+
+    def _before_call(self):
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.OPEN or (self._state == self.HALF_OPEN and self._trial_in_flight):
+                metrics.incr(f"circuit.{self.name}.rejected")
+                raise CircuitOpenError(f"Circuit '{self.name}' is open")
+            if self._state == self.HALF_OPEN:
+                self._trial_in_flight = True
+
+    def _on_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def _on_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            metrics.incr(f"circuit.{self.name}.failures")
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self._state != self.OPEN:
+                    self._transition(self.OPEN)
+
+    def _release_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+
+    def _transition(self, state):
+        logger.warning(f"Circuit '{self.name}' {self._state} -> {state}")
+        self._state = state
+        metrics.incr(f"circuit.{self.name}.{state}")
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge(f"circuit.{self.name}.state", self.STATE_VALUES[self._state])
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """
+    Full-jitter exponential backoff: a random delay in [0, min(max_delay, base * 2**attempt)].
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_call(fn, *args, retry_on=(Exception,), attempts=3, base_delay=0.1, max_delay=2.0,
+               deadline=None, breaker=None, **kwargs):
+    """
+    Calls ``fn`` and retries it on ``retry_on`` exceptions.
+
+    Args:
+        attempts (int): Maximum number of calls, including the first one.
+        base_delay (float): Backoff base in seconds.
+        max_delay (float): Upper bound for a single backoff sleep.
+        deadline (float): Total time budget in seconds; no retry is started that
+            would sleep past it.
+        breaker (CircuitBreaker): Optional breaker every attempt goes through.
+
+    Raises:
+        CircuitOpenError: The breaker is open.
+        DeadlineExceeded: The deadline passed before the first attempt could start.
+        The last ``retry_on`` exception once attempts or the deadline are exhausted.
+    """
+    started = time.monotonic()
+    for attempt in range(attempts):
+        if deadline is not None and time.monotonic() - started >= deadline:
+            raise DeadlineExceeded(f"Deadline of {deadline}s exceeded")
+        try:
+            if breaker is not None:
+                return breaker.call(fn, *args, **kwargs)
+            return fn(*args, **kwargs)
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if deadline is not None and time.monotonic() - started + delay >= deadline:
+                raise
+            logger.warning(f"Retrying {getattr(fn, '__name__', fn)} in {delay:.2f}s after error: {e}")
+            metrics.incr("retry.attempts")
+            time.sleep(delay)
+
+
+class Bulkhead:
+    """
+    Limits a process to ``max_concurrent`` calls of one kind at a time.
+
+    Up to ``max_queue`` further callers wait at most ``queue_timeout`` seconds
+    for a slot; anyone else is shed with BulkheadFull right away, so a slow
+    service cannot tie up every worker thread. Sync and async callers share the
+    same slots. Published as the ``bulkhead.<name>.active`` and ``.queued``
+    gauges and the ``.shed`` counter.
+    """
+
+    ASYNC_POLL_INTERVAL = 0.01
+
+    def __init__(self, name, max_concurrent, max_queue=0, queue_timeout=1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = 0
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self):
+        with self._cond:
+            if self._try_acquire():
+                return
+            self._enqueue()
+            started = time.monotonic()
+            try:
+                while not self._try_acquire():
+                    remaining = self.queue_timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._shed("timeout")
+                    self._cond.wait(remaining)
+            finally:
+                self._dequeue(started)
+
+    async def aacquire(self):
+        """
+        Async variant of acquire; waits on the event loop instead of blocking it.
+        """
+        with self._cond:
+            if self._try_acquire():
+                return
+            self._enqueue()
+        started = time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(self.ASYNC_POLL_INTERVAL)
+                with self._cond:
+                    if self._try_acquire():
+                        return
+                    if time.monotonic() - started >= self.queue_timeout:
+                        self._shed("timeout")
+        finally:
+            with self._cond:
+                self._dequeue(started)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+            metrics.set_gauge(f"bulkhead.{self.name}.active", self._active)
+
+    # The helpers below are called with self._cond held.
+
+    def _try_acquire(self):
+        if self._active >= self.max_concurrent:
+            return False
+        self._active += 1
+        metrics.set_gauge(f"bulkhead.{self.name}.active", self._active)
+        return True
+
+    def _enqueue(self):
+        if self._queued >= self.max_queue:
+            self._shed("queue_full")
+        self._queued += 1
+        metrics.set_gauge(f"bulkhead.{self.name}.queued", self._queued)
+
+    def _dequeue(self, started):
+        self._queued -= 1
+        metrics.set_gauge(f"bulkhead.{self.name}.queued", self._queued)
+        metrics.observe(f"bulkhead.{self.name}.queue_seconds", time.monotonic() - started)
+
+    def _shed(self, reason):
+        metrics.incr(f"bulkhead.{self.name}.shed")
+        metrics.incr(f"bulkhead.{self.name}.shed.{reason}")
+        raise BulkheadFull(f"Bulkhead '{self.name}' is full ({reason})")
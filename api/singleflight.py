@@ -0,0 +1,177 @@
+"""
+Coalesces identical concurrent calls, so a double-tap or client retry that
+fires the same AI request twice pays for one provider call.
+
+Within a process, concurrent callers with the same key share the result of the
+first one (the leader). With ``shared`` on, the leader also takes a lock in the
+shared Django cache, so an identical call in another worker process waits for
+it instead of calling the provider again. The result is published under the
+leader's lock token, which only the calls that waited on that lock know: an
+identical call made after the leader finished makes its own call, so results
+are never reused across requests.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, name, shared=False, lock_timeout=60, result_timeout=10, share_result=None):
+        """
+        Args:
+            shared (bool): Also coalesce across processes through the shared cache.
+            lock_timeout (float): Longest a call is expected to take; other
+                processes stop waiting for it after this.
+            result_timeout (float): How long a published result stays in the
+                shared cache for the waiting processes to pick it up.
+            share_result (callable): Whether a result may be published to other
+                processes, e.g. not a fallback reply. Defaults to all results.
+        """
+        self.name = name
+        self.shared = shared
+        self.lock_timeout = lock_timeout
+        self.result_timeout = result_timeout
+        self.share_result = share_result or (lambda result: True)
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Returns ``fn(*args, **kwargs)``, or the result of an identical call
+        already in flight. Followers get the leader's exception too.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self._suppressed()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn, args, kwargs) if self.shared else fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """
+        Async variant of do for coroutine functions; coalesces the calls made
+        on the running event loop.
+        """
+        future = self._async_calls.get(key)
+        if future is not None:
+            self._suppressed()
+            return await asyncio.shield(future)
+
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            if self.shared:
+                result = await self._arun_shared(key, fn, args, kwargs)
+            else:
+                result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved; followers, if any, re-raise it themselves.
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[key]
+
+    def _lock_key(self, key):
+        return f"singleflight:{self.name}:{key}:lock"
+
+    def _result_key(self, key, token):
+        # Keyed by the leader's lock token, which only its waiters have seen.
+        return f"singleflight:{self.name}:{key}:result:{token}"
+
+    def _run_shared(self, key, fn, args, kwargs):
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        leader = None
+        locked = False
+        while True:
+            if leader is not None:
+                result = cache.get(self._result_key(key, leader), _MISSING)
+                if result is not _MISSING:
+                    self._suppressed()
+                    return result
+            locked = cache.add(lock_key, token, timeout=self.lock_timeout)
+            if locked or time.monotonic() >= deadline:
+                break
+            leader = cache.get(lock_key) or leader
+            time.sleep(self.POLL_INTERVAL)
+        try:
+            result = fn(*args, **kwargs)
+            if locked and self.share_result(result):
+                cache.set(self._result_key(key, token), result, timeout=self.result_timeout)
+            return result
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    async def _arun_shared(self, key, fn, args, kwargs):
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        leader = None
+        locked = False
+        while True:
+            if leader is not None:
+                result = await cache.aget(self._result_key(key, leader), _MISSING)
+                if result is not _MISSING:
+                    self._suppressed()
+                    return result
+            locked = await cache.aadd(lock_key, token, timeout=self.lock_timeout)
+            if locked or time.monotonic() >= deadline:
+                break
+            leader = await cache.aget(lock_key) or leader
+            await asyncio.sleep(self.POLL_INTERVAL)
+        try:
+            result = await fn(*args, **kwargs)
+            if locked and self.share_result(result):
+                await cache.aset(self._result_key(key, token), result, timeout=self.result_timeout)
+            return result
+        finally:
+            if locked:
+                await cache.adelete(lock_key)
+
+    def _suppressed(self):
+        metrics.incr(f"singleflight.{self.name}.suppressed")
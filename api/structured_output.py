@@ -0,0 +1,183 @@
+"""
+Parsing of the JSON objects the AI evaluators are asked for.
+
+An evaluator describes the object it expects with a StructuredOutput, which
+gives the instruction to add to its prompt and a tolerant parser: the object may
+be wrapped in a code fence or in prose, and replies in the older
+"label: value" formats are still understood. Values are validated (numbers
+coerced and clamped into range, required text present) and a reply that cannot
+be parsed raises StructuredOutputError. utils.parse_structured adds a single
+repair call and the ``structured_output.*`` metrics.
+"""
+import json
+import re
+
+from . import metrics
+
+# Provider JSON mode (OpenAI's response_format); the prompt must mention JSON.
+JSON_MODE = {"type": "json_object"}
+
+OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+LEADING_NUMBER_PATTERN = re.compile(r"[\s\"'*]*(-?\d+(?:\.\d+)?)")
+
+
+class StructuredOutputError(ValueError):
+    """The reply does not contain a valid object."""
+
+
+class Number:
+
+    def __init__(self, minimum=0, maximum=100, integer=False, required=True, default=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.integer = integer
+        self.required = required
+        self.default = default
+
+    def describe(self):
+        return f"<{'integer' if self.integer else 'number'} {self.minimum}-{self.maximum}>"
+
+    def clean(self, value):
+        """
+        Accepts numbers and text starting with one ("80/100"); clamps into range.
+        """
+        if isinstance(value, bool):
+            raise TypeError("Not a number")
+        if isinstance(value, str):
+            match = LEADING_NUMBER_PATTERN.match(value)
+            if not match:
+                raise ValueError("Not a number")
+            value = match.group(1)
+        number = max(self.minimum, min(self.maximum, float(value)))
+        return int(number) if self.integer else number
+
+
+class Text:
+
+    def __init__(self, description="text", required=True, default=""):
+        self.description = description
+        self.required = required
+        self.default = default
+
+    def describe(self):
+        return json.dumps(f"<{self.description}>")
+
+    def clean(self, value):
+        if not isinstance(value, str):
+            raise TypeError("Not text")
+        value = value.strip().strip("\"'*,{}").strip()
+        if not value and self.required:
+            raise ValueError("Empty text")
+        return value
+
+
+class StructuredOutput:
+
+    def __init__(self, name, fields, aliases=None):
+        """
+        Args:
+            name (str): Used in the metric names.
+            fields (dict): Field name to Number or Text, in prompt order.
+            aliases (dict): Other keys or labels accepted for a field.
+        """
+        self.name = name
+        self.fields = fields
+        self.labels = {field: [field, *(aliases or {}).get(field, [])] for field in fields}
+        self._group_fields = {}
+        alternatives = []
+        for field, labels in self.labels.items():
+            for label in labels:
+                group = f"label{len(self._group_fields)}"
+                self._group_fields[group] = field
+                # "engagement_score" also matches "Engagement Score" and "**engagement_score**".
+                alternatives.append(f"(?P<{group}>{re.escape(label).replace('_', '[ _]')})")
+        self._label_pattern = re.compile(
+            rf"(?<![\w])(?:{'|'.join(alternatives)})[\"'*\s]*[:=]", re.IGNORECASE
+        )
+
+    def instructions(self):
+        fields = ", ".join(f'"{field}": {kind.describe()}' for field, kind in self.fields.items())
+        return f"Answer only with a JSON object: {{{fields}}}"
+
+    def repair_messages(self, text):
+        """
+        Prompt asking the AI to restate an unparseable reply in the expected format.
+        """
+        return [
+            {
+                "role": "system",
+                "content": f"Restate the following evaluation without changing its content. {self.instructions()}",
+            },
+            {"role": "user", "content": text},
+        ]
+
+    def parse(self, text):
+        """
+        Returns the validated fields of the reply.
+
+        Raises:
+            StructuredOutputError: The reply does not contain a valid object.
+        """
+        error = StructuredOutputError(f"No {self.name} object in reply: {text!r}")
+        for raw in (self._from_json(text), self._from_labels(text)):
+            if not raw:
+                continue
+            try:
+                return self.validate(raw)
+            except StructuredOutputError as e:
+                error = e
+        raise error
+
+    def validate(self, raw):
+        result = {}
+        for field, kind in self.fields.items():
+            value = raw.get(field)
+            if value is None:
+                if kind.required:
+                    raise StructuredOutputError(f"{self.name}: missing {field}")
+                result[field] = kind.default
+                continue
+            try:
+                result[field] = kind.clean(value)
+            except (TypeError, ValueError) as e:
+                raise StructuredOutputError(f"{self.name}: invalid {field} {value!r}") from e
+        return result
+
+    def record(self, outcome):
+        """
+        Counts a parse ``outcome`` (parsed, repaired or failed) and updates the
+        failure rate gauge.
+        """
+        prefix = f"structured_output.{self.name}"
+        metrics.incr(f"{prefix}.{outcome}")
+        counts = [metrics.get_counter(f"{prefix}.{name}") for name in ("parsed", "repaired", "failed")]
+        metrics.set_gauge(f"{prefix}.failure_rate", round(counts[2] / sum(counts), 3))
+
+    def _from_json(self, text):
+        match = OBJECT_PATTERN.search(text)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group())
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        data = {str(key).lower(): value for key, value in data.items()}
+        raw = {}
+        for field, labels in self.labels.items():
+            for label in labels:
+                if label.lower() in data:
+                    raw[field] = data[label.lower()]
+                    break
+        return raw
+
+    def _from_labels(self, text):
+        # Each value runs up to the next label.
+        matches = list(self._label_pattern.finditer(text))
+        raw = {}
+        for match, following in zip(matches, matches[1:] + [None]):
+            field = self._group_fields[match.lastgroup]
+            if field not in raw:
+                raw[field] = text[match.end():following.start() if following else len(text)]
+        return raw
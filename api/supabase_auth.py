@@ -4,25 +4,199 @@ from django.contrib.auth.backends import BaseBackend
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework.authentication import BaseAuthentication
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.exceptions import APIException, AuthenticationFailed
 from datetime import datetime
 import pytz
-from supabase import create_client, Client
 import logging
 logger = logging.getLogger(__name__)
 from gotrue.errors import AuthApiError, AuthRetryableError
+import hashlib
+import time
+from .caching import TTLCache
+from . import metrics
+from .user_resolver import user_resolver
+from .resilience import CircuitBreaker, ResilienceError, retry_call
+from .http_client import get_http_client
+from .clients import get_supabase_client
+import httpx
 
 
 User = get_user_model()
 
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+User = get_user_model()
 
+# Algorithms we accept for local verification. HS256 uses the project JWT secret,
+# the asymmetric ones are resolved through the project's JWKS.
+SHARED_SECRET_ALGORITHMS = ["HS256"]
+JWKS_ALGORITHMS = ["RS256", "ES256"]
 
-User = get_user_model()
+# Verified user data keyed by sha256(token), so repeat requests skip verification.
+token_cache = TTLCache(
+    maxsize=settings.SUPABASE_TOKEN_CACHE_SIZE,
+    ttl=settings.SUPABASE_TOKEN_CACHE_TTL,
+)
+
+# Rejection messages of recently refused tokens, keyed by sha256(token), so a
+# client retrying a stale token does not cost a verification each time.
+rejected_token_cache = TTLCache(
+    maxsize=settings.SUPABASE_TOKEN_CACHE_SIZE,
+    ttl=settings.SUPABASE_NEGATIVE_CACHE_TTL,
+)
+
+EXPIRED_TOKEN_MESSAGE = "Token expired. Please log in again."
+MALFORMED_TOKEN_MESSAGE = "Authentication error: invalid JWT: unable to parse or verify signature, token is malformed"
+
+_jwks_client = None
+
+# Shared by every Supabase auth call in this process (token checks, login, signup).
+# Only retryable (network / 5xx) errors count towards opening the circuit.
+supabase_auth_breaker = CircuitBreaker(
+    "supabase_auth",
+    failure_threshold=settings.SUPABASE_AUTH_BREAKER_THRESHOLD,
+    reset_timeout=settings.SUPABASE_AUTH_BREAKER_RESET_SECONDS,
+    failure_exceptions=(AuthRetryableError,),
+)
+
+
+class SupabaseUnavailable(APIException):
+    status_code = 503
+    default_detail = "Authentication service temporarily unavailable. Please try again shortly."
+    default_code = "service_unavailable"
+
+
+def call_supabase_auth(fn, *args, **kwargs):
+    """
+    Calls a Supabase auth SDK method with bounded retries, backoff, a deadline
+    and the shared circuit breaker.
+
+    Raises:
+        ResilienceError: The circuit is open or the deadline passed.
+        AuthRetryableError: Supabase kept failing until retries ran out.
+        AuthApiError: Supabase rejected the request; never retried.
+    """
+    return retry_call(
+        fn,
+        *args,
+        retry_on=(AuthRetryableError,),
+        attempts=settings.SUPABASE_AUTH_RETRY_ATTEMPTS,
+        base_delay=settings.SUPABASE_AUTH_RETRY_BASE_DELAY,
+        max_delay=settings.SUPABASE_AUTH_RETRY_MAX_DELAY,
+        deadline=settings.SUPABASE_AUTH_DEADLINE_SECONDS,
+        breaker=supabase_auth_breaker,
+        **kwargs,
+    )
+
+
+class LocalVerificationUnavailable(Exception):
+    """
+    Raised when a token cannot be verified in-process (no secret configured,
+    unknown key id, unsupported algorithm...) and Supabase must be asked instead.
+    """
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def get_jwks_client():
+    global _jwks_client
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(
+            settings.SUPABASE_JWKS_URL,
+            cache_keys=True,
+            lifespan=settings.SUPABASE_JWKS_CACHE_SECONDS,
+            headers={"apikey": settings.SUPABASE_ANON_KEY},
+        )
+    return _jwks_client
+
+
+def verify_token_locally(token):
+    """
+    Verifies the token signature, expiry, audience and issuer without a network round
+    trip (apart from an occasional JWKS refresh) and returns its claims.
+
+    Raises:
+        jwt.InvalidTokenError: The token is malformed, expired or has the wrong
+            audience or issuer.
+        LocalVerificationUnavailable: The token has to be checked by Supabase.
+    """
+    try:
+        algorithm = jwt.get_unverified_header(token).get("alg")
+    except jwt.DecodeError as e:
+        raise LocalVerificationUnavailable(f"Unreadable token header: {e}")
+
+    if algorithm in SHARED_SECRET_ALGORITHMS:
+        if not settings.SUPABASE_JWT_SECRET:
+            raise LocalVerificationUnavailable("SUPABASE_JWT_SECRET is not configured")
+        key = settings.SUPABASE_JWT_SECRET
+    elif algorithm in JWKS_ALGORITHMS:
+        try:
+            key = get_jwks_client().get_signing_key_from_jwt(token).key
+        except (jwt.PyJWKClientError, jwt.DecodeError) as e:
+            raise LocalVerificationUnavailable(f"JWKS lookup failed: {e}")
+    else:
+        raise LocalVerificationUnavailable(f"Unsupported algorithm {algorithm}")
+
+    try:
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=settings.SUPABASE_JWT_AUDIENCE,
+            issuer=settings.SUPABASE_JWT_ISSUER or None,
+            options={"require": ["exp", "sub"]},
+        )
+    except jwt.InvalidSignatureError as e:
+        # A rotated secret or key should not lock everybody out; let Supabase decide.
+        logger.warning(f"Local JWT signature check failed, falling back to Supabase: {e}")
+        raise LocalVerificationUnavailable(str(e))
+
+
+def user_data_from_claims(claims):
+    return {
+        "id": claims.get("sub"),
+        "email": claims.get("email") or None,
+        "is_anonymous": claims.get("is_anonymous", False),
+    }
+
+
+def token_cache_ttl(claims):
+    """
+    Seconds the verification result for a token may be cached: never past the
+    token's own expiry and never longer than SUPABASE_TOKEN_CACHE_TTL.
+    """
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)):
+        return settings.SUPABASE_TOKEN_CACHE_TTL
+    return min(settings.SUPABASE_TOKEN_CACHE_TTL, int(exp - time.time()))
+
+
+def precheck_token(token):
+    """
+    Rejects tokens that can never be valid without any network call and returns
+    the (unverified) claims of the others.
+
+    The messages match the ones produced by the full verification path, so
+    clients only see a difference in latency.
+    """
+    if token.count(".") != 2:
+        raise AuthenticationFailed(MALFORMED_TOKEN_MESSAGE)
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.InvalidTokenError:
+        raise AuthenticationFailed(MALFORMED_TOKEN_MESSAGE)
+
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)) and exp < time.time() - settings.SUPABASE_JWT_LEEWAY_SECONDS:
+        raise AuthenticationFailed(EXPIRED_TOKEN_MESSAGE)
+    return claims
 
 class SupabaseAuthentication(BaseAuthentication):
     """
     Custom authentication class to verify Supabase JWT tokens.
+
+    Tokens are verified in-process when possible and the result is cached per
+    token; Supabase's get_user endpoint is only used as a fallback.
     """
 
     def authenticate(self, request):
@@ -35,41 +209,88 @@ class SupabaseAuthentication(BaseAuthentication):
         except IndexError:
             token = auth_header  # Handle case where there is no "Bearer " prefix
 
+        cache_key = hash_token(token)
+        user_data = token_cache.get(cache_key)
+        if user_data is None:
+            rejection = rejected_token_cache.get(cache_key)
+            if rejection is not None:
+                metrics.incr("auth.rejected_cache_hit")
+                raise AuthenticationFailed(rejection)
+            try:
+                claims = precheck_token(token)
+                user_data = self.verify_token(token)
+            except AuthenticationFailed as e:
+                rejected_token_cache.set(cache_key, e.detail)
+                raise
+            token_cache.set(cache_key, user_data, ttl=token_cache_ttl(claims))
+
+        email = user_data.get("email")
+
+        if user_data.get("is_anonymous") and not email:
+            user_id = user_data.get("id")
+            email = f"guest_{str(user_id)}@guestuser.com"
+
+        if not email:
+            raise AuthenticationFailed("Email not found in Supabase token")
+
+        # Ensure user exists in Django and return it
+        user = user_resolver.resolve(email)
+        return user, None  # Now request.user is a Django User instance
+
+    def verify_token(self, token):
+        """
+        Returns the user data ({"id", "email", "is_anonymous"}) for a valid token.
+        """
+        if settings.SUPABASE_JWT_VERIFY_LOCALLY:
+            try:
+                return user_data_from_claims(verify_token_locally(token))
+            except jwt.ExpiredSignatureError:
+                raise AuthenticationFailed(EXPIRED_TOKEN_MESSAGE)
+            except jwt.InvalidTokenError as e:
+                raise AuthenticationFailed(f"Authentication error: {str(e)}")
+            except LocalVerificationUnavailable as e:
+                logger.info(f"Verifying token with Supabase: {e}")
+
+        return self.verify_token_remotely(token)
+
+    def verify_token_remotely(self, token):
         try:
-            while True:
-                try:
-                    # Validate the token using Supabase API
-                    response = supabase.auth.get_user(token)
-                    if not response:
-                        raise AuthenticationFailed("Invalid Supabase token")
-
-                    response = response.model_dump()
-                    user_data = response.get("user")
-                    email = user_data.get("email")
-
-                    if user_data.get("is_anonymous") and not email:
-                        user_id = user_data.get("id")
-                        email = f"guest_{str(user_id)}@guestuser.com"
-
-                    if not email:
-                        raise AuthenticationFailed("Email not found in Supabase token")
-
-                    # Ensure user exists in Django and return it
-                    user, created = User.objects.get_or_create(email=email)
-                    return user, None  # Now request.user is a Django User instance
-    
-                except AuthRetryableError as e:
-                    logger.error(f"Supabase error: {e} | retrying....")
-                    continue
-        
+            # Validate the token using Supabase API
+            response = call_supabase_auth(get_supabase_client().auth.get_user, token)
+            if not response:
+                raise AuthenticationFailed("Invalid Supabase token")
+
+            response = response.model_dump()
+            user_data = response.get("user")
+            return {
+                "id": user_data.get("id"),
+                "email": user_data.get("email"),
+                "is_anonymous": user_data.get("is_anonymous"),
+            }
+
+        except (ResilienceError, AuthRetryableError) as e:
+            logger.error(f"Supabase unavailable: {e}")
+            raise SupabaseUnavailable()
         except AuthApiError as e:
             if "token is expired" in str(e):
-                raise AuthenticationFailed("Token expired. Please log in again.")
+                raise AuthenticationFailed(EXPIRED_TOKEN_MESSAGE)
             raise AuthenticationFailed(f"Authentication error: {str(e)}")
         
 
 
 
+class LazyAuthenticationMixin:
+    """
+    APIView mixin that defers authentication until ``request.user`` or
+    ``request.auth`` is first read (by a permission class, a throttle or the
+    view itself). Public endpoints therefore never verify the bearer token,
+    even when the client sends one.
+    """
+
+    def perform_authentication(self, request):
+        pass
+
+
 class SupabaseAuthBackend(BaseBackend):
     """
     Custom authentication backend for Django that verifies Supabase JWT tokens.
@@ -80,7 +301,11 @@ class SupabaseAuthBackend(BaseBackend):
             return None
         
         headers = {"Authorization": f"Bearer {token}", "apikey": settings.SUPABASE_ANON_KEY}
-        response = requests.get(f"{settings.SUPABASE_URL}/auth/v1/user", headers=headers)
+        try:
+            response = get_http_client().get(f"{settings.SUPABASE_URL}/auth/v1/user", headers=headers)
+        except httpx.HTTPError as e:
+            logger.error(f"Supabase user lookup failed: {e}")
+            return None
 
         if response.status_code != 200:
             return None  # Token is invalid
@@ -92,8 +317,7 @@ class SupabaseAuthBackend(BaseBackend):
             return None
 
         # Get or create Django user (this does not create a password)
-        user, created = User.objects.get_or_create(email=email)
-        return user
+        return user_resolver.resolve(email)
 
     def get_user(self, user_id):
         try:
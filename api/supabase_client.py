@@ -0,0 +1,27 @@
+from supabase import Client, SupabaseAuthClient
+
+from .http_client import get_http_client
+
+
+class PooledSupabaseClient(Client):
+    """
+    Supabase client whose auth API uses the shared pooled HTTP client.
+    """
+
+    @staticmethod
+    def _init_supabase_auth_client(auth_url, client_options, verify=True, proxy=None):
+        return SupabaseAuthClient(
+            url=auth_url,
+            auto_refresh_token=client_options.auto_refresh_token,
+            persist_session=client_options.persist_session,
+            storage=client_options.storage,
+            headers=client_options.headers,
+            flow_type=client_options.flow_type,
+            http_client=get_http_client(),
+            verify=verify,
+            proxy=proxy,
+        )
+
+
+def create_supabase_client(supabase_url, supabase_key):
+    return PooledSupabaseClient.create(supabase_url, supabase_key)
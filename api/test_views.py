@@ -1,14 +1,17 @@
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from dotenv import load_dotenv
 import logging
 
+from .supabase_auth import LazyAuthenticationMixin
+from .health import readiness_prober
+
 
 # Protected Route
-class ProtectedView(APIView):
+class ProtectedView(LazyAuthenticationMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
@@ -16,11 +19,42 @@ class ProtectedView(APIView):
     
 
 # HealthCheck
-class HealthCheck(APIView):
+class HealthCheck(LazyAuthenticationMixin, APIView):
     @swagger_auto_schema(
         operation_summary="Check server health",
         responses={200: "Server is running"}
     )
 
     def get(self, request):
-        return Response({"message": f"Hello, I am running!"})
\ No newline at end of file
+        return Response({"message": f"Hello, I am running!"})
+
+
+# Liveness probe: in-process only, no authentication and no dependencies
+class LivenessView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Liveness probe",
+        responses={200: "Process is alive"}
+    )
+    def get(self, request):
+        return Response({"status": "ok"})
+
+
+# Readiness probe: Postgres, LLM provider and Supabase, cached by a background prober
+class ReadinessView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Readiness probe",
+        operation_description="Returns the last cached result of the database, LLM provider and Supabase checks.",
+        responses={200: "All dependencies are reachable", 503: "At least one dependency is failing"}
+    )
+    def get(self, request):
+        result = readiness_prober.status()
+        return Response(
+            result,
+            status=status.HTTP_200_OK if result["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+        )
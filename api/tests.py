@@ -1,3 +1,1386 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from gotrue.errors import AuthApiError, AuthRetryableError
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from . import http_client, metrics, supabase_auth
+from .async_views import AsyncChatMessageView, AsyncChatSessionView, AsyncReportGenerationView
+from .clients import get_supabase_client
+from .http_client import get_http_client
+from .supabase_client import create_supabase_client
+from .chat_service import CHAT_ENDED_MESSAGE, build_context, count_tokens
+from .context_summary import summarise_session
+from .health import ReadinessProber, check_database
+from .conversation_cache import conversation_cache
+from .llm_router import LLMRouter, Provider
+from .resilience import (
+    Bulkhead, BulkheadFull, CircuitBreaker, CircuitOpenError, DeadlineExceeded, retry_call,
+)
+from .singleflight import SingleFlight
+from .structured_output import JSON_MODE, Number, StructuredOutput, StructuredOutputError, Text
+from .models import ChatBot, ChatMessage, ChatSession, OpeningMessage, ReportCard, ReportJob, TurnScore, User
+from .openers import prompt_hash, refill_all, refill_pool
+from .renderers import format_event
+from .report_jobs import await_report, claim_jobs, run_job
+from .turn_scoring import TURN_OUTPUT, score_turn
+from .user_resolver import user_resolver
+from .utils import (
+    AI_FALLBACK_MESSAGE, LLMOverloaded, get_ai_response, llm_background_bulkhead, llm_bulkhead, llm_calls,
+    parse_structured,
+)
+
+
+def make_token(email="user@example.com"):
+    return jwt.encode(
+        {"sub": "user-id", "email": email, "aud": "authenticated", "exp": int(time.time()) + 3600},
+        "not-the-project-secret",
+    )
+
+
+@override_settings(SUPABASE_JWT_VERIFY_LOCALLY=False)
+class OutboundAuthCallsTest(TestCase):
+    """
+    Counts the Supabase get_user calls each endpoint makes when the client
+    sends a bearer token.
+    """
+
+    def setUp(self):
+        supabase_auth.token_cache.clear()
+        supabase_auth.rejected_token_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token()}")
+        user_response = mock.Mock()
+        user_response.model_dump.return_value = {
+            "user": {"id": "user-id", "email": "user@example.com", "is_anonymous": False}
+        }
+        patcher = mock.patch.object(get_supabase_client().auth, "get_user", return_value=user_response)
+        self.get_user = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_public_bot_list_does_not_authenticate(self):
+        response = self.client.get(reverse("chat_bots"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_user.call_count, 0)
+
+    def test_login_does_not_authenticate(self):
+        with mock.patch.object(get_supabase_client().auth, "sign_in_with_password", side_effect=Exception("bad")):
+            response = self.client.post(reverse("login"), {"email": "a@b.com", "password": "x"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.get_user.call_count, 0)
+
+    def test_protected_endpoint_authenticates_once(self):
+        response = self.client.get(reverse("protected"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_user.call_count, 1)
+
+    def test_repeat_requests_use_token_cache(self):
+        self.client.get(reverse("protected"))
+        self.client.get(reverse("reportcard-list"))
+        self.assertEqual(self.get_user.call_count, 1)
+
+
+class RunBenchmarksCommandTest(TestCase):
+
+    def test_test_database_benchmarks_need_flag(self):
+        with mock.patch("api.benchmarks.throwaway_database") as throwaway_database:
+            with self.assertRaises(CommandError):
+                call_command("run_benchmarks", "time_to_report")
+        throwaway_database.assert_not_called()
+
+    def test_run_all_skips_test_database_benchmarks(self):
+        stderr = StringIO()
+        ran = []
+        benchmarks = {
+            name: mock.Mock(uses_test_db=uses_test_db, side_effect=lambda repeat, name=name: ran.append(name) or {})
+            for name, uses_test_db in [("fast", False), ("time_to_report", True)]
+        }
+        with mock.patch.dict("api.management.commands.run_benchmarks.BENCHMARKS", benchmarks, clear=True):
+            call_command("run_benchmarks", "--json", stdout=StringIO(), stderr=stderr)
+        self.assertEqual(ran, ["fast"])
+        self.assertIn("time_to_report", stderr.getvalue())
+
+
+class SharedHttpClientTest(TestCase):
+
+    def test_supabase_callers_share_one_client(self):
+        client = get_http_client()
+        self.assertIs(get_supabase_client().auth._http_client, client)
+        # Any other SDK client, e.g. one with the service role key.
+        service_role = create_supabase_client(settings.SUPABASE_URL, make_token())
+        self.assertIs(service_role.auth._http_client, client)
+
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"email": "user@example.com"}
+        with mock.patch.object(client, "get", return_value=response) as get:
+            user = supabase_auth.SupabaseAuthBackend().authenticate(None, token="token")
+        self.assertEqual(user.email, "user@example.com")
+        self.assertEqual(get.call_args.kwargs["headers"]["Authorization"], "Bearer token")
+
+    def test_pool_stats(self):
+        get_http_client()
+        self.assertEqual(set(http_client.pool_stats()), {"connections", "idle", "busy"})
+        # httpx internals moved, e.g. after an upgrade: no stats, no error.
+        with mock.patch.object(http_client, "_client", SimpleNamespace(_transport=object())):
+            self.assertEqual(http_client.pool_stats(), {})
+            http_client.publish_pool_stats()
+
+
+class UserResolverTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user_resolver.local.clear()
+
+    def assertNotCached(self, email):
+        self.assertNotIn(email, user_resolver.local)
+        self.assertIsNone(cache.get(user_resolver._email_key(email)))
+
+    def test_repeat_resolve_runs_no_queries(self):
+        user = user_resolver.resolve("user@example.com")
+        with self.assertNumQueries(0):
+            self.assertEqual(user_resolver.resolve("user@example.com").pk, user.pk)
+        user_resolver.local.clear()
+        with self.assertNumQueries(0):
+            cached = user_resolver.resolve("user@example.com")
+        self.assertEqual((cached.pk, cached.email, cached.is_active), (user.pk, user.email, True))
+
+    def test_save_evicts_cached_user(self):
+        user = user_resolver.resolve("user@example.com")
+        user.is_active = False
+        user.save()
+        self.assertNotCached("user@example.com")
+        self.assertFalse(user_resolver.resolve("user@example.com").is_active)
+
+    def test_email_change_evicts_old_email(self):
+        user_resolver.resolve("old@example.com")
+        user = user_resolver.resolve("old@example.com")  # Cached instance, password deferred
+        user.email = "new@example.com"
+        user.save()
+        self.assertNotCached("old@example.com")
+        self.assertEqual(user_resolver.resolve("new@example.com").pk, user.pk)
+        self.assertNotEqual(user_resolver.resolve("old@example.com").pk, user.pk)
+
+    def test_delete_evicts_cached_user(self):
+        user = user_resolver.resolve("user@example.com")
+        User.objects.get(pk=user.pk).delete()
+        self.assertNotCached("user@example.com")
+        self.assertNotEqual(user_resolver.resolve("user@example.com").pk, user.pk)
+        self.assertEqual(User.objects.count(), 1)
+
+
+@override_settings(SUPABASE_JWT_VERIFY_LOCALLY=True, SUPABASE_JWT_SECRET="project-secret")
+class LocalTokenVerificationTest(TestCase):
+
+    def setUp(self):
+        supabase_auth.token_cache.clear()
+        supabase_auth.rejected_token_cache.clear()
+        self.client = APIClient()
+        user_response = mock.Mock()
+        user_response.model_dump.return_value = {
+            "user": {"id": "user-id", "email": "user@example.com", "is_anonymous": False}
+        }
+        patcher = mock.patch.object(get_supabase_client().auth, "get_user", return_value=user_response)
+        self.get_user = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def sign(secret="project-secret", **claims):
+        claims = {"sub": "user-id", "email": "user@example.com", "aud": "authenticated",
+                  "exp": int(time.time()) + 3600, **claims}
+        return jwt.encode(claims, secret)
+
+    def get(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        return self.client.get(reverse("protected"))
+
+    def assertRejected(self, response):
+        # SupabaseAuthentication has no authenticate_header, so DRF answers 403.
+        self.assertEqual(response.status_code, 403)
+
+    def test_valid_token_is_verified_locally(self):
+        self.assertEqual(self.get(self.sign()).status_code, 200)
+        self.assertEqual(self.get_user.call_count, 0)
+
+    def test_bad_signature_falls_back_to_supabase(self):
+        with self.assertLogs("api.supabase_auth", "WARNING"):
+            response = self.get(self.sign(secret="rotated-secret"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_user.call_count, 1)
+
+    def test_wrong_audience_is_rejected(self):
+        self.assertRejected(self.get(self.sign(aud="anon")))
+        self.assertEqual(self.get_user.call_count, 0)
+
+    @override_settings(SUPABASE_JWT_ISSUER="https://project.supabase.co/auth/v1")
+    def test_wrong_issuer_is_rejected(self):
+        self.assertEqual(self.get(self.sign(iss="https://project.supabase.co/auth/v1")).status_code, 200)
+        self.assertRejected(self.get(self.sign(iss="https://other.supabase.co/auth/v1")))
+        self.assertEqual(self.get_user.call_count, 0)
+
+    def test_expired_token_is_rejected(self):
+        # Within the precheck leeway, so the signature check sees the expiry.
+        token = self.sign(exp=int(time.time()) - 5)
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            supabase_auth.verify_token_locally(token)
+        response = self.get(token)
+        self.assertRejected(response)
+        self.assertEqual(str(response.data["detail"]), supabase_auth.EXPIRED_TOKEN_MESSAGE)
+        self.assertEqual(self.get_user.call_count, 0)
+
+    def test_unknown_key_id_falls_back_to_supabase(self):
+        header = jwt.utils.base64url_encode(b'{"alg": "RS256", "kid": "rotated-key"}').decode()
+        payload = self.sign().split(".")[1]
+        token = f"{header}.{payload}.c2lnbmF0dXJl"
+        jwks_client = mock.Mock()
+        jwks_client.get_signing_key_from_jwt.side_effect = jwt.PyJWKClientError(
+            'Unable to find a signing key that matches: "rotated-key"'
+        )
+        with mock.patch.object(supabase_auth, "get_jwks_client", return_value=jwks_client):
+            response = self.get(token)
+        self.assertEqual(response.status_code, 200)
+        jwks_client.get_signing_key_from_jwt.assert_called_once_with(token)
+        self.assertEqual(self.get_user.call_count, 1)
+
+    def test_cached_verification_does_not_outlive_token(self):
+        token = self.sign(exp=int(time.time()) + 5)
+        self.assertEqual(self.get(token).status_code, 200)
+        self.assertLessEqual(supabase_auth.token_cache_ttl(jwt.decode(token, options={"verify_signature": False})), 5)
+        with mock.patch("api.caching.time.monotonic", return_value=time.monotonic() + 6):
+            self.assertIsNone(supabase_auth.token_cache.get(supabase_auth.hash_token(token)))
+
+
+class HealthViewsTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer not-a-jwt")
+
+    @staticmethod
+    def failing_check():
+        raise ConnectionError("connect to 10.0.0.5:5432 failed: password authentication failed")
+
+    def probe(self, checks):
+        prober = ReadinessProber(checks, interval=60)
+        with mock.patch("api.test_views.readiness_prober", prober), \
+                mock.patch.object(prober, "_start") as start:
+            response = self.client.get(reverse("ready"))
+        start.assert_called_once_with()
+        return response
+
+    def test_liveness(self):
+        with mock.patch("api.test_views.readiness_prober") as prober:
+            response = self.client.get(reverse("live"))
+        self.assertEqual((response.status_code, response.data), (200, {"status": "ok"}))
+        prober.status.assert_not_called()
+
+    def test_ready(self):
+        with mock.patch("api.health.connection.close") as close:
+            response = self.probe({"database": check_database, "llm": lambda: None})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["ready"])
+        self.assertEqual(set(response.data["checks"]), {"database", "llm"})
+        # The first probe runs on the request thread, whose connection Django manages.
+        close.assert_not_called()
+
+    def test_failing_check_is_not_described_to_callers(self):
+        with self.assertLogs("api.health", "ERROR") as logs:
+            response = self.probe({"database": check_database, "supabase": self.failing_check})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.data["ready"])
+        self.assertEqual(response.data["checks"]["supabase"]["ok"], False)
+        self.assertNotIn("error", response.data["checks"]["supabase"])
+        self.assertNotIn("password", str(response.data))
+        self.assertIn("password authentication failed", "\n".join(logs.output))
+
+    def test_refresh_thread_closes_its_connection(self):
+        prober = ReadinessProber({"database": check_database}, interval=60)
+        with mock.patch("api.health.time.sleep", side_effect=[None, StopIteration]), \
+                mock.patch("api.health.connection.close") as close, \
+                self.assertRaises(StopIteration):
+            prober._loop()
+        close.assert_called_once_with()
+        self.assertTrue(prober.status()["ready"])
+
+
+@override_settings(SUPABASE_JWT_VERIFY_LOCALLY=False, SUPABASE_AUTH_RETRY_ATTEMPTS=1)
+class RejectedTokenCacheTest(TestCase):
+
+    def setUp(self):
+        supabase_auth.token_cache.clear()
+        supabase_auth.rejected_token_cache.clear()
+        self.client = APIClient()
+        user_response = mock.Mock()
+        user_response.model_dump.return_value = {
+            "user": {"id": "user-id", "email": "user@example.com", "is_anonymous": False}
+        }
+        patcher = mock.patch.object(get_supabase_client().auth, "get_user", return_value=user_response)
+        self.get_user = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        return self.client.get(reverse("protected"))
+
+    def assertRejectedWith(self, response, message):
+        self.assertEqual((response.status_code, str(response.data["detail"])), (403, message))
+
+    # The messages clients saw before tokens were prechecked and rejections cached.
+    MALFORMED = "Authentication error: invalid JWT: unable to parse or verify signature, token is malformed"
+    EXPIRED = "Token expired. Please log in again."
+
+    def test_malformed_token_is_rejected_without_supabase(self):
+        hits = metrics.get_counter("auth.rejected_cache_hit")
+        for _ in range(2):
+            self.assertRejectedWith(self.get("not-a-jwt"), self.MALFORMED)
+        self.assertRejectedWith(self.get("bm90.YS1qd3Q.c2ln"), self.MALFORMED)
+        self.assertEqual(self.get_user.call_count, 0)
+        self.assertEqual(metrics.get_counter("auth.rejected_cache_hit"), hits + 1)
+
+    def test_expired_token_is_rejected_without_supabase(self):
+        token = jwt.encode(
+            {"sub": "user-id", "aud": "authenticated", "exp": int(time.time()) - 3600}, "not-the-project-secret"
+        )
+        self.assertRejectedWith(self.get(token), self.EXPIRED)
+        self.assertEqual(self.get_user.call_count, 0)
+
+    def test_supabase_rejection_is_cached(self):
+        token = make_token()
+        self.get_user.side_effect = AuthApiError("invalid JWT: token has invalid claims", 403, "bad_jwt")
+        self.assertRejectedWith(self.get(token), "Authentication error: invalid JWT: token has invalid claims")
+        self.assertRejectedWith(self.get(token), "Authentication error: invalid JWT: token has invalid claims")
+        self.assertEqual(self.get_user.call_count, 1)
+
+    def test_supabase_expiry_and_empty_response_keep_their_messages(self):
+        self.get_user.side_effect = AuthApiError("invalid JWT: token is expired", 403, "bad_jwt")
+        self.assertRejectedWith(self.get(make_token("expired@example.com")), self.EXPIRED)
+        self.get_user.side_effect = None
+        self.get_user.return_value = None
+        self.assertRejectedWith(self.get(make_token("empty@example.com")), "Invalid Supabase token")
+
+    def test_transient_failure_is_not_cached(self):
+        token = make_token()
+        user_response = self.get_user.return_value
+        self.get_user.side_effect = AuthRetryableError("Supabase is down", 503)
+        with self.assertLogs("api.supabase_auth", "ERROR"):
+            self.assertEqual(self.get(token).status_code, 503)
+        self.get_user.side_effect = None
+        self.get_user.return_value = user_response
+        self.assertEqual(self.get(token).status_code, 200)
+        self.assertEqual(self.get_user.call_count, 2)
+
+
+@override_settings(INCREMENTAL_SCORING=False)
+@override_settings(RATE_LIMITS={"auth_login": "2/min", "chat_message": "2/min"})
+class TokenBucketThrottleTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1_700_000_000.0
+        clock = SimpleNamespace(time=lambda: self.now, perf_counter=time.perf_counter)
+        patcher = mock.patch("api.throttling.time", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def login(self, ip="10.0.0.1"):
+        with mock.patch.object(get_supabase_client().auth, "sign_in_with_password", side_effect=Exception("bad")):
+            return self.client.post(reverse("login"), {"email": "a@b.com", "password": "x"}, REMOTE_ADDR=ip)
+
+    def send(self, user, ip):
+        self.client.force_authenticate(user)
+        url = reverse("chat_messages", args=["00000000-0000-0000-0000-000000000000"])
+        return self.client.post(url, {"message": "hi"}, format="json", REMOTE_ADDR=ip)
+
+    def test_burst_is_admitted_then_denied(self):
+        first, second, third = self.login(), self.login(), self.login()
+        self.assertEqual([first.status_code, second.status_code, third.status_code], [401, 401, 429])
+        self.assertEqual(
+            [(r["RateLimit-Limit"], r["RateLimit-Remaining"], r["RateLimit-Reset"]) for r in (first, second)],
+            [("2", "1", "30"), ("2", "0", "60")],
+        )
+        self.assertEqual((third["RateLimit-Remaining"], third["Retry-After"]), ("0", "30"))
+
+    def test_bucket_refills_at_rate(self):
+        self.login(), self.login()
+        self.now += 29
+        self.assertEqual(self.login().status_code, 429)
+        self.now += 1
+        response = self.login()
+        self.assertEqual((response.status_code, response["RateLimit-Remaining"]), (401, "0"))
+        self.now += 60
+        self.assertEqual(self.login()["RateLimit-Remaining"], "1")
+
+    def test_anonymous_requests_are_keyed_by_ip(self):
+        self.login(), self.login()
+        self.assertEqual(self.login().status_code, 429)
+        self.assertEqual(self.login(ip="10.0.0.2").status_code, 401)
+
+    def test_authenticated_requests_are_keyed_by_user(self):
+        user = User.objects.create(email="user@example.com")
+        self.assertEqual([self.send(user, ip).status_code for ip in ("10.0.0.1", "10.0.0.2")], [404, 404])
+        self.assertEqual(self.send(user, "10.0.0.3").status_code, 429)
+        other = User.objects.create(email="other@example.com")
+        self.assertEqual(self.send(other, "10.0.0.1").status_code, 404)
+
+
+class ProviderCallTransactionTest(TransactionTestCase):
+    """
+    The AI provider must never be called while a database transaction is open.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        ChatMessage.objects.create(session=self.session, sender="system", content="You are Sam.")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.in_atomic_block = []
+
+    def fake_provider(self, reply):
+        def call(messages, temperature=1.3, response_format=None):
+            self.in_atomic_block.append(connection.in_atomic_block)
+            return reply
+        return call
+
+    def test_chat_message(self):
+        with mock.patch("api.chat_views.get_ai_response", side_effect=self.fake_provider("Hi!")):
+            response = self.client.post(
+                reverse("chat_messages", args=[self.session.id]), {"message": "hello"}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.in_atomic_block, [False])
+        self.assertEqual(list(self.session.messages.values_list("sender", flat=True).order_by("timestamp")),
+                         ["system", "user", "assistant"])
+
+    def test_report_generation(self):
+        evaluation = '{"engagement_score": 6, "humor_score": 4, "empathy_score": 8, "feedback": "Nice"}'
+        self.client.get(reverse("generate_report", args=[self.session.id]))
+        with mock.patch("api.utils.get_ai_response", side_effect=self.fake_provider(evaluation)):
+            run_job(claim_jobs(1)[0])
+        self.assertEqual(self.in_atomic_block, [False])
+        self.assertTrue(ReportCard.objects.filter(session=self.session).exists())
+
+    def test_failed_reply_discards_user_message(self):
+        with mock.patch("api.chat_views.get_ai_response", side_effect=RuntimeError("provider down")):
+            response = self.client.post(
+                reverse("chat_messages", args=[self.session.id]), {"message": "hello"}, format="json"
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(self.session.messages.filter(sender="user").exists())
+
+
+@override_settings(INCREMENTAL_SCORING=False)
+class ReportJobTest(TestCase):
+    evaluation = '{"engagement_score": 6, "humor_score": 4, "empathy_score": 8, "feedback": "Nice"}'
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        ChatMessage.objects.create(session=self.session, sender="user", content="hello")
+        ChatMessage.objects.create(session=self.session, sender="assistant", content="hi")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def generate(self):
+        return self.client.get(reverse("generate_report", args=[self.session.id]))
+
+    def report_card(self):
+        return self.client.get(reverse("reportcard-detail", args=[self.session.id]))
+
+    def test_generation_is_queued_once_per_session(self):
+        first, second = self.generate(), self.generate()
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.data["job_id"], second.data["job_id"])
+        self.assertEqual(ReportJob.objects.count(), 1)
+        self.assertEqual(self.report_card().status_code, 202)
+
+    def test_worker_stores_report(self):
+        self.generate()
+        with mock.patch("api.utils.get_ai_response", return_value=self.evaluation) as provider:
+            run_job(claim_jobs(1)[0])
+            self.assertEqual(claim_jobs(1), [])
+        self.assertEqual(provider.call_count, 1)
+        self.assertEqual(self.report_card().data["total_score"], 6)
+        response = self.generate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["feedback"], "Nice")
+
+    @override_settings(REPORT_JOB_MAX_ATTEMPTS=2, REPORT_JOB_RETRY_BASE_DELAY=0)
+    def test_failed_job_is_retried_then_marked_failed(self):
+        self.generate()
+        with mock.patch("api.utils.get_ai_response", return_value="not an evaluation"):
+            run_job(claim_jobs(1)[0])
+            self.assertEqual(ReportJob.objects.get().status, ReportJob.PENDING)
+            run_job(claim_jobs(1)[0])
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.FAILED)
+        self.assertEqual(self.report_card().status_code, 404)
+        self.assertEqual(self.generate().status_code, 202)
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.PENDING)
+
+    def test_chat_end_queues_report(self):
+        response = self.client.post(
+            reverse("chat_messages", args=[self.session.id]), {"message": "end chat"}, format="json"
+        )
+        self.assertTrue(response.data["chat_ended"])
+        job = ReportJob.objects.get(session=self.session)
+        self.session.refresh_from_db()
+        self.assertIsNotNone(self.session.ended_at)
+        self.assertEqual(self.generate().data["job_id"], str(job.id))
+
+    def test_wait_returns_report_of_in_flight_job(self):
+        self.generate()
+
+        def worker_finishes(seconds):
+            run_job(claim_jobs(1)[0])
+
+        with mock.patch("api.utils.get_ai_response", return_value=self.evaluation) as provider, \
+                mock.patch("api.report_jobs.time.sleep", side_effect=worker_finishes):
+            response = self.client.get(reverse("generate_report", args=[self.session.id]), {"wait": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_score"], 6)
+        self.assertEqual(provider.call_count, 1)
+
+
+class TurnScoringTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        self.turns = []
+        for reply, message in [("Hi, I'm Sam.", "hello Sam"), ("Nice day?", "lovely, you?")]:
+            ChatMessage.objects.create(session=self.session, sender="assistant", content=reply)
+            self.turns.append(ChatMessage.objects.create(session=self.session, sender="user", content=message))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def scores(self, engagement, humor, empathy):
+        return f'{{"engagement": {engagement}, "humor": {humor}, "empathy": {empathy}, "note": "ok"}}'
+
+    def test_turn_scores_add_up_on_session(self):
+        with mock.patch("api.turn_scoring.get_ai_response",
+                        side_effect=[self.scores(60, 40, 80), self.scores(80, 20, 100)]) as provider:
+            self.assertTrue(score_turn(self.turns[0].pk))
+            self.assertTrue(score_turn(self.turns[1].pk))
+            self.assertTrue(score_turn(self.turns[1].pk))
+        self.assertEqual(provider.call_count, 2)
+        self.assertIn("Nice day?", provider.call_args.args[0][1]["content"])
+        self.session.refresh_from_db()
+        self.assertEqual(
+            (self.session.scored_turns, self.session.engagement_total, self.session.humor_total,
+             self.session.empathy_total),
+            (2, 140, 60, 180),
+        )
+
+    def test_report_is_summarised_from_turn_scores(self):
+        self.client.post(reverse("chat_messages", args=[self.session.id]), {"message": "end chat"}, format="json")
+        with mock.patch("api.turn_scoring.get_ai_response",
+                        side_effect=[self.scores(60, 40, 80), self.scores(80, 20, 100), "Well done"]) as provider, \
+                mock.patch("api.utils.get_ai_response") as full_evaluation:
+            run_job(claim_jobs(1)[0])
+        self.assertEqual(provider.call_count, 3)
+        full_evaluation.assert_not_called()
+        self.assertEqual(TurnScore.objects.filter(session=self.session).count(), 2)
+        report_card = ReportCard.objects.get(session=self.session)
+        self.assertEqual(
+            (report_card.engagement_score, report_card.humor_score, report_card.empathy_score, report_card.feedback),
+            (70, 30, 90, "Well done"),
+        )
+
+    def test_unscorable_turn_falls_back_to_full_evaluation(self):
+        self.client.post(reverse("chat_messages", args=[self.session.id]), {"message": "end chat"}, format="json")
+        evaluation = '{"engagement_score": 6, "humor_score": 4, "empathy_score": 8, "feedback": "Nice"}'
+        with mock.patch("api.turn_scoring.get_ai_response", return_value="not a score"), \
+                mock.patch("api.utils.get_ai_response", return_value=evaluation) as full_evaluation:
+            run_job(claim_jobs(1)[0])
+        # One repair attempt of the turn score, then the full evaluation.
+        self.assertEqual(full_evaluation.call_count, 2)
+        self.assertEqual(full_evaluation.call_args_list[0].args[0], TURN_OUTPUT.repair_messages("not a score"))
+        self.assertEqual(ReportCard.objects.get(session=self.session).feedback, "Nice")
+
+    def test_chat_message_schedules_scoring(self):
+        with mock.patch("api.chat_views.get_ai_response", return_value="Great!"), \
+                mock.patch("api.turn_scoring.background.submit") as submit:
+            self.client.post(reverse("chat_messages", args=[self.session.id]), {"message": "hi"}, format="json")
+        user_msg = self.session.messages.filter(sender="user").last()
+        submit.assert_called_once_with(score_turn, user_msg.pk)
+
+    def test_unanswered_turn_is_not_scored(self):
+        with mock.patch("api.chat_views.get_ai_response", side_effect=RuntimeError("provider down")), \
+                mock.patch("api.turn_scoring.background.submit") as submit, \
+                self.assertLogs("api.chat_views", "ERROR"):
+            response = self.client.post(reverse("chat_messages", args=[self.session.id]), {"message": "hi"}, format="json")
+        self.assertEqual(response.status_code, 500)
+        submit.assert_not_called()
+
+    def test_streamed_turn_is_scored_once_answered(self):
+        def shed(messages):
+            raise BulkheadFull("full")
+            yield
+
+        url = reverse("chat_messages", args=[self.session.id])
+        for reply, scored in [(shed, False), (lambda messages: iter(["Great!"]), True)]:
+            with mock.patch("api.chat_views.stream_ai_response", side_effect=reply), \
+                    mock.patch("api.turn_scoring.background.submit") as submit:
+                response = self.client.post(url, {"message": "hi"}, format="json", HTTP_ACCEPT="text/event-stream")
+                b"".join(response.streaming_content)
+            self.assertEqual(submit.called, scored)
+        user_msg = self.session.messages.filter(sender="user").last()
+        submit.assert_called_once_with(score_turn, user_msg.pk)
+
+
+@override_settings(CHAT_CONTEXT_TOKENS=200, CHAT_SUMMARY_TRIGGER_TOKENS=100, INCREMENTAL_SCORING=False)
+class ContextBudgetTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        ChatMessage.objects.create(session=self.session, sender="system", content="You are Sam.")
+        for turn in range(8):
+            ChatMessage.objects.create(session=self.session, sender="user", content=f"message {turn} " * 10)
+            ChatMessage.objects.create(session=self.session, sender="assistant", content=f"reply {turn} " * 10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_context_keeps_system_prompt_within_budget(self):
+        history = [("user", "word " * 50), ("assistant", "word " * 50)] * 20
+        messages = build_context(["You are Sam."], history)
+        self.assertEqual(messages[0], {"role": "system", "content": "You are Sam."})
+        self.assertLessEqual(sum(count_tokens(m["content"]) + 4 for m in messages), 200)
+        self.assertEqual(messages[-1]["role"], "assistant")
+
+    def test_estimate_overcounts_without_tiktoken(self):
+        with mock.patch("api.chat_service._encoding", return_value=None):
+            self.assertEqual(count_tokens("word " * 30), 51)
+            self.assertEqual(count_tokens("日本語のテキスト"), 9)
+
+    def test_latest_message_is_kept_even_over_budget(self):
+        messages = build_context(["You are Sam."], [("user", "word " * 1000)])
+        self.assertEqual([m["role"] for m in messages], ["system", "user"])
+
+    def test_older_turns_are_summarised(self):
+        with mock.patch("api.context_summary.get_ai_response", return_value="They talked about numbers.") as provider:
+            self.assertTrue(summarise_session(self.session.pk))
+        self.assertIn("message 0", provider.call_args.args[0][1]["content"])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.context_summary, "They talked about numbers.")
+        remaining = self.session.messages.filter(pk__gt=self.session.summarized_through)
+        self.assertTrue(0 < remaining.count() < 16)
+
+    def test_message_view_sends_summary_and_recent_turns(self):
+        with mock.patch("api.context_summary.get_ai_response", return_value="They talked about numbers."):
+            summarise_session(self.session.pk)
+        self.session.refresh_from_db()
+        with mock.patch("api.chat_views.get_ai_response", return_value="Sure!") as provider, \
+                mock.patch("api.context_summary.background.submit") as submit:
+            self.client.post(reverse("chat_messages", args=[self.session.id]), {"message": "hi"}, format="json")
+        messages = provider.call_args.args[0]
+        self.assertEqual(messages[0]["content"], "You are Sam.")
+        self.assertIn("They talked about numbers.", messages[1]["content"])
+        self.assertNotIn("message 0 ", [m["content"][:10] for m in messages])
+        self.assertEqual(messages[-1], {"role": "user", "content": "hi"})
+        submit.assert_not_called()
+
+    def test_long_history_schedules_summary(self):
+        with mock.patch("api.chat_views.get_ai_response", return_value="Sure!"), \
+                mock.patch("api.context_summary.background.submit") as submit:
+            self.client.post(reverse("chat_messages", args=[self.session.id]), {"message": "hi"}, format="json")
+        submit.assert_called_once_with(summarise_session, self.session.pk)
+
+
+@override_settings(INCREMENTAL_SCORING=False)
+class ConversationCacheTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        ChatMessage.objects.create(session=self.session, sender="system", content="You are Sam.")
+        ChatMessage.objects.create(session=self.session, sender="assistant", content="Hi there!")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, message):
+        with mock.patch("api.chat_views.get_ai_response", return_value=f"Reply to {message}") as provider:
+            response = self.client.post(
+                reverse("chat_messages", args=[self.session.id]), {"message": message}, format="json"
+            )
+        return response, provider.call_args.args[0] if provider.called else None
+
+    def message_reads(self, queries):
+        return [q["sql"] for q in queries if q["sql"].startswith("SELECT") and "api_chatmessage" in q["sql"]]
+
+    def test_steady_state_turn_reads_no_history(self):
+        self.send("first")
+        with CaptureQueriesContext(connection) as queries:
+            response, context = self.send("second")
+        self.assertEqual(response.data["message_count"], 2)
+        self.assertEqual(self.message_reads(queries), [])
+        self.assertEqual(
+            [m["content"] for m in context],
+            ["You are Sam.", "Hi there!", "first", "Reply to first", "second"],
+        )
+
+    def test_out_of_date_entry_is_reloaded(self):
+        self.send("first")
+        # Written by another worker process, which bumps the shared version.
+        other = ChatMessage.objects.create(session=self.session, sender="user", content="elsewhere")
+        cache.set(conversation_cache._version_key(self.session.pk), other.pk)
+        response, context = self.send("second")
+        self.assertEqual(response.data["message_count"], 3)
+        self.assertIn("elsewhere", [m["content"] for m in context])
+
+    def test_discarded_message_leaves_cache(self):
+        self.send("first")
+        with mock.patch("api.chat_views.get_ai_response", side_effect=RuntimeError("provider down")):
+            self.client.post(reverse("chat_messages", args=[self.session.id]), {"message": "lost"}, format="json")
+        response, context = self.send("second")
+        self.assertEqual(response.data["message_count"], 2)
+        self.assertNotIn("lost", [m["content"] for m in context])
+
+
+class StubProvider:
+    """
+    Local stand-in for an OpenAI-compatible client with a fixed latency.
+    """
+
+    def __init__(self, reply, latency=0.0, error=None):
+        self.reply = reply
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    def _response(self):
+        if self.error:
+            raise self.error
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))])
+
+    def create(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._response()
+
+
+class AsyncStubProvider(StubProvider):
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self._response()
+
+
+class LLMRouterTest(TestCase):
+
+    def provider(self, name, stub, samples=()):
+        provider = Provider(name, "model", lambda: stub, lambda: stub)
+        for seconds in samples:
+            provider.record(seconds, ok=True)
+        return provider
+
+    def test_routes_to_lowest_latency(self):
+        slow, fast = StubProvider("slow"), StubProvider("fast")
+        router = LLMRouter([self.provider("a", slow, [2.0]), self.provider("b", fast, [0.5])])
+        self.assertEqual(router.complete([], 1.0), "fast")
+        self.assertEqual(slow.calls, 0)
+
+    def test_fails_over_and_penalises_errors(self):
+        broken, backup = StubProvider("", error=RuntimeError("down")), StubProvider("backup")
+        first, second = self.provider("a", broken, [0.3]), self.provider("b", backup, [0.5])
+        router = LLMRouter([first, second])
+        self.assertEqual(router.complete([], 1.0), "backup")
+        self.assertGreater(first.error_rate, 0)
+        self.assertEqual(router.ranked()[0], second)
+
+    def test_failing_unsampled_provider_does_not_take_traffic(self):
+        broken, healthy = StubProvider("", error=RuntimeError("down")), StubProvider("primary")
+        router = LLMRouter([self.provider("fallback", broken), self.provider("primary", healthy)])
+        for _ in range(10):
+            self.assertEqual(router.complete([], 1.0), "primary")
+        self.assertEqual(broken.calls, 1)
+        self.assertEqual(healthy.calls, 10)
+
+    def test_every_provider_failing_raises(self):
+        router = LLMRouter([self.provider("a", StubProvider("", error=RuntimeError("down")))])
+        with self.assertRaises(RuntimeError):
+            router.complete([], 1.0)
+
+    def test_hedged_request_wins_when_primary_is_slow(self):
+        slow, fast = StubProvider("slow", latency=0.5), StubProvider("hedge")
+        router = LLMRouter(
+            [self.provider("a", slow, [0.01] * 20), self.provider("b", fast, [1.0])],
+            hedge=True, hedge_min_delay=0.02,
+        )
+        won = metrics.get_counter("llm.hedge.won")
+        started = time.monotonic()
+        self.assertEqual(router.complete([], 1.0), "hedge")
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(metrics.get_counter("llm.hedge.won"), won + 1)
+
+    def test_async_hedge_cancels_loser(self):
+        slow, fast = AsyncStubProvider("slow", latency=5), AsyncStubProvider("hedge")
+        router = LLMRouter(
+            [self.provider("a", slow, [0.01] * 20), self.provider("b", fast, [1.0])],
+            hedge=True, hedge_min_delay=0.02,
+        )
+        self.assertEqual(asyncio.run(asyncio.wait_for(router.acomplete([], 1.0), 1)), "hedge")
+
+    def test_no_hedge_without_enough_samples(self):
+        slow, fast = StubProvider("slow", latency=0.1), StubProvider("hedge")
+        router = LLMRouter([self.provider("a", slow), self.provider("b", fast, [1.0])], hedge=True, hedge_min_delay=0)
+        self.assertEqual(router.complete([], 1.0), "slow")
+        self.assertEqual(fast.calls, 0)
+
+
+class Clock:
+    """
+    Stands in for the time module of api.resilience; sleeping advances it.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ResilienceTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("api.resilience.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def failing(self, error=ConnectionError("down")):
+        return mock.Mock(side_effect=error, __name__="failing")
+
+    def test_breaker_opens_then_closes_after_trial(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10, failure_exceptions=(ConnectionError,))
+        fn = self.failing()
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                breaker.call(fn)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(fn)
+        self.assertEqual(fn.call_count, 2)
+
+        self.clock.now += 10
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        def trial():
+            # Only one call at a time is let through while half-open.
+            with self.assertRaises(CircuitOpenError):
+                breaker.call(lambda: "second")
+            return "first"
+
+        self.assertEqual(breaker.call(trial), "first")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10, failure_exceptions=(ConnectionError,))
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing())
+        self.clock.now += 10
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing())
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_attempts_are_capped(self):
+        fn = self.failing()
+        with self.assertRaises(ConnectionError):
+            retry_call(fn, retry_on=(ConnectionError,), attempts=3, base_delay=0.1)
+        self.assertEqual(fn.call_count, 3)
+
+    def test_no_retry_sleeps_past_deadline(self):
+        fn = self.failing()
+        with mock.patch("api.resilience.random.uniform", return_value=1.0), self.assertRaises(ConnectionError):
+            retry_call(fn, retry_on=(ConnectionError,), attempts=5, base_delay=1, deadline=1.5)
+        self.assertEqual((fn.call_count, self.clock.now), (2, 1001.0))
+
+    def test_deadline_exceeded_before_attempt(self):
+        fn = self.failing()
+        # The backoff sleep overruns into the deadline.
+        self.clock.sleep = lambda seconds: Clock.sleep(self.clock, seconds + 1)
+        with mock.patch("api.resilience.random.uniform", return_value=1.0), self.assertRaises(DeadlineExceeded):
+            retry_call(fn, retry_on=(ConnectionError,), attempts=3, base_delay=1, deadline=1.5)
+        self.assertEqual(fn.call_count, 1)
+
+    @override_settings(SUPABASE_AUTH_RETRY_ATTEMPTS=3)
+    def test_auth_api_error_is_not_retried_or_counted(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, failure_exceptions=(AuthRetryableError,))
+        fn = self.failing(AuthApiError("Invalid login credentials", 400, "invalid_credentials"))
+        with mock.patch.object(supabase_auth, "supabase_auth_breaker", breaker):
+            for _ in range(2):
+                with self.assertRaises(AuthApiError):
+                    supabase_auth.call_supabase_auth(fn)
+        self.assertEqual(fn.call_count, 2)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @override_settings(SUPABASE_AUTH_RETRY_ATTEMPTS=3, SUPABASE_AUTH_RETRY_BASE_DELAY=0)
+    def test_retryable_auth_error_is_retried_and_counted(self):
+        breaker = CircuitBreaker("test", failure_threshold=3, failure_exceptions=(AuthRetryableError,))
+        fn = self.failing(AuthRetryableError("Supabase is down", 503))
+        with mock.patch.object(supabase_auth, "supabase_auth_breaker", breaker), self.assertRaises(AuthRetryableError):
+            supabase_auth.call_supabase_auth(fn)
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    @override_settings(SUPABASE_JWT_VERIFY_LOCALLY=False)
+    def test_open_circuit_makes_authentication_unavailable(self):
+        supabase_auth.token_cache.clear()
+        supabase_auth.rejected_token_cache.clear()
+        breaker = CircuitBreaker("test", failure_threshold=1, failure_exceptions=(ConnectionError,))
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing())
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token()}")
+        with mock.patch.object(supabase_auth, "supabase_auth_breaker", breaker), \
+                mock.patch.object(get_supabase_client().auth, "get_user") as get_user, \
+                self.assertLogs("api.supabase_auth", "ERROR"):
+            response = client.get(reverse("protected"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data["detail"], supabase_auth.SupabaseUnavailable.default_detail)
+        get_user.assert_not_called()
+        self.assertNotIn(supabase_auth.hash_token(make_token()), supabase_auth.rejected_token_cache)
+
+
+class BulkheadTest(TestCase):
+
+    def test_sheds_when_queue_is_full(self):
+        bulkhead = Bulkhead("test", max_concurrent=1, max_queue=0)
+        shed = metrics.get_counter("bulkhead.test.shed")
+        with bulkhead.slot():
+            with self.assertRaises(BulkheadFull):
+                bulkhead.acquire()
+        self.assertEqual(metrics.get_counter("bulkhead.test.shed"), shed + 1)
+        with bulkhead.slot():
+            pass
+
+    def test_queued_call_times_out(self):
+        bulkhead = Bulkhead("test", max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        with bulkhead.slot():
+            started = time.monotonic()
+            with self.assertRaises(BulkheadFull):
+                bulkhead.acquire()
+            self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_async_caller_gets_released_slot(self):
+        bulkhead = Bulkhead("test", max_concurrent=1, max_queue=1, queue_timeout=1)
+
+        async def scenario():
+            await bulkhead.aacquire()
+            asyncio.get_running_loop().call_later(0.05, bulkhead.release)
+            async with bulkhead.aslot():
+                return True
+
+        self.assertTrue(asyncio.run(scenario()))
+
+
+@override_settings(INCREMENTAL_SCORING=False, OPENER_POOL_DEPTH=0)
+class LoadSheddingTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_shed_chat_message_gets_503(self):
+        with mock.patch("api.chat_views.get_ai_response", side_effect=BulkheadFull("full")):
+            response = self.client.post(
+                reverse("chat_messages", args=[self.session.id]), {"message": "hello"}, format="json"
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        self.assertFalse(self.session.messages.exists())
+
+    def test_shed_opener_is_canned(self):
+        ChatBot.objects.create(name="Sam", prompt="You are {name}, {custom_role}.")
+        scenario = {"ai_name": "Sam", "ai_role": "a barista"}
+        with mock.patch("api.chat_views.pick_scenario", return_value=scenario), \
+                mock.patch("api.chat_views.get_ai_response", side_effect=BulkheadFull("full")):
+            response = self.client.post(reverse("chat_sessions"), {}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["ai_response"], "Hi, I'm Sam! How's your day going?")
+
+    def test_background_calls_do_not_take_request_slots(self):
+        router = mock.Mock(**{"complete.return_value": "Hi!"})
+        with mock.patch("api.utils.get_llm_router", return_value=router), \
+                mock.patch.object(llm_bulkhead, "max_concurrent", 0), \
+                mock.patch.object(llm_bulkhead, "max_queue", 0):
+            self.assertEqual(get_ai_response([{"role": "user", "content": "hi"}], background=True), "Hi!")
+            with self.assertRaises(BulkheadFull):
+                get_ai_response([{"role": "user", "content": "hi"}])
+
+    def test_full_background_bulkhead_sheds_background_work_only(self):
+        bot = ChatBot.objects.create(name="Sam", prompt="You are Sam.")
+        ChatMessage.objects.create(session=self.session, sender="assistant", content="Hi, I'm Sam.")
+        turn = ChatMessage.objects.create(session=self.session, sender="user", content="hello Sam")
+        router = mock.Mock(**{"complete.return_value": "Hi!"})
+        with mock.patch("api.utils.get_llm_router", return_value=router), \
+                mock.patch.object(llm_background_bulkhead, "max_concurrent", 0), \
+                mock.patch.object(llm_background_bulkhead, "max_queue", 0), \
+                override_settings(OPENER_POOL_DEPTH=2):
+            self.assertFalse(score_turn(turn.pk))
+            self.assertEqual(refill_pool(bot.pk, "You are Sam."), 0)
+            router.complete.assert_not_called()
+            self.assertEqual(get_ai_response([{"role": "user", "content": "hi"}]), "Hi!")
+        self.assertFalse(TurnScore.objects.exists())
+
+
+@override_settings(INCREMENTAL_SCORING=False, OPENER_POOL_DEPTH=0)
+class ChatStreamTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stream(self, reply):
+        with mock.patch("api.chat_views.stream_ai_response", side_effect=reply):
+            response = self.client.post(
+                reverse("chat_messages", args=[self.session.id]), {"message": "hello"},
+                format="json", HTTP_ACCEPT="text/event-stream",
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            body = b"".join(response.streaming_content).decode()
+        self.assertTrue(body.endswith("\n\n"))
+        events = []
+        for block in body.split("\n\n")[:-1]:
+            event, data = block.split("\n")
+            self.assertTrue(event.startswith("event: ") and data.startswith("data: "))
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+
+    def test_reply_is_streamed_then_done(self):
+        events = self.stream(lambda messages: iter(["Hi ", "there!"]))
+        self.assertEqual(events, [
+            ("token", {"content": "Hi "}),
+            ("token", {"content": "there!"}),
+            ("done", {"user_message": "hello", "ai_response": "Hi there!", "chat_ended": False, "message_count": 1}),
+        ])
+        self.assertEqual(
+            list(self.session.messages.order_by("pk").values_list("sender", "content")),
+            [("user", "hello"), ("assistant", "Hi there!")],
+        )
+
+    def test_shed_stream_sends_error_event(self):
+        def shed(messages):
+            raise BulkheadFull("full")
+            yield
+
+        events = self.stream(shed)
+        self.assertEqual(events, [("error", {"error": LLMOverloaded.default_detail})])
+        self.assertFalse(self.session.messages.exists())
+
+
+@override_settings(ASYNC_VIEWS=True, INCREMENTAL_SCORING=False, OPENER_POOL_DEPTH=0)
+class AsyncViewsTest(TestCase):
+    """
+    The async views mirror the sync ones; these run them on an event loop.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        self.factory = APIRequestFactory()
+
+    def call(self, view, method, path, data=None, accept=None, **kwargs):
+        request = getattr(self.factory, method)(path, data, format="json", HTTP_ACCEPT=accept or "application/json")
+        force_authenticate(request, self.user)
+
+        async def run():
+            response = await view.as_view()(request, **kwargs)
+            if response.streaming:
+                return response, "".join([chunk.decode() async for chunk in response.streaming_content])
+            return response.render(), None
+
+        return async_to_sync(run)()
+
+    def send(self, message, accept=None):
+        return self.call(AsyncChatMessageView, "post", "/", {"message": message}, accept, session_id=self.session.id)
+
+    @staticmethod
+    async def reply(messages, temperature=1.3):
+        return "Great!"
+
+    def transcript(self):
+        return list(self.session.messages.order_by("pk").values_list("sender", "content"))
+
+    def test_session_is_created_with_opener(self):
+        ChatBot.objects.create(name="Sam", prompt="You are {name}, {custom_role}.")
+        scenario = {"ai_name": "Sam", "ai_role": "a barista"}
+        with mock.patch("api.async_views.pick_scenario", return_value=scenario), \
+                mock.patch("api.async_views.aget_ai_response", side_effect=self.reply):
+            response, _ = self.call(AsyncChatSessionView, "post", "/", {})
+        self.assertEqual((response.status_code, response.data["ai_response"]), (201, "Great!"))
+        session = ChatSession.objects.get(pk=response.data["session_id"])
+        self.assertEqual(list(session.messages.values_list("sender", flat=True)), ["system", "assistant"])
+
+    def test_message_gets_reply(self):
+        with mock.patch("api.async_views.aget_ai_response", side_effect=self.reply):
+            response, _ = self.send("hello")
+        self.assertEqual((response.status_code, response.data), (200, {
+            "user_message": "hello", "ai_response": "Great!", "chat_ended": False, "message_count": 1
+        }))
+        self.assertEqual(self.transcript(), [("user", "hello"), ("assistant", "Great!")])
+
+    def test_chat_end_queues_report(self):
+        with mock.patch("api.async_views.aget_ai_response") as provider:
+            response, _ = self.send("end chat")
+        provider.assert_not_called()
+        self.assertTrue(response.data["chat_ended"])
+        self.assertEqual(response.data["ai_response"], CHAT_ENDED_MESSAGE)
+        self.assertTrue(ReportJob.objects.filter(session=self.session).exists())
+
+    def test_stream_saves_assembled_reply(self):
+        async def stream(messages, temperature=1.3):
+            for chunk in ["Hi ", "there!"]:
+                yield chunk
+
+        with mock.patch("api.async_views.astream_ai_response", side_effect=stream):
+            response, body = self.send("hello", accept="text/event-stream")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(body.count("event: token"), 2)
+        self.assertIn('event: done\ndata: {"user_message": "hello", "ai_response": "Hi there!"', body)
+        self.assertEqual(self.transcript(), [("user", "hello"), ("assistant", "Hi there!")])
+
+    def test_shed_message_is_discarded(self):
+        with mock.patch("api.async_views.aget_ai_response", side_effect=BulkheadFull("full")):
+            response, _ = self.send("hello")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        self.assertFalse(self.session.messages.exists())
+
+    def test_shed_stream_sends_error_event(self):
+        async def stream(messages, temperature=1.3):
+            raise BulkheadFull("full")
+            yield
+
+        with mock.patch("api.async_views.astream_ai_response", side_effect=stream):
+            _, body = self.send("hello", accept="text/event-stream")
+        self.assertEqual(body, format_event("error", {"error": LLMOverloaded.default_detail}))
+        self.assertFalse(self.session.messages.exists())
+
+    def test_report_is_queued_then_waited_for(self):
+        ChatMessage.objects.create(session=self.session, sender="user", content="hello")
+        ChatMessage.objects.create(session=self.session, sender="assistant", content="hi")
+        response, _ = self.call(AsyncReportGenerationView, "get", "/", session_id=self.session.id)
+        self.assertEqual(response.status_code, 202)
+
+        async def worker_finishes(session_id, timeout):
+            await sync_to_async(lambda: run_job(claim_jobs(1)[0]))()
+            return await await_report(session_id, 0)
+
+        evaluation = '{"engagement_score": 6, "humor_score": 4, "empathy_score": 8, "feedback": "Nice"}'
+        with mock.patch("api.utils.get_ai_response", return_value=evaluation), \
+                mock.patch("api.async_views.await_report", side_effect=worker_finishes):
+            response, _ = self.call(AsyncReportGenerationView, "get", "/?wait=5", session_id=self.session.id)
+        self.assertEqual((response.status_code, response.data["feedback"]), (200, "Nice"))
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow_call(self, reply):
+        self.calls += 1
+        self.release.wait(1)
+        return reply
+
+    def test_concurrent_identical_calls_share_one_result(self):
+        flight = SingleFlight("test")
+        suppressed = metrics.get_counter("singleflight.test.suppressed")
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(flight.do, "key", self.slow_call, "reply") for _ in range(3)]
+            while metrics.get_counter("singleflight.test.suppressed") < suppressed + 2:
+                time.sleep(0.01)
+            self.release.set()
+            self.assertEqual([future.result() for future in futures], ["reply"] * 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(flight.do("key", self.slow_call, "again"), "again")
+
+    def test_followers_get_the_leaders_error(self):
+        flight = SingleFlight("test")
+
+        def failing():
+            self.release.wait(1)
+            raise RuntimeError("provider down")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(flight.do, "key", failing)
+            while "key" not in flight._calls:
+                time.sleep(0.01)
+            follower = pool.submit(flight.do, "key", failing)
+            time.sleep(0.05)
+            self.release.set()
+            for future in (leader, follower):
+                with self.assertRaises(RuntimeError):
+                    future.result()
+
+    def test_shared_result_reaches_waiting_processes(self):
+        first, other_process = SingleFlight("test", shared=True), SingleFlight("test", shared=True)
+        other_process.POLL_INTERVAL = 0.01
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(first.do, "shared-key", self.slow_call, "reply")
+            while cache.get("singleflight:test:shared-key:lock") is None:
+                time.sleep(0.01)
+            follower = pool.submit(other_process.do, "shared-key", self.slow_call, "other")
+            time.sleep(0.05)
+            self.release.set()
+            self.assertEqual((leader.result(), follower.result()), ("reply", "reply"))
+        self.assertEqual(self.calls, 1)
+
+    def test_shared_result_is_not_reused_by_later_calls(self):
+        first, other_process = SingleFlight("test", shared=True), SingleFlight("test", shared=True)
+        self.release.set()
+        self.assertEqual(first.do("shared-key", self.slow_call, "reply"), "reply")
+        self.assertEqual(other_process.do("shared-key", self.slow_call, "again"), "again")
+        self.assertEqual(self.calls, 2)
+
+    def test_async_calls_are_coalesced(self):
+        flight = SingleFlight("test")
+
+        async def call():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return "reply"
+
+        async def scenario():
+            return await asyncio.gather(*(flight.ado("key", call) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(scenario()), ["reply"] * 3)
+        self.assertEqual(self.calls, 1)
+
+
+@override_settings(OPENER_POOL_DEPTH=3)
+class OpenerPoolTest(TestCase):
+    scenario = {"ai_name": "Sam", "ai_role": "a barista", "scenario": "At a coffee shop"}
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com")
+        self.bot = ChatBot.objects.create(name="Sam", prompt="You are {name}, {custom_role}.")
+        self.prompt = "You are Sam, a barista."
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_refill_tops_pool_up_to_depth(self):
+        with mock.patch("api.openers.get_ai_response", side_effect=["Hi!", "Hello!", "Hey!"]) as provider:
+            self.assertEqual(refill_pool(self.bot.pk, self.prompt), 3)
+            self.assertEqual(refill_pool(self.bot.pk, self.prompt), 0)
+        self.assertEqual(provider.call_count, 3)
+        self.assertEqual(OpeningMessage.objects.filter(prompt_hash=prompt_hash(self.prompt)).count(), 3)
+
+    def test_refill_gets_distinct_openers_with_shared_single_flight(self):
+        OpeningMessage.objects.create(bot=self.bot, prompt_hash=prompt_hash(self.prompt), content="Hey!")
+        with mock.patch.object(llm_calls, "shared", True), \
+                mock.patch("api.utils._get_ai_response", side_effect=["Hi!", "Hi!", "Hey!", "Hello!"]) as provider:
+            self.assertEqual(refill_pool(self.bot.pk, self.prompt), 2)
+        self.assertEqual(provider.call_count, 4)
+        self.assertEqual(
+            set(OpeningMessage.objects.values_list("content", flat=True)), {"Hi!", "Hey!", "Hello!"}
+        )
+
+    def test_session_creation_pops_oldest_opener(self):
+        for content in ("First!", "Second!"):
+            OpeningMessage.objects.create(bot=self.bot, prompt_hash=prompt_hash(self.prompt), content=content)
+        with mock.patch("api.chat_views.pick_scenario", return_value=self.scenario), \
+                mock.patch("api.chat_views.get_ai_response") as provider, \
+                mock.patch("api.openers.background.submit") as submit:
+            response = self.client.post(reverse("chat_sessions"), {}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["ai_response"], "First!")
+        provider.assert_not_called()
+        submit.assert_called_once_with(refill_pool, self.bot.pk, self.prompt)
+        self.assertEqual(list(OpeningMessage.objects.values_list("content", flat=True)), ["Second!"])
+
+    def test_empty_pool_falls_back_to_live_call(self):
+        with mock.patch("api.chat_views.pick_scenario", return_value=self.scenario), \
+                mock.patch("api.chat_views.get_ai_response", return_value="Live!"), \
+                mock.patch("api.openers.background.submit"):
+            response = self.client.post(reverse("chat_sessions"), {}, format="json")
+        self.assertEqual(response.data["ai_response"], "Live!")
+
+    def test_refill_all_prunes_unused_prompts(self):
+        OpeningMessage.objects.create(bot=self.bot, prompt_hash=prompt_hash("old prompt"), content="Stale")
+        with mock.patch("api.openers.SCENARIOS", [self.scenario]), \
+                mock.patch("api.openers.get_ai_response", side_effect=["Hi!", "Hello!", "Hey!"]):
+            self.assertEqual(refill_all(), (3, 1))
+        self.assertFalse(OpeningMessage.objects.filter(content="Stale").exists())
+
+
+class StructuredOutputTest(TestCase):
+
+    def setUp(self):
+        self.output = StructuredOutput(
+            "test_output",
+            {"score": Number(integer=True), "feedback": Text()},
+            aliases={"score": ["total"]},
+        )
+
+    def test_tolerant_parsing(self):
+        expected = {"score": 80, "feedback": "Nice one"}
+        replies = [
+            '{"score": 80, "feedback": "Nice one"}',
+            'Sure! ```json\n{"Score": "80", "feedback": "Nice one"}\n```',
+            '{"total": 80.4, "feedback": "Nice one",}',
+            "score: 80, feedback: Nice one",
+            "### **Score: 80/100**\n**Feedback:** Nice one",
+        ]
+        for reply in replies:
+            with self.subTest(reply=reply):
+                self.assertEqual(self.output.parse(reply), expected)
+
+    def test_validation(self):
+        self.assertEqual(self.output.parse('{"score": 140, "feedback": "Wow"}')["score"], 100)
+        for reply in ('{"score": "high", "feedback": "Wow"}', '{"score": 50}', '{"score": 50, "feedback": ""}', "no"):
+            with self.subTest(reply=reply), self.assertRaises(StructuredOutputError):
+                self.output.parse(reply)
+
+    def test_single_repair_call(self):
+        failed = metrics.get_counter("structured_output.test_output.failed")
+        with mock.patch("api.utils.get_ai_response", return_value='{"score": 70, "feedback": "Good"}') as provider:
+            self.assertEqual(parse_structured(self.output, "I'd say seventy, good job"), {"score": 70, "feedback": "Good"})
+        provider.assert_called_once_with(
+            self.output.repair_messages("I'd say seventy, good job"), temperature=0, response_format=JSON_MODE
+        )
+        with mock.patch("api.utils.get_ai_response", return_value="still prose") as provider, \
+                self.assertRaises(StructuredOutputError):
+            parse_structured(self.output, "prose")
+        self.assertEqual(provider.call_count, 1)
+        with mock.patch("api.utils.get_ai_response") as provider, self.assertRaises(StructuredOutputError):
+            parse_structured(self.output, AI_FALLBACK_MESSAGE)
+        provider.assert_not_called()
+        self.assertEqual(metrics.get_counter("structured_output.test_output.failed"), failed + 2)
+
+    def test_json_mode_reaches_provider(self):
+        stub = StubProvider('{"score": 1, "feedback": "ok"}')
+        router = LLMRouter([Provider("primary", "model", lambda: stub)])
+        with mock.patch.object(stub, "create", wraps=stub.create) as create:
+            router.complete([], 0, response_format=JSON_MODE)
+            router.complete([], 0)
+        self.assertEqual(create.call_args_list[0].kwargs["response_format"], JSON_MODE)
+        self.assertNotIn("response_format", create.call_args_list[1].kwargs)
@@ -0,0 +1,109 @@
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """
+    Parses '<requests>/<period>' (period s, sec, m, min, h, hour, d, day) into
+    (requests, period in seconds).
+    """
+    num, period = rate.split("/")
+    return int(num), PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle backed by the shared Django cache.
+
+    The bucket for a view's ``throttle_scope`` holds ``<requests>`` tokens and
+    refills at ``<requests>/<period>``; rates come from ``settings.RATE_LIMITS``.
+    Requests are keyed per scope and per user, or per client IP when the request
+    has not been authenticated (public views are never forced to authenticate).
+
+    The bucket is stored as a single integer, its theoretical arrival time in
+    milliseconds (GCRA), so admitting a request is one atomic ``cache.incr``.
+    Under contention right after a bucket has refilled a few extra requests may
+    get through; a request is never rejected because of a race.
+
+    Every response carries RateLimit-Limit/-Remaining/-Reset headers, and
+    throttled ones also get Retry-After.
+    """
+
+    cache = cache
+    cache_format = "ratelimit:{scope}:{ident}"
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, "throttle_scope", None)
+        rate = settings.RATE_LIMITS.get(self.scope)
+        if not rate:
+            return True
+
+        requests, period = parse_rate(rate)
+        interval = max(1, period * 1000 // requests)
+        capacity = requests * interval
+        key = self.cache_format.format(scope=self.scope, ident=self.get_cache_ident(request))
+
+        started = time.perf_counter()
+        try:
+            now = int(time.time() * 1000)
+            tat = self._charge(key, now, interval, period)
+            allowed = tat - now <= capacity
+            if not allowed:
+                # Rejected requests do not consume a token, but keep a hammered
+                # bucket from expiring and starting over full.
+                tat = self.cache.decr(key, interval)
+                self.cache.touch(key, self._timeout(period))
+        except Exception as e:
+            # Never take the API down because the cache is unavailable.
+            logger.error(f"Rate limiter unavailable, allowing request: {e}")
+            return True
+        finally:
+            metrics.observe("ratelimit.check_seconds", time.perf_counter() - started)
+
+        backlog = max(0, tat - now)
+        self.wait_seconds = (tat + interval - now - capacity) / 1000
+        view.headers["RateLimit-Limit"] = str(requests)
+        view.headers["RateLimit-Remaining"] = str(max(0, (capacity - backlog) // interval))
+        view.headers["RateLimit-Reset"] = str(math.ceil(backlog / 1000))
+        if not allowed:
+            metrics.incr(f"ratelimit.{self.scope}.rejected")
+        return allowed
+
+    def _timeout(self, period):
+        return max(period, 60) * 2
+
+    def _charge(self, key, now, interval, period):
+        timeout = self._timeout(period)
+        try:
+            tat = self.cache.incr(key, interval)
+        except ValueError:
+            if self.cache.add(key, now + interval, timeout):
+                return now + interval
+            tat = self.cache.incr(key, interval)
+        if tat - interval < now:
+            # The bucket had refilled completely; restart it from now.
+            tat = now + interval
+            self.cache.set(key, tat, timeout)
+        return tat
+
+    def get_cache_ident(self, request):
+        # Only use the user if authentication has already happened (see
+        # LazyAuthenticationMixin); reading request.user here would force it.
+        user = request.__dict__.get("_user")
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return f"ip:{self.get_ident(request)}"
+
+    def wait(self):
+        return math.ceil(self.wait_seconds)
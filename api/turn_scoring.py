@@ -0,0 +1,170 @@
+"""
+Incremental evaluation of a chat.
+
+Each user turn is scored in the background once ChatMessageView has saved the
+AI reply to it, and the session keeps running engagement/humor/empathy totals. The final report is then
+the average of the turn scores plus one short summary call over the per-turn
+notes, instead of one large prompt over the whole transcript.
+"""
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import background, metrics
+from .models import ChatMessage, ChatSession, TurnScore
+from .resilience import BulkheadFull
+from .structured_output import JSON_MODE, Number, StructuredOutput, Text
+from .utils import AI_FALLBACK_MESSAGE, get_ai_response, parse_structured
+
+logger = logging.getLogger(__name__)
+
+TURN_SCORING_PROMPT = (
+    "You are a social skills coach scoring one turn of a practice conversation. "
+    "Score the user's reply to the other person's message for engagement, humor and empathy, "
+    "each from 0 to 100, and add a note of at most 15 words on what stood out."
+)
+
+TURN_OUTPUT = StructuredOutput(
+    "turn_score",
+    {
+        "engagement": Number(integer=True),
+        "humor": Number(integer=True),
+        "empathy": Number(integer=True),
+        "note": Text("note", required=False),
+    },
+)
+
+SUMMARY_PROMPT = (
+    "You are a social skills coach. A user finished a practice conversation. Below are their "
+    "average scores out of 100 and a note on each of their turns, in order. Write encouraging, "
+    "specific feedback on how they did and what to work on next, in at most 120 words."
+)
+
+
+def build_turn_messages(ai_message, user_message):
+    return [
+        {"role": "system", "content": f"{TURN_SCORING_PROMPT} {TURN_OUTPUT.instructions()}"},
+        {"role": "user", "content": f"Other person: {ai_message}\nUser: {user_message}"},
+    ]
+
+
+def parse_turn_score(text):
+    """
+    Returns the scores and note from the scorer's reply.
+
+    Raises:
+        ValueError: The reply is not the expected JSON, even after a repair call.
+    """
+    result = parse_structured(TURN_OUTPUT, text, background=True)
+    return {
+        "engagement_score": result["engagement"],
+        "humor_score": result["humor"],
+        "empathy_score": result["empathy"],
+        "note": result["note"],
+    }
+
+
+def schedule_turn_scoring(message):
+    if settings.INCREMENTAL_SCORING:
+        background.submit(score_turn, message.pk)
+
+
+def score_turn(message_id):
+    """
+    Scores one user message against the assistant message it answered and adds
+    it to the session totals. Does nothing if the turn is already scored.
+
+    Returns:
+        bool: Whether the turn has a score.
+    """
+    if TurnScore.objects.filter(message_id=message_id).exists():
+        return True
+    message = ChatMessage.objects.filter(pk=message_id).first()
+    if message is None:
+        # Discarded because the AI reply to it failed.
+        return False
+    previous = (
+        ChatMessage.objects
+        .filter(session_id=message.session_id, sender="assistant", pk__lt=message.pk)
+        .order_by("-pk")
+        .values_list("content", flat=True)
+        .first()
+    )
+    prompt = build_turn_messages(previous or "", message.content)
+    metrics.observe("evaluation.turn_prompt_chars", sum(len(m["content"]) for m in prompt))
+    try:
+        reply = get_ai_response(prompt, temperature=0.3, response_format=JSON_MODE, background=True)
+        scores = parse_turn_score(reply)
+    except (ValueError, BulkheadFull) as e:
+        logger.error(f"Turn {message_id} not scored: {e}")
+        metrics.incr("evaluation.turn_unscored")
+        return False
+
+    try:
+        with transaction.atomic():
+            TurnScore.objects.create(message=message, session_id=message.session_id, **scores)
+            ChatSession.objects.filter(pk=message.session_id).update(
+                scored_turns=F("scored_turns") + 1,
+                engagement_total=F("engagement_total") + scores["engagement_score"],
+                humor_total=F("humor_total") + scores["humor_score"],
+                empathy_total=F("empathy_total") + scores["empathy_score"],
+            )
+    except IntegrityError:
+        # Scored concurrently (background task and report job); keep that one.
+        pass
+    metrics.incr("evaluation.turns_scored")
+    return True
+
+
+def evaluate_incrementally(session):
+    """
+    Builds the evaluation of a chat from its turn scores, scoring any turn the
+    background task has not (yet) handled first.
+
+    The user message that ended the chat is not a turn. Returns None when some
+    turn still cannot be scored, in which case the caller should fall back to
+    the full-transcript evaluation.
+
+    Returns:
+        dict: engagement_score, humor_score, empathy_score and feedback, as
+        expected by utils.save_evaluation.
+    """
+    turns = list(session.messages.filter(sender="user").order_by("pk").values_list("pk", flat=True))
+    if session.ended_at:
+        turns = turns[:-1]
+    if not turns:
+        return None
+
+    scored = set(TurnScore.objects.filter(message_id__in=turns).values_list("message_id", flat=True))
+    for message_id in turns:
+        if message_id not in scored and not score_turn(message_id):
+            return None
+
+    scores = list(
+        TurnScore.objects.filter(message_id__in=turns)
+        .order_by("message_id")
+        .values("engagement_score", "humor_score", "empathy_score", "note")
+    )
+    averages = {
+        key: sum(score[key] for score in scores) // len(scores)
+        for key in ("engagement_score", "humor_score", "empathy_score")
+    }
+    notes = "\n".join(f"{number}. {score['note']}" for number, score in enumerate(scores, start=1))
+    prompt = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"Engagement: {averages['engagement_score']}, Humor: {averages['humor_score']}, "
+                f"Empathy: {averages['empathy_score']}\n{notes}"
+            ),
+        },
+    ]
+    metrics.observe("evaluation.prompt_chars", sum(len(m["content"]) for m in prompt))
+    feedback = get_ai_response(prompt, temperature=0.7)
+    if feedback == AI_FALLBACK_MESSAGE:
+        raise RuntimeError("Summary call failed")
+    metrics.incr("evaluation.incremental")
+    return {**averages, "feedback": feedback}
@@ -1,12 +1,20 @@
+from django.conf import settings
 from django.urls import path, re_path, include
 from .auth_views import (
     SupabaseLoginView, SupabaseRegisterView, SupabaseGuestLoginView
 )
-from .test_views import ProtectedView, HealthCheck
+from .test_views import ProtectedView, HealthCheck, LivenessView, ReadinessView
 from .chat_views import ChatSessionView, ChatMessageView, ChatBotListView, ReportGenerationView
 from .report_views import ReportCardDetailView, ReportCardListView
 from .swagger import schema_view
 
+if settings.ASYNC_VIEWS:
+    from .async_views import (
+        AsyncChatSessionView as ChatSessionView,
+        AsyncChatMessageView as ChatMessageView,
+        AsyncReportGenerationView as ReportGenerationView,
+    )
+
 urlpatterns = [
     # Authentication Endpoints
     path('auth/guest_login/', SupabaseGuestLoginView.as_view(), name="guest_login"),
@@ -15,6 +23,8 @@ urlpatterns = [
     # Protected Routes
     path('protected/', ProtectedView.as_view(), name="protected"),
     path('health/', HealthCheck.as_view(), name="health_check"),
+    path('live/', LivenessView.as_view(), name="live"),
+    path('ready/', ReadinessView.as_view(), name="ready"),
     # Chat Endpoints
     path('chat/sessions/', ChatSessionView.as_view(), name="chat_sessions"),
     path('chat/sessions/<uuid:session_id>/messages/', ChatMessageView.as_view(), name="chat_messages"),
@@ -0,0 +1,96 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from . import metrics
+from .caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Fields kept in the cache. The password hash is deliberately left out; it is
+# deferred on cached instances and loaded from the database only if accessed.
+CACHED_FIELDS = [
+    field.attname for field in User._meta.concrete_fields if field.attname != "password"
+]
+
+
+class UserResolver:
+    """
+    Resolves the email carried by a Supabase token to an ``api.User`` without
+    touching the database on the hot path.
+
+    Lookups go through an in-process LRU first, then the shared Django cache,
+    and only then fall back to ``get_or_create``. Entries are invalidated by the
+    User post_save/post_delete signals (see ``api.signals``); the local tier also
+    has a short TTL so other worker processes pick up changes quickly.
+    """
+
+    def __init__(self, local_size=2048, local_ttl=60, shared_ttl=3600, prefix="auth:user"):
+        self.local = TTLCache(maxsize=local_size, ttl=local_ttl)
+        self.shared_ttl = shared_ttl
+        self.prefix = prefix
+
+    def _email_key(self, email):
+        return f"{self.prefix}:email:{email}"
+
+    def _pk_key(self, pk):
+        return f"{self.prefix}:pk:{pk}"
+
+    def resolve(self, email):
+        row = self.local.get(email)
+        if row is not None:
+            metrics.incr("user_resolver.local_hit")
+            return self._build(row)
+
+        row = cache.get(self._email_key(email))
+        if row is not None:
+            metrics.incr("user_resolver.shared_hit")
+            self.local.set(email, row)
+            return self._build(row)
+
+        metrics.incr("user_resolver.miss")
+        user, created = User.objects.get_or_create(email=email)
+        if created:
+            metrics.incr("user_resolver.created")
+        self.remember(user)
+        return user
+
+    def remember(self, user):
+        row = [getattr(user, attname) for attname in CACHED_FIELDS]
+        self.local.set(user.email, row)
+        cache.set_many(
+            {self._email_key(user.email): row, self._pk_key(user.pk): user.email},
+            timeout=self.shared_ttl,
+        )
+
+    def invalidate(self, user):
+        emails = {user.email}
+        previous_email = cache.get(self._pk_key(user.pk))
+        if previous_email:
+            emails.add(previous_email)
+        for email in emails:
+            self.local.delete(email)
+        cache.delete_many([self._email_key(email) for email in emails] + [self._pk_key(user.pk)])
+        metrics.incr("user_resolver.invalidated")
+
+    def _build(self, row):
+        return User.from_db("default", CACHED_FIELDS, row)
+
+    def stats(self):
+        return {
+            "local_hit": metrics.get_counter("user_resolver.local_hit"),
+            "shared_hit": metrics.get_counter("user_resolver.shared_hit"),
+            "miss": metrics.get_counter("user_resolver.miss"),
+            "local_size": len(self.local),
+        }
+
+
+user_resolver = UserResolver(
+    local_size=settings.USER_RESOLVER_LOCAL_SIZE,
+    local_ttl=settings.USER_RESOLVER_LOCAL_TTL,
+    shared_ttl=settings.USER_RESOLVER_SHARED_TTL,
+)
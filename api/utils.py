@@ -1,58 +1,127 @@
 import os
-import openai
 import logging
-from openai import OpenAI
-from dotenv import load_dotenv
+from . import metrics
+from .clients import get_llm_router
+from .resilience import Bulkhead
+from .singleflight import SingleFlight
+from .structured_output import JSON_MODE, Number, StructuredOutput, StructuredOutputError, Text
 from .models import ReportCard
 from course_content.models import UserContentAccess, Category, SubCategory, Lesson
 # app.py
-import re
 import json
+import hashlib
 import time
 from django.contrib.contenttypes.models import ContentType
-
-load_dotenv()
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import APIException
 
 logger = logging.getLogger(__name__)
 
 EVALUATION_PROMPT = os.getenv('EVALUATION_PROMPT', "Welcome! Let's start chatting.")
+AI_FALLBACK_MESSAGE = "I'm sorry, I'm having trouble processing your request right now."
+
+# Caps the AI provider calls in flight in this process, so a slow provider
+# cannot tie up every worker thread (see resilience.Bulkhead).
+llm_bulkhead = Bulkhead(
+    "llm",
+    max_concurrent=settings.LLM_MAX_CONCURRENCY,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+)
+
+# The same for calls made off the request path, which are shed first.
+llm_background_bulkhead = Bulkhead(
+    "llm_background",
+    max_concurrent=settings.LLM_BACKGROUND_MAX_CONCURRENCY,
+    max_queue=settings.LLM_BACKGROUND_MAX_QUEUE,
+    queue_timeout=settings.LLM_BACKGROUND_QUEUE_TIMEOUT,
+)
+
+# Coalesces identical concurrent AI requests (see singleflight.SingleFlight).
+llm_calls = SingleFlight(
+    "llm",
+    shared=settings.SINGLEFLIGHT_SHARED,
+    lock_timeout=settings.SINGLEFLIGHT_LOCK_SECONDS,
+    result_timeout=settings.SINGLEFLIGHT_RESULT_SECONDS,
+    share_result=lambda result: result != AI_FALLBACK_MESSAGE,
+)
+
+
+# The report evaluation; the aliases also accept the older markdown replies
+# ("### **Engagement Score: 80/100**").
+REPORT_OUTPUT = StructuredOutput(
+    "report_evaluation",
+    {
+        "engagement_score": Number(integer=True),
+        "humor_score": Number(integer=True),
+        "empathy_score": Number(integer=True),
+        "feedback": Text("feedback for the user"),
+    },
+    aliases={"engagement_score": ["engagement"], "humor_score": ["humor"], "empathy_score": ["empathy"]},
+)
+
+
+class LLMOverloaded(APIException):
+    """
+    Raised by views whose AI provider call was shed by llm_bulkhead.
+    """
+    status_code = 503
+    default_detail = "The AI service is busy. Please try again shortly."
+    default_code = "llm_overloaded"
+    # Sent as the Retry-After header by DRF's exception handler.
+    wait = 1
 
 
-# Initialize OpenAI Client
-if "gpt" not in os.getenv("AI_MODEL"):
-    client = OpenAI(api_key=os.getenv("DEEPSEEK_API_KEY"), base_url=os.getenv("AI_BASE_URL"))
-    logger.error("Using deepseek")
-else:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    logger.error("Using Open AI")
+def ai_request_key(messages, temperature, response_format=None):
+    """
+    Identifies an AI request by model, temperature, response format and messages.
+    """
+    payload = json.dumps([os.getenv("AI_MODEL"), temperature, response_format, messages], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
 
-def get_ai_response(messages, temperature=1.3):
+def get_ai_response(messages, temperature=1.3, response_format=None, coalesce=True, background=False):
     """
-    Generates AI responses using OpenAI's API.
+    Generates AI responses using OpenAI's API. Identical concurrent calls, e.g.
+    from a double-tapped request, share a single provider call (see llm_calls),
+    unless ``coalesce`` is off, for callers that want a fresh reply every time.
+    Calls made outside a request pass ``background`` to use
+    llm_background_bulkhead instead of llm_bulkhead.
 
     Args:
         messages (list): List of message objects for conversation context.
         temperature (float): Controls randomness. Higher = more creative responses.
+        response_format (dict): Provider response format, e.g. JSON_MODE.
+        coalesce (bool): Share identical concurrent calls.
+        background (bool): The call is not made on behalf of a waiting user.
 
     Returns:
         str: AI-generated response.
     """
+    bulkhead = llm_background_bulkhead if background else llm_bulkhead
+    if not coalesce:
+        return _get_ai_response(messages, temperature, response_format, bulkhead)
+    return llm_calls.do(
+        ai_request_key(messages, temperature, response_format),
+        _get_ai_response, messages, temperature, response_format, bulkhead,
+    )
+
+
+def _get_ai_response(messages, temperature, response_format, bulkhead):
+    import openai
+
+    # Raises BulkheadFull when the process already has too many calls in flight
+    bulkhead.acquire()
     try:
         start=time.perf_counter()
         logger.error(f"CALLING AI ;;;;")
         logger.error(f"Received messages as => {messages=}")
         
 
-        # Make API request
+        # Make API request, routed to the best available provider (see llm_router)
         # logger.warning(f"Got messages as => {messages=}")
-        response = client.chat.completions.create(
-            model=os.getenv("AI_MODEL"),
-            messages=messages,
-            temperature=temperature
-        )
-
-        # Extract AI response
-        ai_message = response.choices[0].message.content
+        ai_message = get_llm_router().complete(messages, temperature, response_format)
         logger.error(f"AI RESPONSE => {ai_message}")
         end=time.perf_counter()
         logger.error(f"AI RESPONSE TOOK {end-start} seconds")
@@ -60,36 +129,175 @@ def get_ai_response(messages, temperature=1.3):
 
     except openai.OpenAIError as e:
         logger.error(f"Error communicating with OpenAI API: {e}")
-        return "I'm sorry, I'm having trouble processing your request right now."
+        return AI_FALLBACK_MESSAGE
     except Exception as e:
         logger.exception("Error in AI response.")
 
-        return "I'm sorry, I'm having trouble processing your request right now."
+        return AI_FALLBACK_MESSAGE
+    finally:
+        bulkhead.release()
 
 
-def evaluate_user_skills(user_messages):
+def stream_ai_response(messages, temperature=1.3):
     """
-    Sends the user's messages to the AI for evaluation and returns the AI's response.
+    Streams an AI response, yielding text chunks as the provider produces them.
+
+    On a provider error the same apology as get_ai_response is yielded instead
+    (possibly after some chunks were already sent).
+    """
+    import openai
+
+    llm_bulkhead.acquire()
+    try:
+        start=time.perf_counter()
+        yield from get_llm_router().stream(messages, temperature)
+        end=time.perf_counter()
+        logger.error(f"AI STREAM TOOK {end-start} seconds")
+
+    except openai.OpenAIError as e:
+        logger.error(f"Error communicating with OpenAI API: {e}")
+        yield AI_FALLBACK_MESSAGE
+    except Exception as e:
+        logger.exception("Error in AI response stream.")
+        yield AI_FALLBACK_MESSAGE
+    finally:
+        llm_bulkhead.release()
+
+
+async def aget_ai_response(messages, temperature=1.3, response_format=None):
+    """
+    Async variant of get_ai_response using the AsyncOpenAI client, so waiting
+    on the provider does not hold a worker thread.
+    """
+    return await llm_calls.ado(
+        ai_request_key(messages, temperature, response_format),
+        _aget_ai_response, messages, temperature, response_format,
+    )
+
+
+async def _aget_ai_response(messages, temperature, response_format):
+    import openai
+
+    await llm_bulkhead.aacquire()
+    try:
+        start=time.perf_counter()
+        ai_message = await get_llm_router().acomplete(messages, temperature, response_format)
+        end=time.perf_counter()
+        logger.error(f"AI RESPONSE TOOK {end-start} seconds")
+        return ai_message
+
+    except openai.OpenAIError as e:
+        logger.error(f"Error communicating with OpenAI API: {e}")
+        return AI_FALLBACK_MESSAGE
+    except Exception as e:
+        logger.exception("Error in AI response.")
+        return AI_FALLBACK_MESSAGE
+    finally:
+        llm_bulkhead.release()
+
+
+async def astream_ai_response(messages, temperature=1.3):
+    """
+    Async variant of stream_ai_response.
+    """
+    import openai
+
+    await llm_bulkhead.aacquire()
+    try:
+        async for chunk in get_llm_router().astream(messages, temperature):
+            yield chunk
+
+    except openai.OpenAIError as e:
+        logger.error(f"Error communicating with OpenAI API: {e}")
+        yield AI_FALLBACK_MESSAGE
+    except Exception as e:
+        logger.exception("Error in AI response stream.")
+        yield AI_FALLBACK_MESSAGE
+    finally:
+        llm_bulkhead.release()
+
+
+def parse_structured(output, text, background=False):
+    """
+    Parses an evaluator reply with the StructuredOutput ``output``. A reply that
+    does not parse gets one repair call, restating it in the expected format;
+    ``background`` is passed on to get_ai_response for it.
+
+    Raises:
+        StructuredOutputError: Neither the reply nor its repair parses.
+    """
+    try:
+        result = output.parse(text)
+    except StructuredOutputError:
+        if text == AI_FALLBACK_MESSAGE:
+            output.record("failed")
+            raise
+        if background:
+            repaired = get_ai_response(
+                output.repair_messages(text), temperature=0, response_format=JSON_MODE, background=True
+            )
+        else:
+            repaired = get_ai_response(output.repair_messages(text), temperature=0, response_format=JSON_MODE)
+        return _parse_repaired(output, repaired)
+    output.record("parsed")
+    return result
+
+
+async def aparse_structured(output, text):
+    """
+    Async variant of parse_structured.
+    """
+    try:
+        result = output.parse(text)
+    except StructuredOutputError:
+        if text == AI_FALLBACK_MESSAGE:
+            output.record("failed")
+            raise
+        repaired = await aget_ai_response(output.repair_messages(text), temperature=0, response_format=JSON_MODE)
+        return _parse_repaired(output, repaired)
+    output.record("parsed")
+    return result
+
+
+def _parse_repaired(output, text):
+    try:
+        result = output.parse(text)
+    except StructuredOutputError:
+        output.record("failed")
+        raise
+    output.record("repaired")
+    return result
+
+
+def build_evaluation_messages(user_messages):
+    """
+    Builds the evaluation prompt for the given transcript entries.
     """
-    # logger.info(f"GOT USER MESSAGES AS {user_messages}")
     user_messages = [str(msg) for msg in user_messages]
     evaluation_prompt_formatted = EVALUATION_PROMPT.format(
         user_messages="\n".join(user_messages)
     )
-
-    # logger.info(f"Evaluation prompt formatted {evaluation_prompt_formatted}")
-
-    # Prepare messages for AI
-    messages = [
-        {"role": "system", "content": evaluation_prompt_formatted}
+    return [
+        {"role": "system", "content": evaluation_prompt_formatted},
+        {"role": "system", "content": REPORT_OUTPUT.instructions()},
     ]
 
-    # Get AI response
-    ai_response = get_ai_response(messages)
 
-    return ai_response
+def build_transcript(user_messages, ai_messages):
+    return [
+        {"ai_message": ai, "user_message": user_msg}
+        for ai, user_msg in zip(ai_messages, user_messages)
+    ]
 
 
+def evaluate_user_skills(user_messages):
+    """
+    Sends the user's messages to the AI for evaluation and returns the AI's response.
+    """
+    messages = build_evaluation_messages(user_messages)
+    metrics.observe("evaluation.prompt_chars", sum(len(m["content"]) for m in messages))
+    # Get AI response
+    return get_ai_response(messages, response_format=JSON_MODE)
 
 
 def parse_evaluation_result(evaluation_text):
@@ -100,79 +308,13 @@ def parse_evaluation_result(evaluation_text):
         evaluation_text (str): The textual evaluation response from the AI.
     
     Returns:
-        dict: A dictionary containing extracted scores and feedback.
-    """
-    
-    logger.info(f"EVALATION => {evaluation_text.strip('json').strip('`').strip().replace('json','')}")
-
-    try:
-        result = json.loads(evaluation_text.strip('json').strip('`').strip().replace('json',''))
-        logger.info(f"RESULT {result}")
-        # score = result.get('score')
-        # feedback = result.get('feedback')
-        # result = {"total_score": score, "feedback": feedback}
-
-        # logger.info(f"==>RESULT {result}" )
-
-        return result
-    except Exception as e:
-        logger.info(f"GOT ERROR EVALUATING {e}")
-
-        # Initialize a dictionary to hold the results
-        evaluation_data = {
-            "engagement_score": None,
-            "engagement_feedback": None,
-            "humor_score": None,
-            "humor_feedback": None,
-            "empathy_score": None,
-            "empathy_feedback": None,
-            "total_score": None
-        }
-
-        # Define regex patterns for each score and explanation
-        patterns = {
-            "engagement": {
-                "score": r"### \*\*Engagement Score:\s*(\d{1,3}(?:\.\d{1,2})?)/100\*\*",
-                "feedback": r"### \*\*Engagement Score:.*?\*\*\n\*\*Explanation:\*\*\s*(.*?)\n---"
-            },
-            "humor": {
-                "score": r"### \*\*Humor Score:\s*(\d{1,3}(?:\.\d{1,2})?)/100\*\*",
-                "feedback": r"### \*\*Humor Score:.*?\*\*\n\*\*Explanation:\*\*\s*(.*?)\n---"
-            },
-            "empathy": {
-                "score": r"### \*\*Empathy Score:\s*(\d{1,3}(?:\.\d{1,2})?)/100\*\*",
-                "feedback": r"### \*\*Empathy Score:.*?\*\*\n\*\*Explanation:\*\*\s*(.*?)\n---"
-            },
-            "total": {
-                "score": r"### \*\*Total Score:\s*(\d{1,3}(?:\.\d{1,2})?)/100\*\*",
-                "feedback": None  # No feedback for total score
-            }
-        }
-
-        # Iterate over each pattern and extract data
-        for category, pattern in patterns.items():
-            # Extract score
-            score_match = re.search(pattern["score"], evaluation_text, re.DOTALL)
-            if score_match:
-                score = float(score_match.group(1))
-                key = f"{category}_score"
-                evaluation_data[key] = score
-            else:
-                logger.warning(f"Score for {category} not found in evaluation text.")
-
-            # Extract feedback if applicable
-            if pattern["feedback"]:
-                feedback_match = re.search(pattern["feedback"], evaluation_text, re.DOTALL)
-                if feedback_match:
-                    feedback = feedback_match.group(1).strip()
-                    key = f"{category}_feedback"
-                    evaluation_data[key] = feedback
-                else:
-                    logger.warning(f"Feedback for {category} not found in evaluation text.")
-
-    return evaluation_data
-
+        dict: engagement_score, humor_score, empathy_score and feedback.
 
+    Raises:
+        StructuredOutputError: The evaluation could not be parsed, even after
+            a repair call.
+    """
+    return parse_structured(REPORT_OUTPUT, evaluation_text)
 
 
 def process_evaluation(session, user_messages, ai_messages, session_id, user):
@@ -180,15 +322,22 @@ def process_evaluation(session, user_messages, ai_messages, session_id, user):
     Build evaluation prompts, run evaluation logic, create and return a ReportCard.
     Then, unlock the corresponding category, subcategory, and lesson based on the
     lowest score (engagement, empathy, or humor).
+
+    The AI call runs outside any transaction; only the writes are atomic, so
+    nothing is stored if the evaluation or any of the writes fails.
     """
     # Build the prompt and evaluate
-    prompt_to_send = [
-        {"ai_message": ai, "user_message": user_msg} 
-        for ai, user_msg in zip(ai_messages, user_messages)
-    ]
-    evaluation_result = evaluate_user_skills(prompt_to_send)
+    evaluation_result = evaluate_user_skills(build_transcript(user_messages, ai_messages))
     evaluation_data = parse_evaluation_result(evaluation_result)
-    
+    with transaction.atomic():
+        return save_evaluation(session, user, evaluation_data)
+
+
+def save_evaluation(session, user, evaluation_data):
+    """
+    Creates the ReportCard for a parsed evaluation and unlocks the content for
+    the weakest attribute. Makes no AI calls.
+    """
     feedback = evaluation_data.get("feedback", "Empty")
     engagement_score = int(evaluation_data.get("engagement_score", 0))
     empathy_score = int(evaluation_data.get("empathy_score", 0))
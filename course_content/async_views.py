@@ -0,0 +1,152 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.async_views import AsyncAPIView, same_schema_as
+from api.resilience import BulkheadFull
+from api.structured_output import JSON_MODE, StructuredOutputError
+from api.utils import LLMOverloaded, aget_ai_response
+from .evaluation import (
+    EMPTY_RESPONSE_FEEDBACK,
+    aparse_evaluation,
+    build_evaluation_messages,
+    cached_evaluation,
+    is_empty_response,
+    local_evaluation,
+    record_attempt,
+    remember_evaluation,
+)
+from .prescoring import prescore
+from .models import Lesson
+from .views import CLIENT_URL, UNUSABLE_EVALUATION_MESSAGE, BatchEvaluateLessonView, EvaluateLessonView
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEvaluateLessonView(AsyncAPIView, EvaluateLessonView):
+    """
+    Async version of EvaluateLessonView; awaits the AI evaluator instead of
+    blocking a worker thread.
+    """
+
+    @same_schema_as(EvaluateLessonView.post)
+    async def post(self, request):
+        try:
+            lesson_id = request.data.get("lesson_id")
+            user_response = request.data.get("user_response", "")
+            time_taken = request.data.get("time_taken")
+
+            if not lesson_id or time_taken is None:
+                return Response(
+                    {"error": "Missing required fields: lesson_id and time_taken"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            lesson = await Lesson.objects.select_related("subcategory").filter(id=lesson_id).afirst()
+            if lesson is None:
+                raise Http404("No Lesson matches the given query.")
+
+            if is_empty_response(user_response):
+                await sync_to_async(record_attempt)(
+                    request.user, lesson, 0, EMPTY_RESPONSE_FEEDBACK, time_taken, completed=False
+                )
+                return Response({
+                    "score": 0,
+                    "feedback": EMPTY_RESPONSE_FEEDBACK,
+                    "completed": False
+                }, status=status.HTTP_200_OK)
+
+            feedback = prescore(lesson, user_response, time_taken)
+            if feedback:
+                await sync_to_async(record_attempt)(
+                    request.user, lesson, 0, feedback, time_taken, completed=False
+                )
+                return Response({
+                    "score": 0,
+                    "feedback": feedback,
+                    "completed": False
+                }, status=status.HTTP_200_OK)
+
+            cached = cached_evaluation(lesson, user_response)
+            if cached:
+                score, feedback = cached
+            else:
+                messages = build_evaluation_messages(lesson, user_response)
+                ai_response = await aget_ai_response(messages, temperature=1.3, response_format=JSON_MODE)
+                logger.info(f"AI evaluation response: {ai_response}")
+                score, feedback = await aparse_evaluation(ai_response)
+                remember_evaluation(lesson, user_response, messages, ai_response, score, feedback)
+
+            completed, next_lesson_id = await sync_to_async(transaction.atomic(record_attempt))(
+                request.user, lesson, score, feedback, time_taken
+            )
+
+            return Response({
+                "score": score,
+                "feedback": feedback,
+                "completed": completed,
+                "next_lesson_url": f"{CLIENT_URL}/training/lessondetail/{next_lesson_id}" if completed else None
+            }, status=status.HTTP_200_OK)
+
+        except BulkheadFull:
+            raise LLMOverloaded()
+        except StructuredOutputError:
+            logger.exception("Unusable lesson evaluation.")
+            return Response({"error": UNUSABLE_EVALUATION_MESSAGE}, status=status.HTTP_502_BAD_GATEWAY)
+        except Exception as e:
+            logger.exception("Exception during lesson evaluation.")
+            return Response(
+                {"error": "An error occurred during evaluation", "detail": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class AsyncBatchEvaluateLessonView(AsyncAPIView, BatchEvaluateLessonView):
+    """
+    Async version of BatchEvaluateLessonView; the AI evaluator calls run on the
+    event loop instead of a thread pool.
+    """
+
+    @same_schema_as(BatchEvaluateLessonView.post)
+    async def post(self, request):
+        items, error = self.parse_items(request)
+        if error:
+            return error
+        lessons = {
+            lesson.pk: lesson
+            async for lesson in Lesson.objects.select_related("subcategory").filter(
+                pk__in={lesson_id for lesson_id, _, _ in items}
+            )
+        }
+        missing = self.missing_lessons(items, lessons)
+        if missing:
+            return missing
+
+        try:
+            evaluations = [local_evaluation(lessons[lesson_id], *answer) for lesson_id, *answer in items]
+            pending = [index for index, evaluation in enumerate(evaluations) if evaluation is None]
+            semaphore = asyncio.Semaphore(settings.LESSON_BATCH_CONCURRENCY)
+
+            async def evaluate(index):
+                async with semaphore:
+                    return await self.aevaluate(lessons[items[index][0]], items[index][1])
+
+            outcomes = await asyncio.gather(*(evaluate(index) for index in pending), return_exceptions=True)
+            errors = self.settle(pending, outcomes, evaluations)
+            return await sync_to_async(self.respond)(request.user, items, lessons, evaluations, errors)
+        except BulkheadFull:
+            raise LLMOverloaded()
+
+    async def aevaluate(self, lesson, user_response):
+        messages = build_evaluation_messages(lesson, user_response)
+        ai_response = await aget_ai_response(messages, temperature=1.3, response_format=JSON_MODE)
+        logger.info(f"AI evaluation response: {ai_response}")
+        score, feedback = await aparse_evaluation(ai_response)
+        remember_evaluation(lesson, user_response, messages, ai_response, score, feedback)
+        return score, feedback
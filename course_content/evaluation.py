@@ -0,0 +1,250 @@
+"""
+Lesson evaluation steps shared by the sync and async EvaluateLessonView.
+"""
+import hashlib
+import json
+import logging
+import re
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from api import metrics
+from api.caching import TTLCache
+from api.chat_service import count_tokens
+from api.structured_output import Number, StructuredOutput, Text
+from api.utils import aparse_structured, parse_structured
+from .models import Lesson, LessonProgress, UserContentAccess
+from .prescoring import prescore
+
+logger = logging.getLogger(__name__)
+
+# (score, feedback, tokens) of past evaluations, keyed by evaluation_cache_key,
+# so a repeated or trivially different answer is not sent to the AI again.
+evaluation_cache = TTLCache(
+    maxsize=settings.LESSON_EVALUATION_CACHE_SIZE,
+    ttl=settings.LESSON_EVALUATION_CACHE_TTL,
+)
+
+NON_WORD_PATTERN = re.compile(r"[^\w\s]")
+
+EMPTY_RESPONSE_FEEDBACK = "Oops! Looks like you created an awkward moment. No response provided."
+
+# Also accepts the older "score: <score>, feedback: <feedback>" replies.
+LESSON_OUTPUT = StructuredOutput(
+    "lesson_evaluation",
+    {"score": Number(), "feedback": Text("feedback, at most 20 words")},
+)
+
+
+def is_empty_response(user_response):
+    return user_response.strip() == "" or len(user_response) < 5
+
+
+def build_evaluation_messages(lesson, user_response):
+    """
+    Builds the prompt messages for the AI evaluator from the lesson's JSON content
+    ('Context', 'Objective' and optionally 'Feedback Focus').
+    """
+    content = lesson.content or {}
+    context_text = content.get("Context", "No context provided")
+    objective_text = content.get("Objective", "No objective provided")
+    evaluation_criteria = content.get("Feedback Focus", "Provide a creative and authentic response")
+
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are a social skills trainer and evaluator. Given a specific scenario and context, "
+                "evaluate the following response by the user. Provide a score out of 100 and brief feedback "
+                "that is helpful to the users. Your tone should be positive in general. Like you did this good,"
+                "but you can improve this. The feedback should be concise and to the point. "
+                "Remember users' response should always take into account the context, if not provide that in your feedback and decrease score."
+                "The feedback should be constructive and actionable. "
+                "The feedback should be specific and clear. "
+                "The feedback should be encouraging and motivating. "
+                "Never give examples as to how users' should response in your feedback. "
+                f"Remember the score is out of 100 and the passing score is {lesson.threshold_score}, give a score"
+                "above this only when you feel the user was almost perfect. Also your feedback should be"
+                f"no more than 20 words. {LESSON_OUTPUT.instructions()}"
+            )
+        },
+        {
+            "role": "user",
+            "content": (
+                f"Context: {context_text}\n"
+                f"Objective: {objective_text}\n"
+                f"Evaluation Criteria: {evaluation_criteria}\n"
+                f"User Response: {user_response}"
+            )
+        }
+    ]
+
+
+def normalise_response(user_response):
+    """
+    Lowercases the response and drops punctuation and extra whitespace, so
+    "Hi, how are you?" and "hi how are you" are evaluated once.
+    """
+    return " ".join(NON_WORD_PATTERN.sub(" ", user_response.lower()).split())
+
+
+def content_version(lesson):
+    """
+    Hash of everything about the lesson that goes into the evaluation prompt,
+    so editing a lesson invalidates its cached evaluations.
+    """
+    payload = json.dumps([lesson.content, lesson.threshold_score], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def evaluation_cache_key(lesson, user_response):
+    normalised = hashlib.sha256(normalise_response(user_response).encode()).hexdigest()
+    return f"{lesson.pk}:{content_version(lesson)}:{normalised}"
+
+
+def cached_evaluation(lesson, user_response):
+    """
+    Returns the cached (score, feedback) for an equivalent response, or None.
+    """
+    entry = evaluation_cache.get(evaluation_cache_key(lesson, user_response))
+    metrics.incr("lesson_evaluation_cache.hit" if entry else "lesson_evaluation_cache.miss")
+    hits = metrics.get_counter("lesson_evaluation_cache.hit")
+    metrics.set_gauge(
+        "lesson_evaluation_cache.hit_ratio",
+        round(hits / (hits + metrics.get_counter("lesson_evaluation_cache.miss")), 3),
+    )
+    if entry is None:
+        return None
+    score, feedback, tokens = entry
+    metrics.incr("lesson_evaluation_cache.saved_tokens", tokens)
+    return score, feedback
+
+
+def remember_evaluation(lesson, user_response, messages, ai_response, score, feedback):
+    tokens = sum(count_tokens(message["content"]) for message in messages) + count_tokens(ai_response)
+    evaluation_cache.set(evaluation_cache_key(lesson, user_response), (score, feedback, tokens))
+
+
+def parse_evaluation(ai_response):
+    """
+    Returns (score, feedback) from the evaluator's reply.
+
+    Raises:
+        ValueError: The reply does not match the expected format, even after a
+            repair call.
+    """
+    result = parse_structured(LESSON_OUTPUT, ai_response)
+    return result["score"], result["feedback"]
+
+
+async def aparse_evaluation(ai_response):
+    """
+    Async variant of parse_evaluation.
+    """
+    result = await aparse_structured(LESSON_OUTPUT, ai_response)
+    return result["score"], result["feedback"]
+
+
+def local_evaluation(lesson, user_response, time_taken):
+    """
+    Evaluates the answer without the AI where possible: empty answers, answers
+    failed by pre-scoring and answers with a cached evaluation.
+
+    Returns:
+        tuple: (score, feedback, completed), completed being None when it
+        follows from the score; or None if the AI evaluator is needed.
+    """
+    if is_empty_response(user_response):
+        return 0, EMPTY_RESPONSE_FEEDBACK, False
+    feedback = prescore(lesson, user_response, time_taken)
+    if feedback:
+        return 0, feedback, False
+    cached = cached_evaluation(lesson, user_response)
+    if cached:
+        return (*cached, None)
+    return None
+
+
+def record_attempt(user, lesson, score, feedback, time_taken, completed=None):
+    """
+    Records the lesson progress and, if the lesson is completed
+    (score >= lesson.threshold_score and time_taken < lesson.max_time, unless
+    ``completed`` is given), unlocks the next lesson in the subcategory.
+
+    Returns:
+        tuple: (completed, next_lesson_id); next_lesson_id is 0 when there is
+        no next lesson.
+    """
+    return record_attempts(user, [(lesson, score, feedback, time_taken, completed)])[0]
+
+
+def record_attempts(user, attempts):
+    """
+    Batch version of record_attempt for (lesson, score, feedback, time_taken,
+    completed) attempts: the progress rows are inserted at once and the next
+    lessons unlocked with a fixed number of queries.
+
+    Returns:
+        list: (completed, next_lesson_id) per attempt.
+    """
+    results = []
+    progress = []
+    for lesson, score, feedback, time_taken, completed in attempts:
+        if completed is None:
+            completed = (score >= lesson.threshold_score) and (time_taken < lesson.max_time)
+        results.append(completed)
+        progress.append(LessonProgress(
+            user=user,
+            lesson=lesson,
+            completed=completed,
+            score=score,
+            time_taken=time_taken,
+            feedback=feedback
+        ))
+    LessonProgress.objects.bulk_create(progress)
+
+    completed_lessons = [attempt[0] for attempt, completed in zip(attempts, results) if completed]
+    next_lessons = next_lessons_of(completed_lessons)
+    unlock_lessons(user, next_lessons.values())
+    replies = []
+    for (lesson, *_), completed in zip(attempts, results):
+        next_lesson = next_lessons.get((lesson.subcategory_id, lesson.order + 1)) if completed else None
+        replies.append((completed, next_lesson.id if next_lesson else 0))
+    return replies
+
+
+def next_lessons_of(lessons):
+    """
+    Returns the lessons following ``lessons`` in their subcategories, by
+    (subcategory_id, order).
+    """
+    if not lessons:
+        return {}
+    following = Q()
+    for lesson in lessons:
+        following |= Q(subcategory_id=lesson.subcategory_id, order=lesson.order + 1)
+    next_lessons = {}
+    for lesson in Lesson.objects.filter(following).order_by("pk"):
+        next_lessons.setdefault((lesson.subcategory_id, lesson.order), lesson)
+    return next_lessons
+
+
+def unlock_lessons(user, lessons):
+    lessons = {lesson.pk: lesson for lesson in lessons}
+    if not lessons:
+        return
+    ctype = ContentType.objects.get_for_model(Lesson)
+    accesses = UserContentAccess.objects.filter(user=user, content_type=ctype, object_id__in=lessons)
+    accesses.filter(allowed=False).update(allowed=True)
+    existing = set(accesses.values_list("object_id", flat=True))
+    UserContentAccess.objects.bulk_create(
+        [
+            UserContentAccess(user=user, content_type=ctype, object_id=pk, allowed=True)
+            for pk in lessons if pk not in existing
+        ],
+        ignore_conflicts=True,
+    )
+    for lesson in lessons.values():
+        logger.info(f"Next lesson unlocked: {lesson}")
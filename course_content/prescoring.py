@@ -0,0 +1,116 @@
+"""
+Deterministic pre-scoring of lesson answers.
+
+Answers that cannot pass (keyboard mashing, one word repeated, the lesson
+context pasted back, or an attempt past the lesson's max_time) are failed with a
+score of 0 before the AI evaluator is called. Rules are registered with
+``@rule(name)`` and LESSON_PRESCORING_RULES picks the ones that run, in order;
+each takes (lesson, user_response, time_taken) and returns the feedback for a
+failed answer, or None to leave it to the next rule and then the AI.
+``manage.py run_benchmarks prescoring`` measures the rules against the labelled
+answers in prescoring_samples.json.
+"""
+import re
+
+from django.conf import settings
+
+from api import metrics
+
+RULES = {}
+
+# Runs of letters in any script, with inner apostrophes ("don't").
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+VOWELS = set("aeiouy")
+# Longest run of consonants in real English words ("strengths" has 5 after the e).
+MAX_CONSONANT_RUN = 5
+# Share of the answer's word trigrams found in the lesson text for it to count as a copy.
+COPY_OVERLAP = 0.8
+
+TOO_SLOW_FEEDBACK = "Time's up! Try to answer a little quicker next time."
+GIBBERISH_FEEDBACK = "That doesn't look like a real answer. Give it a proper try!"
+REPEATED_WORD_FEEDBACK = "One word on repeat won't get the conversation going. Try a full reply."
+COPIED_CONTEXT_FEEDBACK = "That's the scenario itself. Reply to it in your own words."
+
+
+def rule(name):
+    def register(fn):
+        RULES[name] = fn
+        return fn
+    return register
+
+
+def words(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+def looks_like_word(word):
+    letters = word.replace("'", "")
+    if not letters.isascii():
+        # Only plain ASCII words are judged.
+        return True
+    if not VOWELS & set(letters):
+        return False
+    run = 0
+    for char in letters:
+        run = 0 if char in VOWELS else run + 1
+        if run > MAX_CONSONANT_RUN:
+            return False
+    return True
+
+
+def trigrams(tokens):
+    return {tuple(tokens[index:index + 3]) for index in range(len(tokens) - 2)}
+
+
+@rule("too_slow")
+def too_slow(lesson, user_response, time_taken):
+    # Mirrors record_attempt: such an attempt is never completed, whatever the score.
+    if not time_taken < lesson.max_time:
+        return TOO_SLOW_FEEDBACK
+    return None
+
+
+@rule("gibberish")
+def gibberish(lesson, user_response, time_taken):
+    tokens = words(user_response)
+    if sum(map(looks_like_word, tokens)) * 2 < max(len(tokens), 1):
+        return GIBBERISH_FEEDBACK
+    return None
+
+
+@rule("repeated_word")
+def repeated_word(lesson, user_response, time_taken):
+    tokens = words(user_response)
+    if len(tokens) > 1 and len(set(tokens)) == 1:
+        return REPEATED_WORD_FEEDBACK
+    return None
+
+
+@rule("copied_context")
+def copied_context(lesson, user_response, time_taken):
+    answer = trigrams(words(user_response))
+    if len(answer) < 2:
+        return None
+    content = lesson.content or {}
+    lesson_text = trigrams(words(f"{content.get('Context', '')} {content.get('Objective', '')}"))
+    if len(answer & lesson_text) >= COPY_OVERLAP * len(answer):
+        return COPIED_CONTEXT_FEEDBACK
+    return None
+
+
+def prescore(lesson, user_response, time_taken):
+    """
+    Runs the LESSON_PRESCORING_RULES over the answer.
+
+    Returns:
+        str: Feedback for an answer failed by a rule (score 0, not completed),
+        or None if it needs the AI evaluator.
+    """
+    for name in settings.LESSON_PRESCORING_RULES:
+        feedback = RULES[name](lesson, user_response, time_taken)
+        if feedback is not None:
+            metrics.incr("lesson_prescoring.failed")
+            metrics.incr(f"lesson_prescoring.{name}")
+            return feedback
+    metrics.incr("lesson_prescoring.passed_on")
+    return None
@@ -1,3 +1,274 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from api import metrics
+from api.benchmarks import BENCHMARKS
+from api.models import User
+from api.resilience import BulkheadFull
+from . import prescoring
+from .async_views import AsyncBatchEvaluateLessonView, AsyncEvaluateLessonView
+from .evaluation import evaluation_cache, normalise_response
+from .models import Category, Lesson, LessonProgress, SubCategory, is_content_accessible
+from .views import UNUSABLE_EVALUATION_MESSAGE
+
+
+class LessonEvaluationCacheTest(TestCase):
+
+    def setUp(self):
+        evaluation_cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        subcategory = SubCategory.objects.create(category=Category.objects.create(name="Humor"), name="Wit")
+        self.lesson = Lesson.objects.create(
+            subcategory=subcategory, title="Icebreaker", content={"Context": "A party", "Objective": "Say hi"}
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def evaluate(self, user_response):
+        return self.client.post(
+            reverse("evaluate_lesson"),
+            {"lesson_id": self.lesson.id, "user_response": user_response, "time_taken": 10},
+            format="json",
+        )
+
+    def test_normalise_response(self):
+        self.assertEqual(normalise_response("  Hi,   how are YOU?! "), "hi how are you")
+
+    def test_equivalent_answer_is_served_from_cache(self):
+        saved_tokens = metrics.get_counter("lesson_evaluation_cache.saved_tokens")
+        with mock.patch("course_content.views.get_ai_response", return_value="score: 80, feedback: Nice one") as provider:
+            first = self.evaluate("Hi there, how are you?")
+            second = self.evaluate("hi there how are you")
+        self.assertEqual(provider.call_count, 1)
+        self.assertEqual((second.data["score"], second.data["feedback"]), (80.0, "Nice one"))
+        self.assertEqual(first.data["completed"], second.data["completed"])
+        self.assertEqual(LessonProgress.objects.filter(user=self.user).count(), 2)
+        self.assertGreater(metrics.get_counter("lesson_evaluation_cache.saved_tokens"), saved_tokens)
+
+    def test_edited_lesson_is_evaluated_again(self):
+        with mock.patch("course_content.views.get_ai_response", return_value="score: 80, feedback: Nice one") as provider:
+            self.evaluate("Hi there, how are you?")
+            self.lesson.content = {"Context": "A wedding", "Objective": "Say hi"}
+            self.lesson.save()
+            self.evaluate("Hi there, how are you?")
+        self.assertEqual(provider.call_count, 2)
+
+    def test_drifted_reply_is_repaired(self):
+        with mock.patch("course_content.views.get_ai_response", return_value="Great effort, I'd give it 75!"), \
+                mock.patch("api.utils.get_ai_response", return_value='{"score": 75, "feedback": "Great effort"}'):
+            response = self.evaluate("Hi there, how are you?")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["score"], response.data["feedback"]), (75.0, "Great effort"))
+
+    def test_unusable_reply_is_not_echoed(self):
+        with mock.patch("course_content.views.get_ai_response", return_value="Secret rubric: be nice"), \
+                mock.patch("api.utils.get_ai_response", return_value="Still no score"), \
+                self.assertLogs("course_content.views", "ERROR"):
+            response = self.evaluate("Hi there, how are you?")
+        self.assertEqual((response.status_code, response.data), (502, {"error": UNUSABLE_EVALUATION_MESSAGE}))
+        self.assertFalse(LessonProgress.objects.exists())
+
+
+class PrescoringTest(TestCase):
+
+    def setUp(self):
+        evaluation_cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        subcategory = SubCategory.objects.create(category=Category.objects.create(name="Humor"), name="Wit")
+        self.lesson = Lesson.objects.create(
+            subcategory=subcategory,
+            title="Bartender",
+            content={
+                "Context": "You are sitting at a bar by yourself, waiting for someone for a long time.",
+                "Objective": "Reply in a friendly way.",
+            },
+            max_time=60,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rules(self):
+        cases = [
+            ("I'm good thanks, just waiting on a friend. What do you recommend?", 20, None),
+            ("Strengths and rhythms, what a night!", 20, None),
+            ("Bonjour, ça va très bien, merci !", 20, None),
+            ("Sure, happy to chat!", 60, prescoring.TOO_SLOW_FEEDBACK),
+            ("asdfghjkl qwrtzp", 20, prescoring.GIBBERISH_FEEDBACK),
+            ("12345 67890", 20, prescoring.GIBBERISH_FEEDBACK),
+            ("hello hello hello", 20, prescoring.REPEATED_WORD_FEEDBACK),
+            ("You are sitting at a bar by yourself, waiting", 20, prescoring.COPIED_CONTEXT_FEEDBACK),
+        ]
+        for response, time_taken, expected in cases:
+            with self.subTest(response=response):
+                self.assertEqual(prescoring.prescore(self.lesson, response, time_taken), expected)
+
+    def test_prescored_answer_skips_evaluator(self):
+        with mock.patch("course_content.views.get_ai_response") as provider:
+            response = self.client.post(
+                reverse("evaluate_lesson"),
+                {"lesson_id": self.lesson.id, "user_response": "hello hello hello", "time_taken": 10},
+                format="json",
+            )
+        provider.assert_not_called()
+        self.assertEqual(response.data, {
+            "score": 0, "feedback": prescoring.REPEATED_WORD_FEEDBACK, "completed": False
+        })
+        progress = LessonProgress.objects.get(user=self.user)
+        self.assertEqual((progress.score, progress.completed), (0, False))
+
+    @override_settings(LESSON_PRESCORING_RULES=[])
+    def test_disabled(self):
+        self.assertIsNone(prescoring.prescore(self.lesson, "hello hello hello", 10))
+
+    def test_labelled_samples_keep_outcomes(self):
+        results = BENCHMARKS["prescoring"](repeat=1)
+        self.assertEqual(results["outcome_changes"], 0)
+        self.assertGreater(results["llm_calls_avoided"], 0)
+
+
+class BatchEvaluateLessonTest(TestCase):
+
+    def setUp(self):
+        evaluation_cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        subcategory = SubCategory.objects.create(category=Category.objects.create(name="Humor"), name="Wit")
+        self.lessons = [
+            Lesson.objects.create(
+                subcategory=subcategory, title=f"Lesson {order}", order=order,
+                content={"Context": f"Scenario {order}", "Objective": "Say hi"},
+            )
+            for order in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def evaluate(self, items):
+        return self.client.post(reverse("evaluate_lessons"), {"items": items}, format="json")
+
+    @staticmethod
+    def evaluator(messages, temperature, response_format=None):
+        answer = messages[-1]["content"]
+        if "great" in answer:
+            return "score: 90, feedback: Lovely"
+        if "fine" in answer:
+            return "score: 30, feedback: Try harder"
+        return "I cannot score this"
+
+    def test_results_per_item(self):
+        items = [
+            {"lesson_id": self.lessons[0].id, "user_response": "Hi, you look great today!", "time_taken": 10},
+            {"lesson_id": self.lessons[1].id, "user_response": "hello hello hello", "time_taken": 10},
+            {"lesson_id": self.lessons[2].id, "user_response": "Hi, I'm fine thanks.", "time_taken": 10},
+            {"lesson_id": self.lessons[3].id, "user_response": "Something unexpected", "time_taken": 10},
+        ]
+        with mock.patch("course_content.views.get_ai_response", side_effect=self.evaluator) as provider, \
+                mock.patch("api.utils.get_ai_response", side_effect=self.evaluator) as repair, \
+                self.assertLogs("course_content.views", "ERROR"):
+            response = self.evaluate(items)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((provider.call_count, repair.call_count), (3, 1))
+        passed, prescored, failed, broken = response.data["results"]
+        self.assertEqual(passed["score"], 90.0)
+        self.assertTrue(passed["completed"])
+        self.assertTrue(passed["next_lesson_url"].endswith(f"/training/lessondetail/{self.lessons[1].id}"))
+        self.assertEqual(prescored, {
+            "score": 0, "feedback": prescoring.REPEATED_WORD_FEEDBACK, "completed": False, "next_lesson_url": None
+        })
+        self.assertEqual((failed["score"], failed["completed"]), (30.0, False))
+        self.assertEqual(broken, {"error": "An error occurred during evaluation", "detail": UNUSABLE_EVALUATION_MESSAGE})
+        self.assertEqual(LessonProgress.objects.filter(user=self.user).count(), 3)
+        self.assertTrue(is_content_accessible(self.user, self.lessons[1]))
+        self.assertFalse(is_content_accessible(self.user, self.lessons[3]))
+
+    def test_invalid_requests(self):
+        with override_settings(LESSON_BATCH_MAX_ITEMS=1):
+            item = {"lesson_id": self.lessons[0].id, "user_response": "hi", "time_taken": 1}
+            self.assertEqual(self.evaluate([item, item]).status_code, 400)
+        self.assertEqual(self.evaluate([{"lesson_id": self.lessons[0].id}]).status_code, 400)
+        for invalid in [{"user_response": ["hi"]}, {"user_response": None}, {"time_taken": "10"}, {"time_taken": True}]:
+            with self.subTest(invalid=invalid):
+                item = {"lesson_id": self.lessons[0].id, "user_response": "hi", "time_taken": 1, **invalid}
+                self.assertEqual(self.evaluate([item]).status_code, 400)
+        response = self.evaluate([{"lesson_id": 999, "user_response": "", "time_taken": 1}])
+        self.assertEqual((response.status_code, response.data["lesson_ids"]), (404, [999]))
+
+    def test_overload_sheds_whole_batch(self):
+        items = [{"lesson_id": self.lessons[0].id, "user_response": "Hi, you look great!", "time_taken": 10}]
+        with mock.patch("course_content.views.get_ai_response", side_effect=BulkheadFull("llm bulkhead full")):
+            response = self.evaluate(items)
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(LessonProgress.objects.exists())
+
+
+@override_settings(ASYNC_VIEWS=True)
+class AsyncEvaluateLessonTest(TestCase):
+
+    def setUp(self):
+        evaluation_cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        subcategory = SubCategory.objects.create(category=Category.objects.create(name="Humor"), name="Wit")
+        self.lessons = [
+            Lesson.objects.create(
+                subcategory=subcategory, title=f"Lesson {order}", order=order,
+                content={"Context": f"Scenario {order}", "Objective": "Say hi"},
+            )
+            for order in range(2)
+        ]
+
+    def call(self, view, data):
+        request = APIRequestFactory().post("/", data, format="json")
+        force_authenticate(request, self.user)
+
+        async def run():
+            return (await view.as_view()(request)).render()
+
+        return async_to_sync(run)()
+
+    @staticmethod
+    async def evaluator(messages, temperature, response_format=None):
+        if "great" in messages[-1]["content"]:
+            return '{"score": 90, "feedback": "Lovely"}'
+        return "I cannot score this"
+
+    def test_evaluation_is_recorded(self):
+        with mock.patch("course_content.async_views.aget_ai_response", side_effect=self.evaluator):
+            response = self.call(AsyncEvaluateLessonView, {
+                "lesson_id": self.lessons[0].id, "user_response": "Hi, you look great today!", "time_taken": 10
+            })
+        self.assertEqual((response.status_code, response.data["score"], response.data["completed"]), (200, 90.0, True))
+        self.assertTrue(is_content_accessible(self.user, self.lessons[1]))
+
+    def test_unusable_reply_is_not_echoed(self):
+        with mock.patch("course_content.async_views.aget_ai_response", side_effect=self.evaluator), \
+                mock.patch("api.utils.aget_ai_response", side_effect=self.evaluator), \
+                self.assertLogs("course_content.async_views", "ERROR"):
+            response = self.call(AsyncEvaluateLessonView, {
+                "lesson_id": self.lessons[0].id, "user_response": "Something unexpected", "time_taken": 10
+            })
+        self.assertEqual((response.status_code, response.data), (502, {"error": UNUSABLE_EVALUATION_MESSAGE}))
+        self.assertFalse(LessonProgress.objects.exists())
+
+    def test_batch(self):
+        items = [
+            {"lesson_id": self.lessons[0].id, "user_response": "Hi, you look great today!", "time_taken": 10},
+            {"lesson_id": self.lessons[1].id, "user_response": "hello hello hello", "time_taken": 10},
+        ]
+        with mock.patch("course_content.async_views.aget_ai_response", side_effect=self.evaluator) as provider:
+            response = self.call(AsyncBatchEvaluateLessonView, {"items": items})
+        self.assertEqual(provider.call_count, 1)
+        passed, prescored = response.data["results"]
+        self.assertEqual((passed["score"], passed["completed"]), (90.0, True))
+        self.assertEqual((prescored["score"], prescored["feedback"]), (0, prescoring.REPEATED_WORD_FEEDBACK))
+        self.assertEqual(LessonProgress.objects.filter(user=self.user).count(), 2)
+
+    def test_batch_overload_sheds_whole_batch(self):
+        items = [{"lesson_id": self.lessons[0].id, "user_response": "Hi, you look great!", "time_taken": 10}]
+        with mock.patch("course_content.async_views.aget_ai_response", side_effect=BulkheadFull("full")):
+            response = self.call(AsyncBatchEvaluateLessonView, {"items": items})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(LessonProgress.objects.exists())
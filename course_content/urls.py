@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
@@ -6,10 +7,17 @@ from .views import (
     LessonViewSet,
     LessonProgressViewSet,
     EvaluateLessonView,
+    BatchEvaluateLessonView,
     TrainingPlanStatusView,  # import the new view
     SubCategoryIntroView  # Add the new view
 )
 
+if settings.ASYNC_VIEWS:
+    from .async_views import (
+        AsyncEvaluateLessonView as EvaluateLessonView,
+        AsyncBatchEvaluateLessonView as BatchEvaluateLessonView,
+    )
+
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'subcategories', SubCategoryViewSet, basename='subcategory')
@@ -20,5 +28,6 @@ urlpatterns = [
     path('', include(router.urls)),
     path('training_plan_status/', TrainingPlanStatusView.as_view(), name='training_plan_status'),
     path('evaluate-lesson/', EvaluateLessonView.as_view(), name="evaluate_lesson"),
+    path('evaluate-lessons/', BatchEvaluateLessonView.as_view(), name="evaluate_lessons"),
     path('subcategory-intro/<int:subcategory_id>/', SubCategoryIntroView.as_view(), name="subcategory_intro"),
 ]
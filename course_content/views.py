@@ -14,18 +14,37 @@ from django.contrib.contenttypes.models import ContentType
 
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from api.utils import get_ai_response
+from api.resilience import BulkheadFull
+from api.structured_output import JSON_MODE, StructuredOutputError
+from api.utils import LLMOverloaded, get_ai_response
+from api.supabase_auth import LazyAuthenticationMixin
+from .evaluation import (
+    EMPTY_RESPONSE_FEEDBACK,
+    build_evaluation_messages,
+    cached_evaluation,
+    is_empty_response,
+    parse_evaluation,
+    local_evaluation,
+    record_attempt,
+    record_attempts,
+    remember_evaluation,
+)
+from .prescoring import prescore
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 import logging
-import re
 import os
 
 logger = logging.getLogger(__name__)
 CLIENT_URL = os.getenv('CLIENT_URL', "http://localhost:5173")
+# Shown instead of the evaluator's reply when it could not be parsed.
+UNUSABLE_EVALUATION_MESSAGE = "The AI evaluator returned an unusable answer. Please try again."
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(LazyAuthenticationMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
 
@@ -51,7 +70,7 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 
-class SubCategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class SubCategoryViewSet(LazyAuthenticationMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = SubCategorySerializer
     permission_classes = [IsAuthenticated]
 
@@ -96,7 +115,7 @@ class SubCategoryViewSet(viewsets.ReadOnlyModelViewSet):
         return super().retrieve(request, *args, **kwargs)
 
 
-class LessonViewSet(viewsets.ReadOnlyModelViewSet):
+class LessonViewSet(LazyAuthenticationMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated]
 
@@ -143,7 +162,7 @@ class LessonViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 
-class LessonProgressViewSet(viewsets.ModelViewSet):
+class LessonProgressViewSet(LazyAuthenticationMixin, viewsets.ModelViewSet):
     """
     ViewSet to track user progress on lessons.
     """
@@ -195,7 +214,7 @@ class LessonProgressViewSet(viewsets.ModelViewSet):
         return super().create(request, *args, **kwargs)
 
 
-class TrainingPlanStatusView(APIView):
+class TrainingPlanStatusView(LazyAuthenticationMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
@@ -338,7 +357,7 @@ class TrainingPlanStatusView(APIView):
 
 
 
-class EvaluateLessonView(APIView):
+class EvaluateLessonView(LazyAuthenticationMixin, APIView):
     """
     API to evaluate a user's lesson attempt.
     The client must send lesson_id, user_response, and time_taken.
@@ -377,7 +396,8 @@ class EvaluateLessonView(APIView):
                 )
             ),
             400: "Bad Request",
-            500: "Internal Server Error"
+            500: "Internal Server Error",
+            502: "Unusable answer from the AI evaluator"
         }
     )
     def post(self, request):
@@ -395,110 +415,38 @@ class EvaluateLessonView(APIView):
             # Retrieve the lesson instance
             lesson = get_object_or_404(Lesson, id=lesson_id)
 
-            # Extract details from the lesson's JSON content.
-            # It's assumed that the content field includes keys like 'Context', 'Objective', and optionally 'Feedback Focus'.
-            content = lesson.content or {}
-            context_text = content.get("Context", "No context provided")
-            objective_text = content.get("Objective", "No objective provided")
-            evaluation_criteria = content.get("Feedback Focus", "Provide a creative and authentic response")
-
-            if user_response.strip() == "" or len(user_response) < 5:
+            if is_empty_response(user_response):
                 # If the user response is empty, return a default response.
-                feedback = "Oops! Looks like you created an awkward moment. No response provided."
-                LessonProgress.objects.create(
-                user=request.user,
-                lesson=lesson,
-                completed=False,
-                score=0,
-                time_taken=time_taken,
-                feedback=feedback
-                )
+                record_attempt(request.user, lesson, 0, EMPTY_RESPONSE_FEEDBACK, time_taken, completed=False)
+                return Response({
+                "score": 0,
+                "feedback": EMPTY_RESPONSE_FEEDBACK,
+                "completed": False
+                }, status=status.HTTP_200_OK)
+
+            # Fail hopeless answers (gibberish, copied context, too slow) without the AI.
+            feedback = prescore(lesson, user_response, time_taken)
+            if feedback:
+                record_attempt(request.user, lesson, 0, feedback, time_taken, completed=False)
                 return Response({
                 "score": 0,
                 "feedback": feedback,
                 "completed": False
                 }, status=status.HTTP_200_OK)
 
-            # Build prompt messages for the AI evaluator.
-            prompt_messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a social skills trainer and evaluator. Given a specific scenario and context, "
-                        "evaluate the following response by the user. Provide a score out of 100 and brief feedback "
-                        "that is helpful to the users. Your tone should be positive in general. Like you did this good,"
-                        "but you can improve this. The feedback should be concise and to the point. "
-                        "Remember users' response should always take into account the context, if not provide that in your feedback and decrease score."
-                        "The feedback should be constructive and actionable. "
-                        "The feedback should be specific and clear. "
-                        "The feedback should be encouraging and motivating. "
-                        "Never give examples as to how users' should response in your feedback. "
-                        f"Remember the score is out of 100 and the passing score is {lesson.threshold_score}, give a score"
-                        "above this only when you feel the user was almost perfect. Also your feedback should be"
-                        "no more than 20 words. Format your answer as: 'score: <score>, feedback: <feedback>'."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Context: {context_text}\n"
-                        f"Objective: {objective_text}\n"
-                        f"Evaluation Criteria: {evaluation_criteria}\n"
-                        f"User Response: {user_response}"
-                    )
-                }
-            ]
-
-            # Call the AI evaluator
-            ai_response = get_ai_response(prompt_messages, temperature=1.3)
-            logger.info(f"AI evaluation response: {ai_response}")
-
-            # Parse the AI response using a regex pattern.
-            # Expected format: "score: <score>, feedback: <feedback>"
-            pattern = r"score:\s*(?P<score>\d+(?:\.\d+)?),\s*feedback:\s*(?P<feedback>.+)"
-            match = re.search(pattern, ai_response, re.IGNORECASE)
-            if match:
-                score_str = match.group("score")
-                feedback = match.group("feedback").strip()
-                score = float(score_str)
+            # Serve an equivalent earlier answer from the cache, else call the AI evaluator
+            cached = cached_evaluation(lesson, user_response)
+            if cached:
+                score, feedback = cached
             else:
-                raise ValueError("Could not parse score or feedback from AI response.")
-
-            # Determine completion status.
-            # Lesson is completed if score >= lesson.threshold_score and time_taken < lesson.max_time.
-            completed = (score >= lesson.threshold_score) and (time_taken < lesson.max_time)
+                messages = build_evaluation_messages(lesson, user_response)
+                ai_response = get_ai_response(messages, temperature=1.3, response_format=JSON_MODE)
+                logger.info(f"AI evaluation response: {ai_response}")
+                score, feedback = parse_evaluation(ai_response)
+                remember_evaluation(lesson, user_response, messages, ai_response, score, feedback)
 
-            # Record the lesson progress.
-            LessonProgress.objects.create(
-                user=request.user,
-                lesson=lesson,
-                completed=completed,
-                score=score,
-                time_taken=time_taken,
-                feedback=feedback
-            )
-
-            # If the lesson is completed, unlock the next lesson (if any).
-            if completed:
-                next_lesson = (
-                    Lesson.objects
-                    .filter(subcategory=lesson.subcategory, order=lesson.order + 1)
-                    .first()
-                )
-                next_lesson_id = 0
-                if next_lesson:
-                    next_lesson_id = next_lesson.id
-                    ctype = ContentType.objects.get_for_model(next_lesson)
-                    access, created = UserContentAccess.objects.get_or_create(
-                        user=request.user,
-                        content_type=ctype,
-                        object_id=next_lesson.pk,
-                        defaults={'allowed': True}
-                    )
-                    if not created and not access.allowed:
-                        access.allowed = True
-                        access.save()
-                    logger.info(f"Next lesson unlocked: {next_lesson}")
+            # Record the lesson progress and unlock the next lesson (if any).
+            completed, next_lesson_id = record_attempt(request.user, lesson, score, feedback, time_taken)
 
             return Response({
                 "score": score,
@@ -507,6 +455,11 @@ class EvaluateLessonView(APIView):
                 "next_lesson_url": f"{CLIENT_URL}/training/lessondetail/{next_lesson_id}" if completed else None
             }, status=status.HTTP_200_OK)
 
+        except BulkheadFull:
+            raise LLMOverloaded()
+        except StructuredOutputError:
+            logger.exception("Unusable lesson evaluation.")
+            return Response({"error": UNUSABLE_EVALUATION_MESSAGE}, status=status.HTTP_502_BAD_GATEWAY)
         except Exception as e:
             logger.exception("Exception during lesson evaluation.")
             return Response(
@@ -515,7 +468,182 @@ class EvaluateLessonView(APIView):
             )
 
 
-class SubCategoryIntroView(APIView):
+class BatchEvaluateLessonView(LazyAuthenticationMixin, APIView):
+    """
+    API to evaluate several lesson attempts at once, e.g. a multi-lesson drill.
+    The client sends a list of items with lesson_id, user_response and
+    time_taken; each gets a result shaped like EvaluateLessonView's, in order.
+    Answers that need the AI evaluator are evaluated in parallel (up to
+    LESSON_BATCH_CONCURRENCY at a time) and all attempts are recorded at once.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Evaluate several lesson attempts",
+        operation_description=(
+            "Evaluates up to LESSON_BATCH_MAX_ITEMS lesson attempts like evaluate-lesson does and returns "
+            "one result per item, in order. An item whose evaluation failed gets an error instead and "
+            "no progress is recorded for it."
+        ),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=["items"],
+            properties={
+                "items": openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        required=["lesson_id", "user_response", "time_taken"],
+                        properties={
+                            "lesson_id": openapi.Schema(type=openapi.TYPE_INTEGER, description="ID of the lesson"),
+                            "user_response": openapi.Schema(type=openapi.TYPE_STRING, description="User's response (can be empty)"),
+                            "time_taken": openapi.Schema(type=openapi.TYPE_INTEGER, description="Time taken in seconds")
+                        }
+                    )
+                )
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description="Evaluation results, one per item",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "results": openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(
+                                type=openapi.TYPE_OBJECT,
+                                properties={
+                                    "score": openapi.Schema(type=openapi.TYPE_NUMBER, description="Score out of 100"),
+                                    "feedback": openapi.Schema(type=openapi.TYPE_STRING, description="Brief feedback (max 20 words)"),
+                                    "completed": openapi.Schema(type=openapi.TYPE_BOOLEAN, description="Lesson completion status"),
+                                    "next_lesson_url": openapi.Schema(type=openapi.TYPE_STRING, description="Next lesson, if completed"),
+                                    "error": openapi.Schema(type=openapi.TYPE_STRING, description="Set if the evaluation failed")
+                                }
+                            )
+                        )
+                    }
+                )
+            ),
+            400: "Bad Request",
+            404: "Lesson not found",
+            503: "AI evaluator overloaded"
+        }
+    )
+    def post(self, request):
+        items, error = self.parse_items(request)
+        if error:
+            return error
+        lessons = Lesson.objects.select_related("subcategory").in_bulk({lesson_id for lesson_id, _, _ in items})
+        missing = self.missing_lessons(items, lessons)
+        if missing:
+            return missing
+
+        try:
+            evaluations = [local_evaluation(lessons[lesson_id], *answer) for lesson_id, *answer in items]
+            pending = [index for index, evaluation in enumerate(evaluations) if evaluation is None]
+            outcomes = []
+            if pending:
+                with ThreadPoolExecutor(max_workers=min(settings.LESSON_BATCH_CONCURRENCY, len(pending))) as pool:
+                    futures = [
+                        pool.submit(self.evaluate, lessons[items[index][0]], items[index][1]) for index in pending
+                    ]
+                outcomes = [future.exception() or future.result() for future in futures]
+            errors = self.settle(pending, outcomes, evaluations)
+            return self.respond(request.user, items, lessons, evaluations, errors)
+        except BulkheadFull:
+            raise LLMOverloaded()
+
+    def parse_items(self, request):
+        """
+        Returns ([(lesson_id, user_response, time_taken)], None), or
+        (None, error response) for an invalid request.
+        """
+        items = request.data.get("items")
+        if not isinstance(items, list) or not items:
+            return None, Response({"error": "items must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.LESSON_BATCH_MAX_ITEMS:
+            return None, Response(
+                {"error": f"At most {settings.LESSON_BATCH_MAX_ITEMS} items per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        parsed = []
+        for item in items:
+            try:
+                user_response = item.get("user_response", "")
+                time_taken = item.get("time_taken")
+                if not isinstance(user_response, str):
+                    raise TypeError
+                # bool is an int subclass, but never a duration.
+                if isinstance(time_taken, bool) or not isinstance(time_taken, (int, float)):
+                    raise TypeError
+                parsed.append((int(item["lesson_id"]), user_response, time_taken))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                return None, Response(
+                    {"error": "Every item needs a lesson_id, a text user_response and a numeric time_taken"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        return parsed, None
+
+    def missing_lessons(self, items, lessons):
+        missing = sorted({lesson_id for lesson_id, _, _ in items} - set(lessons))
+        if missing:
+            return Response({"error": "Lessons not found", "lesson_ids": missing}, status=status.HTTP_404_NOT_FOUND)
+        return None
+
+    def evaluate(self, lesson, user_response):
+        messages = build_evaluation_messages(lesson, user_response)
+        ai_response = get_ai_response(messages, temperature=1.3, response_format=JSON_MODE)
+        logger.info(f"AI evaluation response: {ai_response}")
+        score, feedback = parse_evaluation(ai_response)
+        remember_evaluation(lesson, user_response, messages, ai_response, score, feedback)
+        return score, feedback
+
+    def settle(self, pending, outcomes, evaluations):
+        """
+        Fills in the AI evaluations (or exceptions) of the ``pending`` items.
+
+        Returns:
+            dict: Error message by item index.
+        """
+        errors = {}
+        for index, outcome in zip(pending, outcomes):
+            if isinstance(outcome, BulkheadFull):
+                # The evaluations made are cached, so the retry does not redo them.
+                raise outcome
+            if isinstance(outcome, BaseException):
+                logger.error("Exception during lesson evaluation.", exc_info=outcome)
+                if isinstance(outcome, StructuredOutputError):
+                    # The parse error quotes the evaluator's reply; it only goes to the log.
+                    errors[index] = UNUSABLE_EVALUATION_MESSAGE
+                else:
+                    errors[index] = str(outcome)
+            else:
+                evaluations[index] = (*outcome, None)
+        return errors
+
+    def respond(self, user, items, lessons, evaluations, errors):
+        recorded = [index for index in range(len(items)) if index not in errors]
+        with transaction.atomic():
+            attempts = record_attempts(user, [
+                (lessons[items[index][0]], *evaluations[index][:2], items[index][2], evaluations[index][2])
+                for index in recorded
+            ])
+        results = [None] * len(items)
+        for index, (completed, next_lesson_id) in zip(recorded, attempts):
+            score, feedback, _ = evaluations[index]
+            results[index] = {
+                "score": score,
+                "feedback": feedback,
+                "completed": completed,
+                "next_lesson_url": f"{CLIENT_URL}/training/lessondetail/{next_lesson_id}" if completed else None
+            }
+        for index, detail in errors.items():
+            results[index] = {"error": "An error occurred during evaluation", "detail": detail}
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class SubCategoryIntroView(LazyAuthenticationMixin, APIView):
     """
     API to return the subcategory intro content.
     This will be displayed as a reading lesson for users in the UI.
@@ -27,6 +27,123 @@ environ.Env.read_env(os.path.join(os.path.dirname(__file__), '../.env'))
 SUPABASE_URL = env("SUPABASE_URL", default="https://default.supabase.co")
 SUPABASE_ANON_KEY = env("SUPABASE_ANON_KEY", default="your-default-anon-key")
 SUPABASE_SERVICE_ROLE_KEY = env("SUPABASE_SERVICE_ROLE_KEY", default="your-default-service-role-key")
+
+# Local verification of Supabase access tokens. HS256 tokens are checked against
+# SUPABASE_JWT_SECRET; asymmetric tokens against the project's JWKS. Anything that
+# cannot be verified locally falls back to Supabase's /auth/v1/user endpoint.
+SUPABASE_JWT_VERIFY_LOCALLY = env.bool("SUPABASE_JWT_VERIFY_LOCALLY", default=True)
+SUPABASE_JWT_SECRET = env("SUPABASE_JWT_SECRET", default="")
+SUPABASE_JWT_AUDIENCE = env("SUPABASE_JWT_AUDIENCE", default="authenticated")
+# Expected "iss" claim, e.g. f"{SUPABASE_URL}/auth/v1"; empty skips the check.
+SUPABASE_JWT_ISSUER = env("SUPABASE_JWT_ISSUER", default="")
+SUPABASE_JWKS_URL = env("SUPABASE_JWKS_URL", default=f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json")
+SUPABASE_JWKS_CACHE_SECONDS = env.int("SUPABASE_JWKS_CACHE_SECONDS", default=600)
+SUPABASE_TOKEN_CACHE_SIZE = env.int("SUPABASE_TOKEN_CACHE_SIZE", default=4096)
+SUPABASE_TOKEN_CACHE_TTL = env.int("SUPABASE_TOKEN_CACHE_TTL", default=300)
+SUPABASE_NEGATIVE_CACHE_TTL = env.int("SUPABASE_NEGATIVE_CACHE_TTL", default=30)
+SUPABASE_JWT_LEEWAY_SECONDS = env.int("SUPABASE_JWT_LEEWAY_SECONDS", default=10)
+
+# Retries, deadline and circuit breaker for Supabase auth calls (see api.resilience)
+SUPABASE_AUTH_RETRY_ATTEMPTS = env.int("SUPABASE_AUTH_RETRY_ATTEMPTS", default=3)
+SUPABASE_AUTH_RETRY_BASE_DELAY = env.float("SUPABASE_AUTH_RETRY_BASE_DELAY", default=0.2)
+SUPABASE_AUTH_RETRY_MAX_DELAY = env.float("SUPABASE_AUTH_RETRY_MAX_DELAY", default=2.0)
+SUPABASE_AUTH_DEADLINE_SECONDS = env.float("SUPABASE_AUTH_DEADLINE_SECONDS", default=5.0)
+SUPABASE_AUTH_BREAKER_THRESHOLD = env.int("SUPABASE_AUTH_BREAKER_THRESHOLD", default=5)
+SUPABASE_AUTH_BREAKER_RESET_SECONDS = env.float("SUPABASE_AUTH_BREAKER_RESET_SECONDS", default=30.0)
+
+# Shared keep-alive HTTP pool for Supabase auth calls (see api.http_client)
+SUPABASE_HTTP_POOL_SIZE = env.int("SUPABASE_HTTP_POOL_SIZE", default=20)
+SUPABASE_HTTP_KEEPALIVE_SECONDS = env.float("SUPABASE_HTTP_KEEPALIVE_SECONDS", default=30.0)
+SUPABASE_HTTP_CONNECT_TIMEOUT = env.float("SUPABASE_HTTP_CONNECT_TIMEOUT", default=3.0)
+SUPABASE_HTTP_READ_TIMEOUT = env.float("SUPABASE_HTTP_READ_TIMEOUT", default=10.0)
+SUPABASE_HTTP2 = env.bool("SUPABASE_HTTP2", default=True)
+
+# LLM routing (see api.llm_router). AI_MODEL selects the primary provider; with
+# LLM_FALLBACK_MODEL set, the other provider (OpenAI or DeepSeek) is added.
+LLM_FALLBACK_MODEL = env.str("LLM_FALLBACK_MODEL", default="")
+LLM_EWMA_ALPHA = env.float("LLM_EWMA_ALPHA", default=0.2)
+# How much a provider's recent error rate inflates its latency score.
+LLM_ERROR_PENALTY = env.float("LLM_ERROR_PENALTY", default=10.0)
+# Send a second request to the runner-up once a call outlasts the p95 latency
+# of its provider (at least LLM_HEDGE_MIN_DELAY seconds).
+LLM_HEDGING = env.bool("LLM_HEDGING", default=False)
+LLM_HEDGE_MIN_DELAY = env.float("LLM_HEDGE_MIN_DELAY", default=0.5)
+LLM_HEDGE_THREADS = env.int("LLM_HEDGE_THREADS", default=32)
+# Bulkhead around AI provider calls (see api.utils.llm_bulkhead): calls beyond
+# LLM_MAX_CONCURRENCY wait in a queue of LLM_MAX_QUEUE for at most
+# LLM_QUEUE_TIMEOUT seconds, and are shed with a 503 beyond that.
+LLM_MAX_CONCURRENCY = env.int("LLM_MAX_CONCURRENCY", default=16)
+LLM_MAX_QUEUE = env.int("LLM_MAX_QUEUE", default=16)
+LLM_QUEUE_TIMEOUT = env.float("LLM_QUEUE_TIMEOUT", default=2.0)
+# Background AI calls (turn scoring, context summaries, opener refills) go
+# through their own, smaller bulkhead (api.utils.llm_background_bulkhead), so
+# they never take the slots of live requests.
+LLM_BACKGROUND_MAX_CONCURRENCY = env.int("LLM_BACKGROUND_MAX_CONCURRENCY", default=4)
+LLM_BACKGROUND_MAX_QUEUE = env.int("LLM_BACKGROUND_MAX_QUEUE", default=8)
+LLM_BACKGROUND_QUEUE_TIMEOUT = env.float("LLM_BACKGROUND_QUEUE_TIMEOUT", default=5.0)
+# Identical concurrent AI requests share one provider call (see api.singleflight);
+# with SINGLEFLIGHT_SHARED also across processes, through the shared cache. The
+# result seconds only need to cover the waiting processes' poll interval.
+SINGLEFLIGHT_SHARED = env.bool("SINGLEFLIGHT_SHARED", default=False)
+SINGLEFLIGHT_LOCK_SECONDS = env.float("SINGLEFLIGHT_LOCK_SECONDS", default=60.0)
+SINGLEFLIGHT_RESULT_SECONDS = env.float("SINGLEFLIGHT_RESULT_SECONDS", default=10.0)
+
+# Readiness probe (api/ready/): dependency checks are refreshed in the background
+READINESS_CACHE_SECONDS = env.float("READINESS_CACHE_SECONDS", default=5.0)
+READINESS_CHECK_TIMEOUT = env.float("READINESS_CHECK_TIMEOUT", default=2.0)
+
+# Report generation queue worked by `manage.py run_report_worker` (see api.report_jobs)
+REPORT_WORKER_CONCURRENCY = env.int("REPORT_WORKER_CONCURRENCY", default=4)
+REPORT_WORKER_POLL_SECONDS = env.float("REPORT_WORKER_POLL_SECONDS", default=1.0)
+REPORT_JOB_MAX_ATTEMPTS = env.int("REPORT_JOB_MAX_ATTEMPTS", default=3)
+REPORT_JOB_RETRY_BASE_DELAY = env.float("REPORT_JOB_RETRY_BASE_DELAY", default=5.0)
+REPORT_JOB_RETRY_MAX_DELAY = env.float("REPORT_JOB_RETRY_MAX_DELAY", default=60.0)
+# Queue the report as soon as a chat ends instead of on the first generate-report call.
+SPECULATIVE_REPORTS = env.bool("SPECULATIVE_REPORTS", default=True)
+# Upper bound for generate-report's ?wait=<seconds> on an in-flight job.
+REPORT_MAX_WAIT_SECONDS = env.float("REPORT_MAX_WAIT_SECONDS", default=10.0)
+# A running job not finished within this time is assumed lost and claimed again.
+REPORT_JOB_LEASE_SECONDS = env.float("REPORT_JOB_LEASE_SECONDS", default=300.0)
+
+# Token budget of the chat context sent to the AI provider. Once the turns since
+# the last summary exceed the trigger, older ones are compacted into a rolling
+# summary in the background (see api.context_summary).
+CHAT_CONTEXT_TOKENS = env.int("CHAT_CONTEXT_TOKENS", default=3000)
+CHAT_SUMMARY_TRIGGER_TOKENS = env.int("CHAT_SUMMARY_TRIGGER_TOKENS", default=1500)
+# Write-through cache of active chat sessions' context (see api.conversation_cache)
+CONVERSATION_CACHE_SIZE = env.int("CONVERSATION_CACHE_SIZE", default=1024)
+CONVERSATION_CACHE_TTL = env.int("CONVERSATION_CACHE_TTL", default=1800)
+
+# Opening lines kept ready per bot and scenario, so creating a chat session does
+# not wait on the AI provider (see api.openers). 0 disables the pool.
+OPENER_POOL_DEPTH = env.int("OPENER_POOL_DEPTH", default=5)
+
+# In-process cache of lesson evaluations by lesson, lesson content and normalised
+# response (see course_content.evaluation)
+LESSON_EVALUATION_CACHE_SIZE = env.int("LESSON_EVALUATION_CACHE_SIZE", default=4096)
+LESSON_EVALUATION_CACHE_TTL = env.int("LESSON_EVALUATION_CACHE_TTL", default=86400)
+
+# Rules that fail hopeless lesson answers without calling the AI evaluator, in
+# order (see course_content.prescoring); empty disables pre-scoring
+LESSON_PRESCORING_RULES = env.list(
+    "LESSON_PRESCORING_RULES", default=["too_slow", "gibberish", "repeated_word", "copied_context"]
+)
+
+# Batch lesson evaluation: most answers per request, and AI evaluator calls made
+# in parallel for one request
+LESSON_BATCH_MAX_ITEMS = env.int("LESSON_BATCH_MAX_ITEMS", default=20)
+LESSON_BATCH_CONCURRENCY = env.int("LESSON_BATCH_CONCURRENCY", default=4)
+
+# Score each user turn in the background as it is saved, so the final report is
+# an aggregation plus a short summary call (see api.turn_scoring)
+INCREMENTAL_SCORING = env.bool("INCREMENTAL_SCORING", default=True)
+# Threads for in-process fire-and-forget work (see api.background)
+BACKGROUND_WORKERS = env.int("BACKGROUND_WORKERS", default=4)
+
+# Route the AI-bound endpoints to their async views (api.async_views); only
+# useful when serving socialflow_django.asgi with an ASGI server such as uvicorn.
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+
 SCENARIOS_FILE_PATH = env("SCENARIOS_FILE_PATH")
 
 # Read other settings
@@ -130,6 +247,16 @@ DATABASES = {
 
 CORS_ALLOW_ALL_ORIGINS = True  # Allow CORS requests
 
+# Shared cache used across worker processes, e.g. CACHE_URL=rediscache://127.0.0.1:6379/1
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Email -> api.User resolution on the authentication path (see api.user_resolver)
+USER_RESOLVER_LOCAL_SIZE = env.int("USER_RESOLVER_LOCAL_SIZE", default=2048)
+USER_RESOLVER_LOCAL_TTL = env.int("USER_RESOLVER_LOCAL_TTL", default=60)
+USER_RESOLVER_SHARED_TTL = env.int("USER_RESOLVER_SHARED_TTL", default=3600)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -184,6 +311,14 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 
+# Token bucket rates per view throttle_scope, '<requests>/<period>' (see api.throttling)
+RATE_LIMITS = {
+    "auth_login": env("RATE_LIMIT_AUTH_LOGIN", default="10/min"),
+    "auth_register": env("RATE_LIMIT_AUTH_REGISTER", default="5/min"),
+    "auth_guest": env("RATE_LIMIT_AUTH_GUEST", default="5/min"),
+    "chat_message": env("RATE_LIMIT_CHAT_MESSAGE", default="20/min"),
+}
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "api.supabase_auth.SupabaseAuthentication",  # This line caused the error before
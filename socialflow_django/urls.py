@@ -16,10 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from .views import LogFileView
+from .views import LogFileView, MetricsView
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path('logs/', LogFileView.as_view(), name='log-file'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 
 ]
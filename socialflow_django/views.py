@@ -1,7 +1,7 @@
 # views.py
 import os
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAdminUser
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
@@ -9,6 +9,8 @@ from rest_framework.authentication import SessionAuthentication, BasicAuthentica
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+from api import metrics
+
 class LogFileView(APIView):
     # Override the default authentication to use session and basic auth.
     authentication_classes = [SessionAuthentication, BasicAuthentication]
@@ -32,4 +34,17 @@ class LogFileView(APIView):
         with open(log_file_path, 'r') as f:
             log_content = f.read()
         
-        return HttpResponse(log_content, content_type="text/plain")
\ No newline at end of file
+        return HttpResponse(log_content, content_type="text/plain")
+
+
+class MetricsView(APIView):
+    authentication_classes = [SessionAuthentication, BasicAuthentication]
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="View Process Metrics",
+        operation_description="Returns the counters, gauges and timings collected by this worker process. Accessible only to admin users.",
+        responses={200: "Metrics snapshot"}
+    )
+    def get(self, request):
+        return JsonResponse(metrics.snapshot())